@@ -0,0 +1,178 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Time the search index backends on a synthetic corpus.
+
+Usage:
+  python devtools/benchmark_search.py [--entries N] [--per-page P]
+                                      [--backend sqlite|postgresql|memory]
+                                      [--database URL]
+
+Documents are made of words drawn with a Zipf-like distribution, so some
+words are in most documents and most words in few.  The time to index
+all of them, then to count and rank matches for common, middling and
+rare words (and pairs of them) is printed, along with the time of the
+LIKE scan a search without an index would be.
+"""
+
+from __future__ import print_function
+
+import argparse
+import bisect
+import os
+import random
+import tempfile
+import time
+
+from sqlalchemy import create_engine, text
+
+from mediagoblin.search.index import MemorySearchIndex, \
+    PostgreSQLSearchIndex, SQLiteSearchIndex, SEARCH_FIELDS
+
+BACKENDS = {
+    'sqlite': SQLiteSearchIndex,
+    'postgresql': PostgreSQLSearchIndex,
+    'memory': MemorySearchIndex,
+}
+VOCABULARY_SIZE = 50000
+BATCH_SIZE = 5000
+
+
+def make_word_sampler(seed=0):
+    """
+    Function returning count random words, word i being drawn about
+    1 / (i + 1) times as often as the first
+    """
+    cumulative = []
+    total = 0.
+    for rank in range(VOCABULARY_SIZE):
+        total += 1. / (rank + 1)
+        cumulative.append(total)
+    rng = random.Random(seed)
+
+    def sample(count):
+        return u' '.join(
+            u'w{0}'.format(bisect.bisect(cumulative, rng.random() * total))
+            for i in range(count))
+    return sample
+
+
+def documents(entries, sample):
+    lengths = {'title': 4, 'tags': 3, 'description': 30, 'comments': 20}
+    for media_id in range(1, entries + 1):
+        yield media_id, dict(
+            (field, sample(lengths[field])) for field in SEARCH_FIELDS)
+
+
+def timed(function, *args):
+    start = time.time()
+    result = function(*args)
+    return result, time.time() - start
+
+
+def build(index, connection, entries, sample, scan_table):
+    batch = {}
+    for media_id, document in documents(entries, sample):
+        batch[media_id] = document
+        if len(batch) == BATCH_SIZE:
+            write_batch(index, connection, batch, scan_table)
+            batch = {}
+    if batch:
+        write_batch(index, connection, batch, scan_table)
+
+
+def write_batch(index, connection, batch, scan_table):
+    with connection.begin():
+        index.update(connection, batch)
+        if scan_table:
+            connection.execute(text(
+                "INSERT INTO benchmark_scan (id, body) VALUES (:id, :body)"),
+                [{'id': media_id,
+                  'body': u' '.join(document[field]
+                                    for field in SEARCH_FIELDS)}
+                 for media_id, document in batch.items()])
+
+
+def like_scan(connection, terms, per_page):
+    criteria = ' AND '.join(
+        "body LIKE :term{0}".format(i) for i in range(len(terms)))
+    params = dict(('term{0}'.format(i), u'% {0} %'.format(term))
+                  for i, term in enumerate(terms))
+    return connection.execute(text(
+        "SELECT id FROM benchmark_scan WHERE {0} ORDER BY id DESC "
+        "LIMIT {1}".format(criteria, per_page)), **params).fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--entries', type=int, default=1000000)
+    parser.add_argument('--per-page', type=int, default=30)
+    parser.add_argument('--backend', choices=sorted(BACKENDS),
+                        default='sqlite')
+    parser.add_argument('--database',
+                        help='SQLAlchemy URL (default: a temporary SQLite '
+                             'file); tables are created in it')
+    args = parser.parse_args()
+
+    database = args.database
+    tmp_path = None
+    if database is None:
+        fd, tmp_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        database = 'sqlite:///' + tmp_path
+    engine = create_engine(database)
+    connection = engine.connect()
+    scan_table = engine.dialect.name == 'sqlite'
+    if scan_table:
+        connection.execute(text(
+            "CREATE TABLE benchmark_scan (id integer PRIMARY KEY, body text)"))
+
+    index = BACKENDS[args.backend]()
+    print('Indexing {0} synthetic entries with {1}'.format(
+        args.entries, type(index).__name__))
+    dummy, build_time = timed(
+        build, index, connection, args.entries, make_word_sampler(),
+        scan_table)
+    print('indexed in {0:.1f}s ({1:.0f} entries/s)'.format(
+        build_time, args.entries / max(build_time, 1e-9)))
+
+    searches = [['w0'], ['w50'], ['w5000'], ['w49999'],
+                ['w0', 'w1'], ['w50', 'w500'], ['w5000', 'w10']]
+    for terms in searches:
+        count, count_time = timed(index.count, connection, terms)
+        dummy, first_time = timed(
+            index.search, connection, terms, args.per_page)
+        dummy, last_time = timed(
+            index.search, connection, terms, args.per_page,
+            max(count - args.per_page, 0))
+        line = ('{0:<12} {1:>8} matches  count {2:7.1f}ms  '
+                'first page {3:7.1f}ms  last page {4:7.1f}ms').format(
+                    ' '.join(terms), count, count_time * 1000,
+                    first_time * 1000, last_time * 1000)
+        if scan_table:
+            dummy, scan_time = timed(
+                like_scan, connection, terms, args.per_page)
+            line += '  LIKE scan {0:7.1f}ms'.format(scan_time * 1000)
+        print(line)
+
+    connection.close()
+    if tmp_path is not None:
+        os.remove(tmp_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Compare the per-column spectrogram renderer with the batched one.
+
+Usage:
+  python devtools/benchmark_spectrogram.py [--seconds N] [--width W]
+                                           [--fft-size F] [audio file]
+
+Without an audio file (which needs scikits.audiolab) a synthetic signal
+of --seconds length is rendered.
+"""
+
+from __future__ import print_function
+
+import argparse
+import time
+
+import numpy
+
+from mediagoblin.media_types.audio import audioprocessing
+
+
+class SyntheticSndfile(object):
+    """Stands in for audiolab.Sndfile, serving a generated signal"""
+    samplerate = 44100
+    channels = 1
+    samples = None
+
+    def __init__(self, *args, **kwargs):
+        self.nframes = len(self.samples)
+        self.seekpoint = 0
+
+    def seek(self, seekpoint):
+        self.seekpoint = int(seekpoint)
+
+    def read_frames(self, frames_to_read):
+        frames = self.samples[self.seekpoint:self.seekpoint + frames_to_read]
+        self.seekpoint += len(frames)
+        return frames.copy()
+
+    def close(self):
+        pass
+
+
+def render_per_column(filename, width, height, fft_size):
+    processor = audioprocessing.AudioProcessor(
+        filename, fft_size, numpy.hanning)
+    samples_per_pixel = processor.audio_file.nframes / float(width)
+    spectrogram = audioprocessing.SpectrogramImage(width, height, fft_size)
+
+    for x in range(width):
+        seek_point = int(x * samples_per_pixel)
+        (spectral_centroid, db_spectrum) = processor.spectral_centroid(
+            seek_point)
+        spectrogram.draw_spectrum(x, db_spectrum)
+
+    spectrogram.image.putdata(spectrogram.pixels)
+    return numpy.asarray(
+        spectrogram.image.transpose(audioprocessing.Image.ROTATE_90))
+
+
+def render_batched(filename, width, height, fft_size):
+    audio_file = audioprocessing.audiolab.Sndfile(filename, 'r')
+    nframes = audio_file.nframes
+    audio_file.close()
+
+    spectra = audioprocessing.compute_spectra(
+        filename, audioprocessing.get_seek_points(nframes, width),
+        fft_size, numpy.hanning)
+    spectrogram = audioprocessing.SpectrogramImage(width, height, fft_size)
+    spectrogram.draw_spectra(spectra)
+    return numpy.asarray(spectrogram.image)
+
+
+def timed(function, *args):
+    start = time.time()
+    result = function(*args)
+    return result, time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('filename', nargs='?')
+    parser.add_argument('--seconds', type=int, default=600)
+    parser.add_argument('--width', type=int, default=640)
+    parser.add_argument('--fft-size', type=int, default=4096)
+    args = parser.parse_args()
+
+    filename = args.filename
+    if filename is None:
+        nframes = args.seconds * SyntheticSndfile.samplerate
+        time_axis = numpy.arange(nframes) / float(SyntheticSndfile.samplerate)
+        SyntheticSndfile.samples = 0.5 * numpy.sin(
+            2 * numpy.pi * (200 + 50 * time_axis) * time_axis) \
+            + 0.05 * numpy.random.RandomState(0).randn(nframes)
+        audioprocessing.audiolab.Sndfile = SyntheticSndfile
+        filename = '<synthetic %ds>' % args.seconds
+
+    height = int(args.width * 0.3)
+    print('Rendering {0} at {1}x{2}, fft size {3}'.format(
+        filename, args.width, height, args.fft_size))
+
+    old, old_time = timed(
+        render_per_column, filename, args.width, height, args.fft_size)
+    new, new_time = timed(
+        render_batched, filename, args.width, height, args.fft_size)
+
+    difference = numpy.abs(old.astype(int) - new.astype(int))
+    print('per-column: {0:.2f}s'.format(old_time))
+    print('batched:    {0:.2f}s ({1:.1f}x)'.format(
+        new_time, old_time / max(new_time, 1e-9)))
+    print('max pixel difference: {0}, differing pixels: {1:.4%}'.format(
+        difference.max(), (difference.max(axis=2) > 0).mean()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Compare transcoding a video once per resolution with the single pass mode.
+
+Usage:
+  python devtools/benchmark_video_transcoding.py [--resolutions R [R ...]]
+                                                 [--vp8-threads N] video
+
+Both modes run in this process, one after the other; CPU time includes
+the GStreamer threads.  The fan-out mode is what one celery worker does
+with the tasks of the video's resolutions.
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import resource
+import shutil
+import tempfile
+import time
+
+from mediagoblin.media_types.video import transcoders
+from mediagoblin.media_types.video.util import ACCEPTED_RESOLUTIONS
+
+
+def cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def transcode_fan_out(src, destinations, vp8_threads):
+    results = {}
+    for resolution, dimensions, path in destinations:
+        transcoder = transcoders.VideoTranscoder()
+        transcoder.transcode(src, path, destinations[0][0], len(destinations),
+                             vp8_threads=vp8_threads, dimensions=dimensions)
+        results[resolution] = transcoder.dst_data
+    return results
+
+
+def transcode_single_pass(src, destinations, vp8_threads):
+    transcoder = transcoders.MultiResolutionTranscoder()
+    transcoder.transcode(src, destinations, destinations[0][0],
+                         len(destinations), vp8_threads=vp8_threads)
+    return transcoder.dst_data
+
+
+def timed(function, *args):
+    start_time, start_cpu = time.time(), cpu_time()
+    result = function(*args)
+    return result, time.time() - start_time, cpu_time() - start_cpu
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('filename')
+    parser.add_argument('--resolutions', nargs='+',
+                        default=['480p', '360p', '720p'],
+                        choices=sorted(ACCEPTED_RESOLUTIONS))
+    parser.add_argument('--vp8-threads', type=int, default=0)
+    args = parser.parse_args()
+
+    src = os.path.abspath(args.filename)
+    workdir = tempfile.mkdtemp()
+    try:
+        results = []
+        for mode, transcode in (('fan-out', transcode_fan_out),
+                                ('single pass', transcode_single_pass)):
+            destinations = [
+                (resolution, ACCEPTED_RESOLUTIONS[resolution],
+                 os.path.join(workdir, '{0}.{1}.webm'.format(
+                     mode.replace(' ', '_'), resolution)))
+                for resolution in args.resolutions]
+            dst_data, wall, cpu = timed(
+                transcode, src, destinations, args.vp8_threads)
+            failed = [resolution for resolution in args.resolutions
+                      if not dst_data.get(resolution)]
+            results.append((mode, wall, cpu, failed))
+
+        print('Transcoding {0} to {1}'.format(
+            args.filename, ', '.join(args.resolutions)))
+        for mode, wall, cpu, failed in results:
+            print('{0:<12} {1:8.2f}s wall {2:8.2f}s cpu{3}'.format(
+                mode + ':', wall, cpu,
+                '  FAILED: ' + ', '.join(failed) if failed else ''))
+        print('single pass speedup: {0:.2f}x wall, {1:.2f}x cpu'.format(
+            results[0][1] / max(results[1][1], 1e-9),
+            results[0][2] / max(results[1][2], 1e-9)))
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -190,7 +190,7 @@ class AudioProcessor(object):
 
         if resize_if_less and (add_to_start > 0 or add_to_end > 0):
             if add_to_start > 0:
-                samples = numpy.concatenate((numpy.zeros(add_to_start), samples), axis=1)
+                samples = numpy.concatenate((numpy.zeros(add_to_start), samples))
 
             if add_to_end > 0:
                 samples = numpy.resize(samples, size)
@@ -202,7 +202,7 @@ class AudioProcessor(object):
     def spectral_centroid(self, seek_point, spec_range=110.0):
         """ starting at seek_point read fft_size samples, and calculate the spectral centroid """
 
-        samples = self.read(seek_point - self.fft_size/2, self.fft_size, True)
+        samples = self.read(seek_point - self.fft_size // 2, self.fft_size, True)
 
         samples *= self.window
         fft = numpy.fft.rfft(samples)
@@ -218,7 +218,7 @@ class AudioProcessor(object):
         if energy > 1e-60:
             # calculate the spectral centroid
 
-            if self.spectrum_range == None:
+            if self.spectrum_range is None:
                 self.spectrum_range = numpy.arange(length)
 
             spectral_centroid = (spectrum * self.spectrum_range).sum() / (energy * (length - 1)) * self.audio_file.samplerate * 0.5
@@ -276,6 +276,97 @@ class AudioProcessor(object):
         return (min_value, max_value) if min_index < max_index else (max_value, min_value)
 
 
+def get_seek_points(nframes, image_width):
+    """ the sample each pixel column of an image_width wide image is centered
+    on, the same way the per-column drawing loops compute them """
+    samples_per_pixel = nframes / float(image_width)
+    return (numpy.arange(image_width) * samples_per_pixel).astype(numpy.int64)
+
+
+def compute_spectra(input_filename, seek_points, fft_size,
+                    window_function=numpy.hanning, spec_range=110.0,
+                    block_size=262144, progress_callback=None):
+    """ calculate the db spectrum of fft_size samples centered around each of
+    the (ascending) seek_points in a single sequential pass over the file.
+
+    This gives the same spectra as calling AudioProcessor.spectral_centroid
+    for every seek point, but reads the audio in large blocks instead of
+    seeking for every column (and again in get_max_level), and does all FFTs
+    of a block as one 2-D FFT. Returns an array of shape
+    (len(seek_points), fft_size/2 + 1) with values between 0 and 1. """
+
+    audio_file = audiolab.Sndfile(input_filename, 'r')
+    window = window_function(fft_size)
+    half = fft_size // 2
+    starts = numpy.asarray(seek_points, dtype=numpy.int64) - half
+    offsets = numpy.arange(fft_size)
+    spectra = numpy.zeros((len(starts), fft_size // 2 + 1))
+
+    # buffer of samples starting at buffer_start; windows starting before
+    # the first sample are zero padded, like AudioProcessor.read does
+    buffer_start = min(0, int(starts[0])) if len(starts) else 0
+    buffer = numpy.zeros(-buffer_start)
+    max_level = 0
+    done = 0
+    n_samples_left = audio_file.nframes
+
+    while done < len(starts):
+        if n_samples_left > 0:
+            to_read = min(block_size, n_samples_left)
+            try:
+                samples = audio_file.read_frames(to_read)
+            except RuntimeError:
+                # this can happen with a broken header, treat as silence
+                n_samples_left = 0
+                samples = numpy.zeros(0)
+            else:
+                n_samples_left -= to_read
+            samples = numpy.asarray(samples, dtype=numpy.float64)
+
+            # convert to mono by selecting left channel only
+            if samples.ndim > 1:
+                samples = samples[:, 0]
+            if len(samples):
+                max_level = max(max_level, numpy.abs(samples).max())
+        else:
+            # past the end of the file: pad the last windows with zeros
+            samples = numpy.zeros(fft_size)
+
+        buffer = numpy.concatenate((buffer, samples))
+        buffer_end = buffer_start + len(buffer)
+
+        # all windows which are completely inside the buffer
+        ready = done + numpy.searchsorted(
+            starts[done:] + fft_size, buffer_end, side='right')
+        if ready > done:
+            frames = buffer[starts[done:ready, numpy.newaxis]
+                            - buffer_start + offsets]
+            spectra[done:ready] = numpy.abs(
+                numpy.fft.rfft(frames * window, axis=1))
+            done = ready
+
+            if progress_callback:
+                progress_callback((done * 100) / len(starts))
+
+        # drop the samples no remaining window needs
+        keep_from = int(starts[done]) if done < len(starts) else buffer_end
+        keep_from = min(max(keep_from, buffer_start), buffer_end)
+        buffer = buffer[keep_from - buffer_start:]
+        buffer_start = keep_from
+
+    audio_file.close()
+
+    # figure out what the maximum value is for an FFT doing the FFT of a DC signal
+    max_fft = numpy.abs(numpy.fft.rfft(numpy.ones(fft_size) * window)).max()
+    # set the scale to normalized audio and normalized FFT
+    scale = 1.0 / max_level / max_fft if max_level > 0 else 1
+    spectra *= scale
+
+    # scale the db spectrum from [- spec_range db ... 0 db] > [0..1]
+    return ((20 * numpy.log10(spectra + 1e-60)).clip(-spec_range, 0.0)
+            + spec_range) / spec_range
+
+
 def interpolate_colors(colors, flat=False, num_colors=256):
     """ given a list of colors, create a larger list of colors interpolating
     the first one. If flatten is True a list of numers will be returned. If
@@ -463,6 +554,15 @@ class SpectrogramImage(object):
         # so we store all the pixels in an array and then create the image when saving
         self.pixels = []
 
+        # the same lookup as arrays, to draw all columns at once in draw_spectra
+        self.bin_indexes = numpy.array(
+            [index for (index, alpha) in self.y_to_bin], dtype=numpy.intp)
+        self.bin_alphas = numpy.array(
+            [alpha for (index, alpha) in self.y_to_bin], dtype=numpy.float64)
+        # RGBA palette, putdata() makes RGB colors opaque
+        self.palette_array = numpy.array(
+            [color + (255,) for color in self.palette], dtype=numpy.uint8)
+
     def draw_spectrum(self, x, spectrum):
         # for all frequencies, draw the pixels
         for (index, alpha) in self.y_to_bin:
@@ -472,10 +572,27 @@ class SpectrogramImage(object):
         for y in range(len(self.y_to_bin), self.image_height): #@UnusedVariable
             self.pixels.append(self.palette[0])
 
+    def draw_spectra(self, spectra):
+        """ draw all columns at once from an array of db spectra of shape
+        (image_width, fft_size/2 + 1), such as returned by compute_spectra """
+        values = ((255.0 - self.bin_alphas) * spectra[:, self.bin_indexes]
+                  + self.bin_alphas * spectra[:, self.bin_indexes + 1])
+
+        color_indexes = numpy.zeros(
+            (self.image_width, self.image_height), dtype=numpy.intp)
+        color_indexes[:, :len(self.y_to_bin)] = values.astype(numpy.intp)
+
+        # low frequencies at the bottom, time from left to right
+        pixels = self.palette_array[color_indexes.T[::-1]]
+        self.image = Image.fromarray(numpy.ascontiguousarray(pixels), 'RGBA')
+
     def save(self, filename, quality=80):
         assert filename.lower().endswith(".jpg")
-        self.image.putdata(self.pixels)
-        self.image.transpose(Image.ROTATE_90).save(filename, quality=quality)
+        if self.pixels:
+            self.image.putdata(self.pixels)
+            self.image = self.image.transpose(Image.ROTATE_90)
+        # JPEG has no alpha channel
+        self.image.convert('RGB').save(filename, quality=quality)
 
 
 def create_wave_images(input_filename, output_filename_w, output_filename_s, image_width, image_height, fft_size, progress_callback=None):
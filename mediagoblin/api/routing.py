@@ -117,6 +117,14 @@ add_route(
     match_slash=False
 )
 
+# Search
+add_route(
+    "mediagoblin.api.search",
+    "/api/search/",
+    "mediagoblin.api.views:search_endpoint",
+    match_slash=False
+)
+
 add_route(
     "mediagoblin.webfinger.well-known.host-meta",
     "/.well-known/host-meta",
@@ -14,6 +14,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import datetime
 import json
 import io
 import mimetypes
@@ -28,6 +29,7 @@ from mediagoblin.tools.routing import extract_url_arguments
 from mediagoblin.tools.response import redirect, json_response, json_error, \
                                        render_404, render_to_response
 from mediagoblin.meddleware.csrf import csrf_exempt
+from mediagoblin.search.lib import get_search_index, SearchResults
 from mediagoblin.submit.lib import new_upload_entry, api_upload_request, \
                                     api_add_to_feed
 
@@ -199,7 +201,9 @@ def inbox_endpoint(request, inbox=None):
         "totalItems": total_items,
     }
 
-    for activity in inbox:
+    activities = Activity.for_listing(inbox).all()
+    Activity.load_objects(activities)
+    for activity in activities:
         try:
             feed["items"].append(activity.serialize(request))
         except AttributeError:
@@ -334,7 +338,7 @@ def feed_endpoint(request, outbox=None):
                 if "location" in data:
                     Location.create(data["location"], self)
 
-                media.save()
+                media.save(set_updated=True)
                 activity = api_add_to_feed(request, media)
 
                 return json_response(activity.serialize(request))
@@ -404,6 +408,7 @@ def feed_endpoint(request, outbox=None):
                         "Invalid 'comment' with id '{0}'".format(obj["id"])
                     )
 
+                comment.updated = datetime.datetime.utcnow()
                 comment.save()
 
                 # Create an update activity
@@ -439,7 +444,7 @@ def feed_endpoint(request, outbox=None):
                         "Invalid 'image' with id '{0}'".format(obj_id)
                     )
                 image.generate_slug()
-                image.save()
+                image.save(set_updated=True)
 
                 # Create an update activity
                 generator = create_generator(request)
@@ -603,7 +608,9 @@ def feed_endpoint(request, outbox=None):
     outbox = outbox.offset(offset)
 
     # Build feed.
-    for activity in outbox:
+    activities = Activity.for_listing(outbox).all()
+    Activity.load_objects(activities)
+    for activity in activities:
         try:
             feed["items"].append(activity.serialize(request))
         except AttributeError:
@@ -709,6 +716,37 @@ def object_comments(request):
     }
     return json_response(comments)
 
+@oauth_required
+def search_endpoint(request):
+    """ Media matching the words of the "q" parameter, best match first """
+    index = get_search_index()
+    if index is None:
+        return json_error("Search is disabled on this site.", 404)
+
+    query = request.args.get("q", "").strip()
+    if not query:
+        return json_error("Missing search query 'q'.")
+
+    # Limit by the "count" (default: 20, at most 200 like the feeds)
+    try:
+        limit = min(int(request.args.get("count", 20)), 200)
+        offset = max(int(request.args.get("offset", 0)), 0)
+    except ValueError:
+        return json_error("Invalid 'count' or 'offset'.")
+
+    results = SearchResults(query, index)
+    items = [media.serialize(request, show_comments=False)
+             for media in results.slice(offset, offset + limit)]
+    feed = {
+        "displayName": "Search results for {0}".format(query),
+        "objectTypes": sorted(set(item["objectType"] for item in items)),
+        "url": request.base_url,
+        "links": {"self": {"href": request.url}},
+        "totalItems": results.count(),
+        "items": items,
+    }
+    return json_response(feed)
+
 ##
 # RFC6415 - Web Host Metadata
 ##
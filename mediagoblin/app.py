@@ -36,11 +36,13 @@ from mediagoblin.media_types.tools import media_type_warning
 from mediagoblin.mg_globals import setup_globals
 from mediagoblin.init.celery import setup_celery_from_config
 from mediagoblin.init.plugins import setup_plugins
-from mediagoblin.init import (get_jinja_loader, get_staticdirector,
+from mediagoblin.init import (get_jinja_loader, get_jinja_bytecode_cache,
+    get_staticdirector,
     setup_global_and_app_config, setup_locales, setup_workbench, setup_database,
     setup_storage)
 from mediagoblin.tools.pluginapi import PluginManager, hook_transform
 from mediagoblin.tools.crypto import setup_crypto
+from mediagoblin.search.lib import setup_search_index
 from mediagoblin.auth.tools import check_auth_enabled, no_auth_logout
 
 from mediagoblin.tools.transition import DISABLE_GLOBALS
@@ -96,7 +98,8 @@ class MediaGoblinApp(object):
         ##########################################
 
         # Setup Session Manager, not needed in celery
-        self.session_manager = session.SessionManager()
+        self.session_manager = session.SessionManager(
+            store=session.get_session_store(self.app_config))
 
         # load all available locales
         setup_locales()
@@ -112,6 +115,9 @@ class MediaGoblinApp(object):
         else:
             self.db = setup_database(self)
 
+        # The search index is created for this app's database on first use
+        setup_search_index()
+
         # Quit app if need to run dbupdate
         ## NOTE: This is currently commented out due to session errors..
         ##  We'd like to re-enable!
@@ -126,6 +132,14 @@ class MediaGoblinApp(object):
             self.current_theme,
             PluginManager().get_template_paths()
             )
+        jinja2_config = self.global_config.get('jinja2', {})
+        self.template_bytecode_cache = get_jinja_bytecode_cache(
+            jinja2_config.get('bytecode_cache_dir'),
+            self.app_config.get('local_templates'),
+            self.current_theme,
+            PluginManager().get_template_paths(),
+            PluginManager().template_hooks,
+            jinja2_config.get('extensions'))
 
         # Check if authentication plugin is enabled and respond accordingly.
         self.auth = check_auth_enabled()
@@ -123,11 +123,13 @@ class GMGTableBase(object):
                 )
                 notifications.delete()
                 
-                # Delete this as a comment
+                # Delete this as a comment, through the session so
+                # listeners (like the search index's) see the links go
                 comments = Comment.query.filter_by(
                     comment_id=gmr.id
                 )
-                comments.delete()
+                for comment in comments:
+                    comment.hard_delete(commit=False)
 
                 # Set None on reports found
                 reports = Report.query.filter_by(
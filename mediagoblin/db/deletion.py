@@ -0,0 +1,189 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Deleting many media entries at once, like all of a user's, with the
+same few queries for each batch of entries instead of many queries for
+each entry.
+"""
+
+import logging
+
+from sqlalchemy import inspect
+
+from mediagoblin.db.base import Base, Session
+from mediagoblin.db.models import MediaEntry, MediaFile, \
+    MediaAttachmentFile, MediaSubtitleFile, GenericModelReference, \
+    CollectionItem, Notification, Comment, Report, Graveyard, User, MediaTag
+from mediagoblin.db.util import clean_orphan_tags
+from mediagoblin.search.lib import remove_from_search_index
+from mediagoblin.submit.task import delete_public_files
+from mediagoblin.tools.response_cache import invalidate_response_cache
+
+_log = logging.getLogger(__name__)
+
+DELETION_BATCH_SIZE = 500
+
+
+def _referencing_columns(table):
+    """ The columns of other tables with foreign keys to rows of table """
+    for other in Base.metadata.sorted_tables:
+        for foreign_key in other.foreign_keys:
+            if foreign_key.column.table is table and other is not table:
+                yield foreign_key.parent
+
+
+def _public_files(media_ids):
+    """ The files in the public store of the media entries of media_ids """
+    filepaths = []
+    for column in (MediaFile.file_path, MediaAttachmentFile.filepath,
+                   MediaSubtitleFile.filepath):
+        filepaths.extend(
+            filepath for (filepath,) in Session.query(column).filter(
+                column.class_.media_entry.in_(media_ids))
+            if filepath)
+    return filepaths
+
+
+def _forget_references(reference_ids):
+    """
+    Remove what GMGTableBase.delete() removes along with the objects of
+    reference_ids (a list or query of GenericModelReference ids)
+    """
+    CollectionItem.query.filter(
+        CollectionItem.object_id.in_(reference_ids)).delete(
+            synchronize_session=False)
+    Notification.query.filter(
+        Notification.object_id.in_(reference_ids)).delete(
+            synchronize_session=False)
+    Comment.query.filter(
+        Comment.comment_id.in_(reference_ids)).delete(
+            synchronize_session=False)
+    Report.query.filter(
+        Report.object_id.in_(reference_ids)).update(
+            {"object_id": None}, synchronize_session=False)
+
+
+def _delete_batch(media_ids, del_orphan_tags):
+    """
+    Delete the media entries of media_ids like MediaEntry.delete() does
+    and return how many there were and the files they leave behind
+    """
+    entries = Session.query(
+        MediaEntry.id, MediaEntry.public_id, MediaEntry.actor,
+        MediaEntry.media_type).filter(MediaEntry.id.in_(media_ids)).all()
+    if not entries:
+        return 0, []
+    media_ids = [entry.id for entry in entries]
+    filepaths = _public_files(media_ids)
+    tag_ids = [tag_id for (tag_id,) in Session.query(MediaTag.tag).filter(
+        MediaTag.media_entry.in_(media_ids)).distinct()]
+
+    references = Session.query(
+        GenericModelReference.id, GenericModelReference.obj_pk).filter(
+            GenericModelReference.model_type == MediaEntry.__tablename__,
+            GenericModelReference.obj_pk.in_(media_ids)).all()
+    reference_ids = [reference.id for reference in references]
+    if reference_ids:
+        # The comments on the entries, like MediaEntry.soft_delete()
+        comment_ids = Session.query(Comment.id).filter(
+            Comment.target_id.in_(reference_ids))
+        _forget_references(Session.query(GenericModelReference.id).filter(
+            GenericModelReference.model_type == Comment.__tablename__,
+            GenericModelReference.obj_pk.in_(comment_ids)))
+        Comment.query.filter(Comment.id.in_(comment_ids)).delete(
+            synchronize_session=False)
+
+        _forget_references(reference_ids)
+
+    # Tombstones, and references remapped to them, like soft_delete()
+    actors = dict(
+        (user.id, GenericModelReference.find_or_new(user))
+        for user in User.query.filter(
+            User.id.in_(set(entry.actor for entry in entries))))
+    tombstones = {}
+    for entry in entries:
+        tombstone = Graveyard(
+            public_id=entry.public_id,
+            # Like MediaEntryMixin.object_type
+            object_type=entry.media_type.split(".")[-1])
+        tombstone.actor_helper = actors.get(entry.actor)
+        tombstones[entry.id] = tombstone
+    Session.add_all(tombstones.values())
+    Session.flush()
+    Session.bulk_update_mappings(GenericModelReference, [{
+        "id": reference.id,
+        "obj_pk": tombstones[reference.obj_pk].id,
+        "model_type": Graveyard.__tablename__,
+    } for reference in references])
+
+    # Files, tags, media data and all else belonging to the entries
+    for column in _referencing_columns(MediaEntry.__table__):
+        Session.execute(
+            column.table.delete().where(column.in_(media_ids)))
+    Session.execute(MediaEntry.__table__.delete().where(
+        MediaEntry.id.in_(media_ids)))
+    remove_from_search_index(media_ids)
+    if del_orphan_tags:
+        clean_orphan_tags(commit=False, tag_ids=tag_ids)
+
+    # Entries loaded before are gone now
+    deleted = set(media_ids)
+    for obj in list(Session.identity_map.values()):
+        if isinstance(obj, MediaEntry) and \
+                inspect(obj).identity[0] in deleted:
+            Session.expunge(obj)
+
+    return len(media_ids), filepaths
+
+
+def delete_media_entries(media_ids, commit=True, progress=None,
+                         batch_size=DELETION_BATCH_SIZE,
+                         del_orphan_tags=True):
+    """
+    Delete the media entries of media_ids, like MediaEntry.delete() does,
+    batch_size entries at a time.  The files of the entries are removed
+    from the public store by the delete_public_files task.
+
+    Args:
+     - commit: commit after each batch (and not only flush)
+     - progress: called with the number of entries deleted so far and
+       the number of media_ids after each batch
+     - del_orphan_tags: also delete the tags of the entries no other
+       entry uses
+
+    Returns how many entries were deleted.
+    """
+    media_ids = sorted(set(media_ids))
+    deleted = 0
+    for start in range(0, len(media_ids), batch_size):
+        count, filepaths = _delete_batch(
+            media_ids[start:start + batch_size], del_orphan_tags)
+        if commit:
+            Session.commit()
+        else:
+            Session.flush()
+        if filepaths:
+            delete_public_files.delay(filepaths)
+
+        deleted += count
+        if progress is not None:
+            progress(deleted, len(media_ids))
+
+    if deleted:
+        invalidate_response_cache()
+    _log.info('Deleted {0} media entries'.format(deleted))
+    return deleted
@@ -0,0 +1,39 @@
+"""add sessions table
+
+Revision ID: 5c8b4fd1a2e6
+Revises: cc3651803714
+Create Date: 2026-10-18 10:12:40.518323
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5c8b4fd1a2e6'
+down_revision = 'cc3651803714'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+from mediagoblin.db.extratypes import JSONEncoded
+
+
+def upgrade():
+    op.create_table('core__sessions',
+    sa.Column('id', sa.Unicode(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('data', JSONEncoded(), nullable=False),
+    sa.Column('expires', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_core__sessions_user_id'), 'core__sessions',
+                    ['user_id'], unique=False)
+    op.create_index(op.f('ix_core__sessions_expires'), 'core__sessions',
+                    ['expires'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_core__sessions_expires'),
+                  table_name='core__sessions')
+    op.drop_index(op.f('ix_core__sessions_user_id'),
+                  table_name='core__sessions')
+    op.drop_table('core__sessions')
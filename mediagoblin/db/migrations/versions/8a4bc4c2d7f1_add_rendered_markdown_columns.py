@@ -0,0 +1,42 @@
+"""add rendered markdown columns
+
+Revision ID: 8a4bc4c2d7f1
+Revises: 5c8b4fd1a2e6
+Create Date: 2026-10-18 14:02:11.730214
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '8a4bc4c2d7f1'
+down_revision = '5c8b4fd1a2e6'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+RENDERED_FIELDS = [
+    ('core__users', 'rendered_bio'),
+    ('core__media_entries', 'rendered_description'),
+    ('core__media_comments', 'rendered_content'),
+    ('core__collections', 'rendered_description'),
+]
+
+
+def upgrade():
+    """
+    The HTML stays empty until the objects are saved again or
+    "gmg rendermarkdown" is run; until then it's rendered when shown.
+    """
+    for table, column in RENDERED_FIELDS:
+        op.add_column(table, sa.Column(column, sa.UnicodeText()))
+        op.add_column(table, sa.Column('html_renderer', sa.Unicode()))
+
+
+def downgrade():
+    # SQLite can't drop columns in place
+    for table, column in RENDERED_FIELDS:
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('html_renderer')
+            batch_op.drop_column(column)
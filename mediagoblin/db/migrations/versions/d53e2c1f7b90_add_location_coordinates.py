@@ -0,0 +1,82 @@
+"""add location coordinates
+
+Revision ID: d53e2c1f7b90
+Revises: 8a4bc4c2d7f1
+Create Date: 2026-10-18 16:40:05.118730
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'd53e2c1f7b90'
+down_revision = '8a4bc4c2d7f1'
+branch_labels = None
+depends_on = None
+
+import json
+
+from alembic import op
+import sqlalchemy as sa
+
+
+BATCH_SIZE = 1000
+
+
+def _coordinates(position):
+    """ Like Location.coordinates, for the JSON of position """
+    try:
+        position = json.loads(position)
+        latitude = float(position["latitude"])
+        longitude = float(position["longitude"])
+    except (TypeError, KeyError, ValueError):
+        return None, None
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return None, None
+    return latitude, longitude
+
+
+def upgrade():
+    op.add_column('core__locations', sa.Column('latitude', sa.Float()))
+    op.add_column('core__locations', sa.Column('longitude', sa.Float()))
+    op.create_index('ix_core__locations_latitude_longitude',
+                    'core__locations', ['latitude', 'longitude'],
+                    unique=False)
+    op.create_index(op.f('ix_core__media_entries_location'),
+                    'core__media_entries', ['location'], unique=False)
+
+    # Copy the coordinates of existing locations
+    locations = sa.table(
+        'core__locations',
+        sa.column('id', sa.Integer),
+        sa.column('position', sa.UnicodeText),
+        sa.column('latitude', sa.Float),
+        sa.column('longitude', sa.Float))
+    connection = op.get_bind()
+    last_id = -1
+    while True:
+        rows = connection.execute(
+            sa.select([locations.c.id, locations.c.position])
+            .where(locations.c.id > last_id)
+            .where(locations.c.position != None)
+            .order_by(locations.c.id)
+            .limit(BATCH_SIZE)).fetchall()
+        if not rows:
+            break
+        for location_id, position in rows:
+            latitude, longitude = _coordinates(position)
+            if latitude is not None:
+                connection.execute(
+                    locations.update()
+                    .where(locations.c.id == location_id)
+                    .values(latitude=latitude, longitude=longitude))
+        last_id = rows[-1][0]
+
+
+def downgrade():
+    op.drop_index(op.f('ix_core__media_entries_location'),
+                  table_name='core__media_entries')
+    op.drop_index('ix_core__locations_latitude_longitude',
+                  table_name='core__locations')
+    # SQLite can't drop columns in place
+    with op.batch_alter_table('core__locations') as batch_op:
+        batch_op.drop_column('longitude')
+        batch_op.drop_column('latitude')
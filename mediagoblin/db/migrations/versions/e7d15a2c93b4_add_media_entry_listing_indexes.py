@@ -0,0 +1,49 @@
+"""add media entry listing indexes
+
+Revision ID: e7d15a2c93b4
+Revises: d53e2c1f7b90
+Create Date: 2026-10-18 19:12:41.306254
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'e7d15a2c93b4'
+down_revision = 'd53e2c1f7b90'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+
+
+def upgrade():
+    op.create_index('ix_core__media_entries_state_created',
+                    'core__media_entries', ['state', 'created', 'id'],
+                    unique=False)
+    op.create_index('ix_core__media_entries_actor_state_created',
+                    'core__media_entries',
+                    ['actor', 'state', 'created', 'id'], unique=False)
+    # Takes over lookups by actor alone
+    op.create_index('ix_core__media_entries_actor_created',
+                    'core__media_entries', ['actor', 'created', 'id'],
+                    unique=False)
+    op.drop_index(op.f('ix_core__media_entries_actor'),
+                  table_name='core__media_entries')
+    op.create_index(op.f('ix_core__comment_links_target_id'),
+                    'core__comment_links', ['target_id'], unique=False)
+    op.create_index(op.f('ix_core__attachment_files_media_entry'),
+                    'core__attachment_files', ['media_entry'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_core__attachment_files_media_entry'),
+                  table_name='core__attachment_files')
+    op.drop_index(op.f('ix_core__comment_links_target_id'),
+                  table_name='core__comment_links')
+    op.create_index(op.f('ix_core__media_entries_actor'),
+                    'core__media_entries', ['actor'], unique=False)
+    op.drop_index('ix_core__media_entries_actor_created',
+                  table_name='core__media_entries')
+    op.drop_index('ix_core__media_entries_actor_state_created',
+                  table_name='core__media_entries')
+    op.drop_index('ix_core__media_entries_state_created',
+                  table_name='core__media_entries')
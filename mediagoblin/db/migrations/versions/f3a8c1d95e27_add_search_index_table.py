@@ -0,0 +1,40 @@
+"""add search index table
+
+Revision ID: f3a8c1d95e27
+Revises: e7d15a2c93b4
+Create Date: 2026-10-18 21:02:17.530412
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'f3a8c1d95e27'
+down_revision = 'e7d15a2c93b4'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+
+from mediagoblin.search.index import SQLiteSearchIndex
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        # Without FTS5 there is no database search, see
+        # mediagoblin.search.lib
+        if SQLiteSearchIndex.is_supported():
+            op.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS core__search_index "
+                "USING fts5(title, tags, description, comments)")
+    elif dialect == 'postgresql':
+        op.execute(
+            "CREATE TABLE IF NOT EXISTS core__search_index ("
+            "media_entry integer PRIMARY KEY, "
+            "document tsvector NOT NULL)")
+        op.execute(
+            "CREATE INDEX IF NOT EXISTS core__search_index_document_idx "
+            "ON core__search_index USING gin (document)")
+
+
+def downgrade():
+    op.execute("DROP TABLE IF EXISTS core__search_index")
@@ -29,15 +29,16 @@ real objects.
 
 import uuid
 import re
-from datetime import datetime
 
 from pytz import UTC
+from sqlalchemy import inspect
 from werkzeug.utils import cached_property
 
 from mediagoblin.media_types import FileTypeNotSupported
 from mediagoblin.tools import common, licenses
 from mediagoblin.tools.pluginapi import hook_handle
-from mediagoblin.tools.text import cleaned_markdown_conversion
+from mediagoblin.tools.text import cleaned_markdown_conversion, \
+    MARKDOWN_RENDERER
 from mediagoblin.tools.url import slugify
 from mediagoblin.tools.translate import pass_to_ugettext as _
 
@@ -118,12 +119,54 @@ class GeneratePublicIDMixin(object):
             self.save()
         return self.public_id
 
-class UserMixin(object):
+class RenderedMarkdownMixin(object):
+    """
+    Mixin for models which keep the HTML of their markdown fields.
+
+    For each field in markdown_fields the model has a "rendered_<field>"
+    column holding the HTML, and an "html_renderer" column holding the
+    MARKDOWN_RENDERER it was rendered with.  The HTML is stored whenever
+    the object is written (see mediagoblin.db.models), so showing it
+    doesn't need Markdown at all.
+
+    HTML from another renderer (or not rendered yet) is rendered again
+    when it is shown, but only stored on the next write of the object or
+    by "gmg rendermarkdown".
+    """
+    markdown_fields = ()
+
+    def render_markdown(self):
+        """Render all markdown fields and keep the HTML in the columns"""
+        for field in self.markdown_fields:
+            setattr(self, 'rendered_' + field,
+                    cleaned_markdown_conversion(getattr(self, field)))
+        self.html_renderer = MARKDOWN_RENDERER
+        self._fresh_html = None
+
+    def rendered_html(self, field):
+        """The HTML of the markdown field, as current renderers make it"""
+        if (self.html_renderer == MARKDOWN_RENDERER and
+                not inspect(self).attrs[field].history.has_changes()):
+            return getattr(self, 'rendered_' + field) or u''
+
+        # Not set as the columns, so that showing an object doesn't
+        # make it need writing
+        text = getattr(self, field)
+        fresh_html = getattr(self, '_fresh_html', None)
+        if fresh_html is None:
+            fresh_html = self._fresh_html = {}
+        if fresh_html.get(field, (None,))[0] != text:
+            fresh_html[field] = (text, cleaned_markdown_conversion(text))
+        return fresh_html[field][1]
+
+
+class UserMixin(RenderedMarkdownMixin):
     object_type = "person"
+    markdown_fields = ('bio',)
 
     @property
     def bio_html(self):
-        return cleaned_markdown_conversion(self.bio)
+        return self.rendered_html('bio')
 
     def url_for_self(self, urlgen, **kwargs):
         """Generate a URL for this User's home page."""
@@ -205,7 +248,10 @@ class GenerateSlugMixin(object):
         self.slug = slug
 
 
-class MediaEntryMixin(GenerateSlugMixin, GeneratePublicIDMixin):
+class MediaEntryMixin(GenerateSlugMixin, GeneratePublicIDMixin,
+                      RenderedMarkdownMixin):
+    markdown_fields = ('description',)
+
     def check_slug_used(self, slug):
         # import this here due to a cyclic import issue
         # (db.models -> db.mixin -> db.util -> db.models)
@@ -224,7 +270,7 @@ class MediaEntryMixin(GenerateSlugMixin, GeneratePublicIDMixin):
         Rendered version of the description, run through
         Markdown and cleaned with our cleaning tool.
         """
-        return cleaned_markdown_conversion(self.description)
+        return self.rendered_html('description')
 
     def get_display_media(self):
         """Find the best media for display.
@@ -373,10 +419,34 @@ class MediaEntryMixin(GenerateSlugMixin, GeneratePublicIDMixin):
         """Return license dict for requested license"""
         return licenses.get_license_by_url(self.license or "")
 
+    def exif_summary(self):
+        """
+        The summary of the EXIF tags of an image as a dict of
+        EXIF_SUMMARY_FIELDS, or None
+        """
+        # import this here due to a cyclic import issue
+        # (db.models -> db.mixin -> tools.exif -> processing -> db.models)
+        from mediagoblin.tools.exif import summarize_exif, \
+            EXIF_SUMMARY_FIELDS
+
+        media_data = self.media_data
+        has_exif = getattr(media_data, 'has_exif', None)
+        if has_exif is None:
+            # Processed before summaries were stored, so make one up
+            exif_all = getattr(media_data, 'exif_all', None)
+            return summarize_exif(exif_all) if exif_all else None
+        if not has_exif:
+            return None
+        return dict((field, getattr(media_data, field))
+                    for field in EXIF_SUMMARY_FIELDS)
+
+    def has_exif(self):
+        return self.exif_summary() is not None
+
     def exif_display_iter(self):
         if not self.media_data:
             return
-        exif_all = self.media_data.get("exif_all")
+        exif_all = self.media_data.get("exif_all") or {}
 
         for key in exif_all:
             label = re.sub('(.)([A-Z][a-z]+)', r'\1 \2', key)
@@ -384,54 +454,36 @@ class MediaEntryMixin(GenerateSlugMixin, GeneratePublicIDMixin):
 
     def exif_display_data_short(self):
         """Display a very short practical version of exif info"""
-        if not self.media_data:
+        summary = self.exif_summary()
+        if not summary:
             return
 
-        exif_all = self.media_data.get("exif_all")
-
         exif_short = {}
 
-        if 'Image DateTimeOriginal' in exif_all:
-            # format date taken
-            takendate = datetime.strptime(
-                exif_all['Image DateTimeOriginal']['printable'],
-                '%Y:%m:%d %H:%M:%S').date()
-            taken = takendate.strftime('%B %d %Y')
-
-            exif_short.update({'Date Taken': taken})
-
-        aperture = None
-        if 'EXIF FNumber' in exif_all:
-            fnum = str(exif_all['EXIF FNumber']['printable']).split('/')
-
-            # calculate aperture
-            if len(fnum) == 2:
-                aperture = "f/%.1f" % (float(fnum[0])/float(fnum[1]))
-            elif fnum[0] != 'None':
-                aperture = "f/%s" % (fnum[0])
-
-        if aperture:
-            exif_short.update({'Aperture': aperture})
+        if summary['taken']:
+            exif_short['Date Taken'] = summary['taken'].strftime('%B %d %Y')
+        if summary['aperture']:
+            exif_short['Aperture'] = 'f/%g' % round(summary['aperture'], 1)
 
         short_keys = [
-            ('Camera', 'Image Model', None),
-            ('Exposure', 'EXIF ExposureTime', lambda x: '%s sec' % x),
-            ('ISO Speed', 'EXIF ISOSpeedRatings', None),
-            ('Focal Length', 'EXIF FocalLength', lambda x: '%s mm' % x)]
-
-        for label, key, fmt_func in short_keys:
-            try:
-                val = fmt_func(exif_all[key]['printable']) if fmt_func \
-                        else exif_all[key]['printable']
-                exif_short.update({label: val})
-            except KeyError:
-                pass
+            ('Camera', 'camera_model', None),
+            ('Lens', 'lens', None),
+            ('Exposure', 'exposure_time', lambda x: '%s sec' % x),
+            ('ISO Speed', 'iso', None),
+            ('Focal Length', 'focal_length',
+             lambda x: '%g mm' % round(x, 1))]
+
+        for label, field, fmt_func in short_keys:
+            value = summary[field]
+            if value is not None:
+                exif_short[label] = fmt_func(value) if fmt_func else value
 
         return exif_short
 
 
-class TextCommentMixin(GeneratePublicIDMixin):
+class TextCommentMixin(GeneratePublicIDMixin, RenderedMarkdownMixin):
     object_type = "comment"
+    markdown_fields = ('content',)
 
     @property
     def content_html(self):
@@ -439,7 +491,7 @@ class TextCommentMixin(GeneratePublicIDMixin):
         the actual html-rendered version of the comment displayed.
         Run through Markdown and the HTML cleaner.
         """
-        return cleaned_markdown_conversion(self.content)
+        return self.rendered_html('content')
 
     def __unicode__(self):
         return u'<{klass} #{id} {actor} "{comment}">'.format(
@@ -455,8 +507,10 @@ class TextCommentMixin(GeneratePublicIDMixin):
             actor=self.get_actor,
             comment=self.content)
 
-class CollectionMixin(GenerateSlugMixin, GeneratePublicIDMixin):
+class CollectionMixin(GenerateSlugMixin, GeneratePublicIDMixin,
+                      RenderedMarkdownMixin):
     object_type = "collection"
+    markdown_fields = ('description',)
 
     def check_slug_used(self, slug):
         # import this here due to a cyclic import issue
@@ -471,7 +525,7 @@ class CollectionMixin(GenerateSlugMixin, GeneratePublicIDMixin):
         Rendered version of the description, run through
         Markdown and cleaned with our cleaning tool.
         """
-        return cleaned_markdown_conversion(self.description)
+        return self.rendered_html('description')
 
     @property
     def slug_or_id(self):
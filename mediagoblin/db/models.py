@@ -25,9 +25,9 @@ import datetime
 
 from sqlalchemy import Column, Integer, Unicode, UnicodeText, DateTime, \
         Boolean, ForeignKey, UniqueConstraint, PrimaryKeyConstraint, \
-        SmallInteger, Date, types, Float
+        SmallInteger, Date, types, Float, Index, event, inspect
 from sqlalchemy.orm import relationship, backref, with_polymorphic, validates, \
-        class_mapper
+        class_mapper, joinedload, selectinload
 from sqlalchemy.orm.collections import attribute_mapped_collection
 from sqlalchemy.sql import and_
 from sqlalchemy.sql.expression import desc
@@ -39,11 +39,14 @@ from mediagoblin.db.extratypes import (PathTupleWithSlashes, JSONEncoded,
 from mediagoblin.db.base import Base, DictReadAttrProxy, FakeCursor
 from mediagoblin.db.mixin import UserMixin, MediaEntryMixin, \
         CollectionMixin, CollectionItemMixin, ActivityMixin, TextCommentMixin, \
-        CommentingMixin
+        CommentingMixin, RenderedMarkdownMixin
 from mediagoblin.tools.files import delete_media_files
+from mediagoblin.tools.response_cache import invalidate_response_cache
+from mediagoblin.tools.session import invalidate_cached_user
 from mediagoblin.tools.common import import_component
 from mediagoblin.tools.routing import extract_url_arguments
-from mediagoblin.tools.text import convert_to_tag_list_of_dicts
+from mediagoblin.tools.text import convert_to_tag_list_of_dicts, \
+        MARKDOWN_RENDERER
 
 import six
 from six.moves.urllib.parse import urljoin
@@ -70,13 +73,60 @@ class GenericModelReference(Base):
         UniqueConstraint("model_type", "obj_pk"),
         {})
 
+    # How many primary keys load_objects() puts into one IN clause
+    LOAD_BATCH_SIZE = 500
+
+    # (model_type, obj_pk, object) set by load_objects()
+    _loaded = None
+
     def get_object(self):
         # This can happen if it's yet to be saved
         if self.model_type is None or self.obj_pk is None:
             return None
 
+        if self._loaded is not None:
+            model_type, obj_pk, obj = self._loaded
+            if (model_type, obj_pk) == (self.model_type, self.obj_pk) \
+                    and inspect(obj).persistent:
+                return obj
+
         model = self._get_model_from_type(self.model_type)
-        return model.query.filter_by(id=self.obj_pk).first()
+        # get() doesn't hit the database for objects already loaded
+        return model.query.get(self.obj_pk)
+
+    @classmethod
+    def load_objects(cls, references):
+        """
+        Load the objects of all references (None is skipped) with one
+        query per model type instead of one query per reference, and keep
+        them on the references for get_object().
+
+        Models with a for_listing() query (like MediaEntry) are loaded
+        with it.  Returns the objects found.
+        """
+        wanted = {}
+        for reference in references:
+            if reference is None or reference.model_type is None \
+                    or reference.obj_pk is None:
+                continue
+            wanted.setdefault(reference.model_type, {}).setdefault(
+                reference.obj_pk, []).append(reference)
+
+        objects = []
+        for model_type, by_pk in six.iteritems(wanted):
+            model = cls._get_model_from_type(model_type)
+            query = model.for_listing() if hasattr(model, "for_listing") \
+                else model.query
+            pk_column = class_mapper(model).primary_key[0]
+            pks = sorted(by_pk)
+            for start in range(0, len(pks), cls.LOAD_BATCH_SIZE):
+                batch = pks[start:start + cls.LOAD_BATCH_SIZE]
+                for obj in query.filter(pk_column.in_(batch)):
+                    obj_pk = inspect(obj).identity[0]
+                    for reference in by_pk[obj_pk]:
+                        reference._loaded = (model_type, obj_pk, obj)
+                    objects.append(obj)
+        return objects
 
     def set_object(self, obj):
         model = obj.__class__
@@ -105,21 +155,19 @@ class GenericModelReference(Base):
         self.obj_pk = getattr(obj, pk_column.key)
         self.model_type = obj.__tablename__
 
-    def _get_model_from_type(self, model_type):
+    @classmethod
+    def _get_model_from_type(cls, model_type):
         """ Gets a model from a tablename (model type) """
-        if getattr(type(self), "_TYPE_MAP", None) is None:
+        if getattr(cls, "_TYPE_MAP", None) is None:
             # We want to build on the class (not the instance) a map of all the
             # models by the table name (type) for easy lookup, this is done on
             # the class so it can be shared between all instances
-
-            # to prevent circular imports do import here
             registry = dict(Base._decl_class_registry).values()
-            self._TYPE_MAP = dict(
+            cls._TYPE_MAP = dict(
                 ((m.__tablename__, m) for m in registry if hasattr(m, "__tablename__"))
             )
-            setattr(type(self), "_TYPE_MAP",  self._TYPE_MAP)
 
-        return self.__class__._TYPE_MAP[model_type]
+        return cls._TYPE_MAP[model_type]
 
     @classmethod
     def find_for_obj(cls, obj):
@@ -160,6 +208,28 @@ class Location(Base):
     position = Column(MutationDict.as_mutable(JSONEncoded))
     address = Column(MutationDict.as_mutable(JSONEncoded))
 
+    # Copies of position's coordinates, to find the locations in an area
+    latitude = Column(Float)
+    longitude = Column(Float)
+
+    __table_args__ = (
+        Index('ix_core__locations_latitude_longitude',
+              'latitude', 'longitude'),
+        {})
+
+    def coordinates(self):
+        """
+        The (latitude, longitude) of position as numbers, or (None, None)
+        """
+        try:
+            latitude = float(self.position["latitude"])
+            longitude = float(self.position["longitude"])
+        except (TypeError, KeyError, ValueError):
+            return None, None
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+            return None, None
+        return latitude, longitude
+
     @classmethod
     def create(cls, data, obj):
         location = cls()
@@ -238,6 +308,8 @@ class User(Base, UserMixin):
     id = Column(Integer, primary_key=True)
     url = Column(Unicode)
     bio = Column(UnicodeText)
+    rendered_bio = Column(UnicodeText)
+    html_renderer = Column(Unicode)
     name = Column(Unicode)
 
     # This is required for the polymorphic inheritance
@@ -258,6 +330,10 @@ class User(Base, UserMixin):
 
     deletion_mode = Base.SOFT_DELETE
 
+    def save(self, *args, **kwargs):
+        super(User, self).save(*args, **kwargs)
+        invalidate_cached_user(self.id)
+
     def soft_delete(self, *args, **kwargs):
         # Find all the Collections and delete those
         for collection in Collection.query.filter_by(actor=self.id):
@@ -278,20 +354,22 @@ class User(Base, UserMixin):
         """Deletes a User and all related entries/comments/files/..."""
         # Collections get deleted by relationships.
 
-        media_entries = MediaEntry.query.filter(MediaEntry.actor == self.id)
-        for media in media_entries:
-            # TODO: Make sure that "MediaEntry.delete()" also deletes
-            # all related files/Comments
-            media.delete(del_orphan_tags=False, commit=False)
-
-        # Delete now unused tags
         # TODO: import here due to cyclic imports!!! This cries for refactoring
-        from mediagoblin.db.util import clean_orphan_tags
-        clean_orphan_tags(commit=False)
+        from mediagoblin.db.deletion import delete_media_entries
+
+        # progress is called as media entries are deleted, see
+        # delete_media_entries()
+        progress = kwargs.pop('progress', None)
+        media_ids = [media_id for (media_id,) in MediaEntry.query.filter(
+            MediaEntry.actor == self.id).with_entities(MediaEntry.id)]
+        delete_media_entries(media_ids, commit=kwargs.get('commit', True),
+                             progress=progress)
 
         # Delete user, pass through commit=False/True in kwargs
         username = self.username
+        user_id = self.id
         super(User, self).delete(*args, **kwargs)
+        invalidate_cached_user(user_id)
         _log.info('Deleted user "{0}" account'.format(username))
 
     def has_privilege(self, privilege, allow_admin=True):
@@ -308,10 +386,10 @@ class User(Base, UserMixin):
                                 even if the user hasn't been given the
                                 privilege. (defaults to True)
         """
-        priv = Privilege.query.filter_by(privilege_name=privilege).one()
-        if priv in self.all_privileges:
+        privilege_names = [priv.privilege_name for priv in self.all_privileges]
+        if privilege in privilege_names:
             return True
-        elif allow_admin and self.has_privilege(u'admin', allow_admin=False):
+        elif allow_admin and u'admin' in privilege_names:
             return True
 
         return False
@@ -524,16 +602,18 @@ class MediaEntry(Base, MediaEntryMixin, CommentingMixin):
     public_id = Column(Unicode, unique=True, nullable=True)
     remote = Column(Boolean, default=False)
 
-    actor = Column(Integer, ForeignKey(User.id), nullable=False, index=True)
+    actor = Column(Integer, ForeignKey(User.id), nullable=False)
     title = Column(Unicode, nullable=False)
     slug = Column(Unicode)
     description = Column(UnicodeText) # ??
+    rendered_description = Column(UnicodeText)
+    html_renderer = Column(Unicode)
     media_type = Column(Unicode, nullable=False)
     state = Column(Unicode, default=u'unprocessed', nullable=False)
         # or use sqlalchemy.types.Enum?
     license = Column(Unicode)
     file_size = Column(Integer, default=0)
-    location = Column(Integer, ForeignKey("core__locations.id"))
+    location = Column(Integer, ForeignKey("core__locations.id"), index=True)
     get_location = relationship("Location", lazy="joined")
 
     created = Column(DateTime, nullable=False, default=datetime.datetime.utcnow,
@@ -551,7 +631,15 @@ class MediaEntry(Base, MediaEntryMixin, CommentingMixin):
     queued_task_id = Column(Unicode)
 
     __table_args__ = (
+        # Also serves lookups by actor and slug
         UniqueConstraint('actor', 'slug'),
+        # For listings of media, newest first
+        Index('ix_core__media_entries_state_created',
+              'state', 'created', 'id'),
+        Index('ix_core__media_entries_actor_created',
+              'actor', 'created', 'id'),
+        Index('ix_core__media_entries_actor_state_created',
+              'actor', 'state', 'created', 'id'),
         {})
 
     deletion_mode = Base.SOFT_DELETE
@@ -597,6 +685,22 @@ class MediaEntry(Base, MediaEntryMixin, CommentingMixin):
     ## TODO
     # fail_error
 
+    @classmethod
+    def for_listing(cls, query=None):
+        """
+        Set up query (all media entries by default) to load what galleries
+        and feeds show of each entry (files, uploader and tags) for all
+        entries at once, instead of lazily one entry at a time.
+        """
+        if query is None:
+            query = cls.query
+
+        actor = with_polymorphic(User, "*", flat=True)
+        return query.options(
+            selectinload(cls.media_files_helper),
+            selectinload(cls.get_actor.of_type(actor)),
+            selectinload(cls.tags_helper).joinedload(MediaTag.tag_helper))
+
     @property
     def get_uploader(self):
         # for compatibility
@@ -632,22 +736,33 @@ class MediaEntry(Base, MediaEntryMixin, CommentingMixin):
 
         return query
 
+    def _processed_by_actor(self):
+        """
+        Query for the processed entries by the same user, as ordered in
+        their gallery (by created and id)
+        """
+        return MediaEntry.query.filter(
+            (MediaEntry.actor == self.actor)
+            & (MediaEntry.state == u'processed'))
+
     def url_to_prev(self, urlgen):
         """get the next 'newer' entry by this user"""
-        media = MediaEntry.query.filter(
-            (MediaEntry.actor == self.actor)
-            & (MediaEntry.state == u'processed')
-            & (MediaEntry.id > self.id)).order_by(MediaEntry.id).first()
+        media = self._processed_by_actor().filter(
+            (MediaEntry.created > self.created)
+            | ((MediaEntry.created == self.created)
+               & (MediaEntry.id > self.id))).order_by(
+                   MediaEntry.created, MediaEntry.id).first()
 
         if media is not None:
             return media.url_for_self(urlgen)
 
     def url_to_next(self, urlgen):
         """get the next 'older' entry by this user"""
-        media = MediaEntry.query.filter(
-            (MediaEntry.actor == self.actor)
-            & (MediaEntry.state == u'processed')
-            & (MediaEntry.id < self.id)).order_by(desc(MediaEntry.id)).first()
+        media = self._processed_by_actor().filter(
+            (MediaEntry.created < self.created)
+            | ((MediaEntry.created == self.created)
+               & (MediaEntry.id < self.id))).order_by(
+                   desc(MediaEntry.created), desc(MediaEntry.id)).first()
 
         if media is not None:
             return media.url_for_self(urlgen)
@@ -719,6 +834,26 @@ class MediaEntry(Base, MediaEntryMixin, CommentingMixin):
                 id=self.id,
                 title=safe_title)
 
+    # What galleries and feeds show of an entry
+    _LISTED_FIELDS = ('title', 'slug', 'description', 'license', 'state',
+                      'actor', 'created', 'updated')
+
+    def save(self, *args, **kwargs):
+        """
+        Save the entry.  Pass set_updated=True (only as a keyword) when
+        the user edited it, cached pages and feeds are validated against
+        updated.
+        """
+        if kwargs.pop('set_updated', False):
+            self.updated = datetime.datetime.utcnow()
+
+        attrs = inspect(self).attrs
+        listed_changed = any(attrs[name].history.has_changes()
+                             for name in self._LISTED_FIELDS)
+        super(MediaEntry, self).save(*args, **kwargs)
+        if listed_changed:
+            invalidate_response_cache()
+
     def soft_delete(self, *args, **kwargs):
         # Find all of the media comments for this and delete them
         for comment in self.get_comments():
@@ -746,14 +881,20 @@ class MediaEntry(Base, MediaEntryMixin, CommentingMixin):
                        '{0}'.format(str(error), self.get_actor))
         _log.info('Deleted Media entry id "{0}"'.format(self.id))
         # Related MediaTag's are automatically cleaned, but we might
-        # want to clean out unused Tag's too.
+        # want to clean out unused Tag's too.  Only the Tags of this
+        # entry can have become unused.
         if del_orphan_tags:
             # TODO: Import here due to cyclic imports!!!
             #       This cries for refactoring
             from mediagoblin.db.util import clean_orphan_tags
-            clean_orphan_tags(commit=False)
-        # pass through commit=False/True in kwargs
-        super(MediaEntry, self).delete(**kwargs)
+            tag_ids = [media_tag.tag for media_tag in self.tags_helper]
+            commit = kwargs.pop('commit', True)
+            super(MediaEntry, self).delete(commit=False, **kwargs)
+            clean_orphan_tags(commit=commit, tag_ids=tag_ids)
+        else:
+            # pass through commit=False/True in kwargs
+            super(MediaEntry, self).delete(**kwargs)
+        invalidate_response_cache()
 
     def serialize(self, request, show_comments=True):
         """ Unserialize MediaEntry to object """
@@ -907,7 +1048,7 @@ class MediaAttachmentFile(Base):
     id = Column(Integer, primary_key=True)
     media_entry = Column(
         Integer, ForeignKey(MediaEntry.id),
-        nullable=False)
+        nullable=False, index=True)
     name = Column(Unicode, nullable=False)
     filepath = Column(PathTupleWithSlashes)
     created = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
@@ -1002,7 +1143,8 @@ class Comment(Base):
     target_id = Column(
         Integer,
         ForeignKey(GenericModelReference.id),
-        nullable=False
+        nullable=False,
+        index=True
     )
     target_helper = relationship(
         GenericModelReference,
@@ -1027,6 +1169,19 @@ class Comment(Base):
     # When it was added
     added = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
 
+    @classmethod
+    def for_listing(cls, query=None):
+        """
+        Set up query (all comment links by default) to load the
+        references to the comments and what they are on along with them.
+        """
+        if query is None:
+            query = cls.query
+
+        return query.options(
+            joinedload(cls.target_helper),
+            joinedload(cls.comment_helper))
+
     @property
     def get_author(self):
         # for compatibility
@@ -1059,6 +1214,8 @@ class TextComment(Base, TextCommentMixin, CommentingMixin):
     created = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
     updated = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
     content = Column(UnicodeText, nullable=False)
+    rendered_content = Column(UnicodeText)
+    html_renderer = Column(Unicode)
     location = Column(Integer, ForeignKey("core__locations.id"))
     get_location = relationship("Location", lazy="joined")
 
@@ -1071,6 +1228,18 @@ class TextComment(Base, TextCommentMixin, CommentingMixin):
                                               cascade="all, delete-orphan"))
     deletion_mode = Base.SOFT_DELETE
 
+    @classmethod
+    def for_listing(cls, query=None):
+        """
+        Set up query (all comments by default) to load their authors
+        along with them
+        """
+        if query is None:
+            query = cls.query
+
+        actor = with_polymorphic(User, "*", flat=True)
+        return query.options(joinedload(cls.get_actor.of_type(actor)))
+
     def serialize(self, request):
         """ Unserialize to python dictionary for API """
         target = self.get_reply_to()
@@ -1163,6 +1332,8 @@ class Collection(Base, CollectionMixin, CommentingMixin):
                      index=True)
     updated = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
     description = Column(UnicodeText)
+    rendered_description = Column(UnicodeText)
+    html_renderer = Column(Unicode)
     actor = Column(Integer, ForeignKey(User.id), nullable=False)
     num_items = Column(Integer, default=0)
 
@@ -1201,7 +1372,8 @@ class Collection(Base, CollectionMixin, CommentingMixin):
         if not ascending:
             order_col = desc(order_col)
         return CollectionItem.query.filter_by(
-            collection=self.id).order_by(order_col)
+            collection=self.id).order_by(order_col).options(
+                joinedload(CollectionItem.object_helper))
 
     def __repr__(self):
         safe_title = self.title.encode('ascii', 'replace')
@@ -1213,7 +1385,10 @@ class Collection(Base, CollectionMixin, CommentingMixin):
 
     def serialize(self, request):
         # Get all serialized output in a list
-        items = [i.serialize(request) for i in self.get_collection_items()]
+        collection_items = self.get_collection_items().all()
+        GenericModelReference.load_objects(
+            [item.object_helper for item in collection_items])
+        items = [i.serialize(request) for i in collection_items]
         return {
             "totalItems": self.num_items,
             "url": self.url_for_self(request.urlgen, qualified=True),
@@ -1508,6 +1683,21 @@ class PrivilegeUserAssociation(Base):
         ForeignKey(Privilege.id),
         primary_key=True)
 
+class StoredSession(Base):
+    """
+    Sessions kept in the database, see
+    mediagoblin.tools.session.SQLSessionStore
+    """
+    __tablename__ = 'core__sessions'
+
+    id = Column(Unicode, primary_key=True)
+    # Not a foreign key: anonymous sessions have none and the sessions
+    # of deleted users are simply revoked
+    user_id = Column(Integer, index=True)
+    data = Column(JSONEncoded, nullable=False)
+    expires = Column(DateTime, nullable=False, index=True)
+
+
 class Generator(Base):
     """ Information about what created an activity """
     __tablename__ = "core__generators"
@@ -1588,6 +1778,34 @@ class Activity(Base, ActivityMixin):
 
     deletion_mode = Base.SOFT_DELETE
 
+    @classmethod
+    def for_listing(cls, query=None):
+        """
+        Set up query (all activities by default) to load the actors,
+        generators and references to the objects and targets of all
+        activities at once.  Use load_objects() on the results for the
+        objects and targets themselves.
+        """
+        if query is None:
+            query = cls.query
+
+        actor = with_polymorphic(User, "*", flat=True)
+        return query.options(
+            joinedload(cls.object_helper),
+            joinedload(cls.target_helper),
+            joinedload(cls.get_actor.of_type(actor)),
+            joinedload(cls.get_generator))
+
+    @staticmethod
+    def load_objects(activities):
+        """
+        Load the objects and targets of all activities with one query
+        per model type
+        """
+        return GenericModelReference.load_objects(
+            [activity.object_helper for activity in activities] +
+            [activity.target_helper for activity in activities])
+
     def __repr__(self):
         if self.content is None:
             return "<{klass} verb:{verb}>".format(
@@ -1642,12 +1860,39 @@ class Graveyard(Base):
             context["actor"] = self.actor().serialize(request)
 
         return context
+
+
+def render_markdown_before_flush(mapper, connection, target):
+    """
+    Store the HTML of new or changed markdown, and of markdown rendered
+    by another renderer, whenever one of these objects is written
+    """
+    state = inspect(target)
+    if target.html_renderer != MARKDOWN_RENDERER or any(
+            state.attrs[field].history.has_changes()
+            for field in target.markdown_fields):
+        target.render_markdown()
+
+event.listen(RenderedMarkdownMixin, 'before_insert',
+             render_markdown_before_flush, propagate=True)
+event.listen(RenderedMarkdownMixin, 'before_update',
+             render_markdown_before_flush, propagate=True)
+
+
+def copy_coordinates_before_flush(mapper, connection, target):
+    target.latitude, target.longitude = target.coordinates()
+
+event.listen(Location, 'before_insert', copy_coordinates_before_flush)
+event.listen(Location, 'before_update', copy_coordinates_before_flush)
+
+
 MODELS = [
     LocalUser, RemoteUser, User, MediaEntry, Tag, MediaTag, Comment, TextComment,
     Collection, CollectionItem, MediaFile, FileKeynames, MediaAttachmentFile, MediaSubtitleFile,
     ProcessingMetaData, Notification, Client, CommentSubscription, Report,
     UserBan, Privilege, PrivilegeUserAssociation, RequestToken, AccessToken,
-    NonceTimestamp, Activity, Generator, Location, GenericModelReference, Graveyard]
+    NonceTimestamp, Activity, Generator, Location, GenericModelReference, Graveyard,
+    StoredSession]
 
 """
  Foundations are the default rows that are created immediately after the tables
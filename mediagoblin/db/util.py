@@ -16,6 +16,8 @@
 
 import sys
 
+from sqlalchemy import exists
+
 from mediagoblin import mg_globals as mgg
 from mediagoblin.db.models import MediaEntry, Tag, MediaTag, Collection
 from mediagoblin.gmg_commands.dbupdate import gather_database_data
@@ -53,17 +55,33 @@ def media_entries_for_tag_slug(dummy_db, tag_slug):
             & (Tag.slug == tag_slug))
 
 
-def clean_orphan_tags(commit=True):
-    """Search for unused MediaTags and delete them"""
-    q1 = Session.query(Tag).outerjoin(MediaTag).filter(MediaTag.id==None)
-    for t in q1:
-        Session.delete(t)
-    # The "let the db do all the work" version:
-    # q1 = Session.query(Tag.id).outerjoin(MediaTag).filter(MediaTag.id==None)
-    # q2 = Session.query(Tag).filter(Tag.id.in_(q1))
-    # q2.delete(synchronize_session = False)
+def clean_orphan_tags(commit=True, tag_ids=None):
+    """
+    Delete the Tags no MediaTag uses anymore, in a single query
+
+    :param tag_ids: only look at these Tags (like the ones of deleted
+        media entries) instead of all of them
+    :param commit: True/False if this should end the db transaction
+
+    Returns the number of deleted Tags.
+    """
+    if tag_ids is not None:
+        tag_ids = list(tag_ids)
+        if not tag_ids:
+            if commit:
+                Session.commit()
+            return 0
+
+    # MediaTags removed in this transaction must be gone from the db
+    Session.flush()
+    orphans = Tag.query.filter(
+        ~exists().where(MediaTag.tag == Tag.id))
+    if tag_ids is not None:
+        orphans = orphans.filter(Tag.id.in_(tag_ids))
+    deleted = orphans.delete(synchronize_session=False)
     if commit:
         Session.commit()
+    return deleted
 
 
 def check_collection_slug_used(creator_id, slug, ignore_c_id):
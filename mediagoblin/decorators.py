@@ -29,6 +29,11 @@ from mediagoblin.tools.response import (
     redirect, render_404,
     render_user_banned, json_response)
 from mediagoblin.tools.translate import pass_to_ugettext as _
+from mediagoblin.tools.pagination import get_page_key
+from mediagoblin.tools.response_cache import (
+    make_etag, get_last_modified, is_not_modified, not_modified_response,
+    set_cache_headers, get_response_cache, get_cached_response,
+    store_response)
 
 from mediagoblin.oauth.tools.request import decode_authorization_header
 from mediagoblin.oauth.oauth import GMGRequestValidator
@@ -157,6 +162,9 @@ def user_may_alter_collection(controller):
 def uses_pagination(controller):
     """
     Check request GET 'page' key for wrong values
+
+    Also decodes the keyset position tokens used by KeysetPagination
+    into request.page_key.
     """
     @wraps(controller)
     def wrapper(request, *args, **kwargs):
@@ -164,6 +172,7 @@ def uses_pagination(controller):
             page = int(request.GET.get('page', 1))
             if page < 0:
                 return render_404(request)
+            request.page_key = get_page_key(request.GET)
         except ValueError:
             return render_404(request)
 
@@ -172,6 +181,61 @@ def uses_pagination(controller):
     return wrapper
 
 
+def cache_response(get_validators, shared=False):
+    """
+    Answer conditional GETs of the decorated view without running it
+
+    get_validators is called with the view's arguments and returns a list
+    of values (newest timestamps, counts) the rendered page depends on, or
+    None if the request should not be cached, e.g. because it will 404.
+    The ETag is derived from these, Last-Modified from the newest datetime
+    among them.
+
+    Views whose output is the same for every anonymous visitor (feeds, no
+    forms or messages in them) pass shared=True: they are sent with
+    Last-Modified and as public, and their rendered responses are kept in
+    the configured response_cache.  Other views are only validated for
+    anonymous visitors, pages of logged in users show their notifications,
+    collections and other state no validator covers.
+    """
+    def decorator(controller):
+        @wraps(controller)
+        def wrapper(request, *args, **kwargs):
+            # Pending messages are rendered (and cleared) by the view
+            if request.method not in ('GET', 'HEAD') or \
+                    request.session.get('messages') or \
+                    (request.user and not shared):
+                return controller(request, *args, **kwargs)
+
+            validators = get_validators(request, *args, **kwargs)
+            if validators is None:
+                return controller(request, *args, **kwargs)
+
+            public = shared and not request.user
+            etag = make_etag(request, validators, public)
+            last_modified = None
+            if public:
+                last_modified = get_last_modified(validators)
+
+            if is_not_modified(request, etag, last_modified):
+                return not_modified_response(etag, last_modified, public)
+
+            cache = get_response_cache() if public else None
+            response = cache and get_cached_response(cache, etag)
+            if not response:
+                response = controller(request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                if cache:
+                    store_response(cache, etag, response)
+
+            return set_cache_headers(response, etag, last_modified, public)
+
+        return wrapper
+
+    return decorator
+
+
 def get_user_media_entry(controller):
     """
     Pass in a MediaEntry based off of a url component
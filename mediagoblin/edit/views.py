@@ -90,7 +90,7 @@ def edit_media(request, media):
 
             media.license = six.text_type(form.license.data) or None
             media.slug = slug
-            media.save()
+            media.save(set_updated=True)
 
             return redirect_obj(request, media)
 
@@ -170,7 +170,7 @@ def edit_attachments(request, media):
                     created=datetime.utcnow(),
                     ))
 
-            media.save()
+            media.save(set_updated=True)
 
             messages.add_message(
                 request,
@@ -524,7 +524,7 @@ def edit_metadata(request, media):
         json_ld_metadata = None
         json_ld_metadata = compact_and_validate(metadata_dict)
         media.media_metadata = json_ld_metadata
-        media.save()
+        media.save(set_updated=True)
         return redirect_obj(request, media)
 
     if len(form.media_metadata) == 0:
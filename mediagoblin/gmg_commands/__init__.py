@@ -48,6 +48,10 @@ SUBCOMMAND_MAP = {
         'setup': 'mediagoblin.gmg_commands.users:deleteuser_parser_setup',
         'func': 'mediagoblin.gmg_commands.users:deleteuser',
         'help': 'Deletes a user'},
+    'revokesessions': {
+        'setup': 'mediagoblin.gmg_commands.users:revokesessions_parser_setup',
+        'func': 'mediagoblin.gmg_commands.users:revokesessions',
+        'help': 'Logs users out everywhere'},
     'dbupdate': {
         'setup': 'mediagoblin.gmg_commands.dbupdate:dbupdate_parse_setup',
         'func': 'mediagoblin.gmg_commands.dbupdate:dbupdate',
@@ -76,6 +80,26 @@ SUBCOMMAND_MAP = {
         'setup': 'mediagoblin.gmg_commands.batchaddmedia:parser_setup',
         'func': 'mediagoblin.gmg_commands.batchaddmedia:batchaddmedia',
         'help': 'Add many media entries at once'},
+    'compiletemplates': {
+        'setup': 'mediagoblin.gmg_commands.compiletemplates:parser_setup',
+        'func': 'mediagoblin.gmg_commands.compiletemplates:compiletemplates',
+        'help': 'Precompile all templates into the template cache'},
+    'rendermarkdown': {
+        'setup': 'mediagoblin.gmg_commands.rendermarkdown:parser_setup',
+        'func': 'mediagoblin.gmg_commands.rendermarkdown:rendermarkdown',
+        'help': 'Store the HTML of all descriptions, bios and comments'},
+    'summarizeexif': {
+        'setup': 'mediagoblin.gmg_commands.summarizeexif:parser_setup',
+        'func': 'mediagoblin.gmg_commands.summarizeexif:summarizeexif',
+        'help': 'Store what is shown of the EXIF tags of older images'},
+    'cleanorphantags': {
+        'setup': 'mediagoblin.gmg_commands.cleanorphantags:parser_setup',
+        'func': 'mediagoblin.gmg_commands.cleanorphantags:cleanorphantags',
+        'help': 'Delete all tags no media entry uses anymore'},
+    'reindex': {
+        'setup': 'mediagoblin.gmg_commands.reindex:parser_setup',
+        'func': 'mediagoblin.gmg_commands.reindex:reindex',
+        'help': 'Build the search index from all media entries'},
     'alembic': {
         'setup': 'mediagoblin.gmg_commands.alembic_commands:parser_setup',
         'func': 'mediagoblin.gmg_commands.alembic_commands:raw_alembic_cli',
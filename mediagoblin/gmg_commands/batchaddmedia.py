@@ -16,17 +16,25 @@
 
 from __future__ import print_function, unicode_literals
 
+import collections
 import csv
+import datetime
+import io
+import json
 import os
 import shutil
 import tempfile
+import time
+from multiprocessing.pool import ThreadPool
 
 import requests
 import six
 from six.moves.urllib.parse import urlparse
 
+from mediagoblin import mg_globals
 from mediagoblin.db.models import LocalUser, MediaEntry
 from mediagoblin.gmg_commands import util as commands_util
+from mediagoblin.media_types import sniff_media
 from mediagoblin.submit.lib import (
     submit_media, FileUploadLimit, UserUploadLimit, UserPastUploadLimit)
 from mediagoblin.tools.metadata import compact_and_validate
@@ -52,6 +60,157 @@ documentation page on command line uploading
         '--celery',
         action='store_true',
         help=_("Don't process eagerly, pass off to celery"))
+    subparser.add_argument(
+        '--jobs', '-j',
+        type=int,
+        default=1,
+        help=_("Number of files to download and sniff at the same time"))
+    subparser.add_argument(
+        '--checkpoint',
+        help=_(
+"""File listing the locations already imported, so they are skipped when
+the import is run again (default: the csv file's path + ".imported")"""))
+
+
+class FetchError(Exception):
+    """
+    The media file of a row could not be fetched
+    """
+    pass
+
+
+def fetch_media(location, metadata_dir):
+    """
+    Open the media file at location, a URL or a path relative to
+    metadata_dir, and sniff it.
+
+    This is what the worker threads do; it doesn't touch the database.
+    Returns the file, its filename and what sniff_media returned.
+    """
+    url = urlparse(location)
+    filename = url.path.split()[-1]
+
+    if url.scheme.startswith('http'):
+        res = requests.get(url.geturl(), stream=True)
+        if res.headers.get('content-encoding'):
+            # The requests library's "raw" method does not deal with content
+            # encoding. Alternative could be to use iter_content(), and
+            # write chunks to the temporary file.
+            raise NotImplementedError('URL-based media with content-encoding (eg. gzip) are not currently supported.')
+
+        # To avoid loading the media into memory all at once, we write it to
+        # a file before importing. This currently requires free space up to
+        # twice the size of the media file. Memory use can be tested by
+        # running something like `ulimit -Sv 200000` before running
+        # `batchaddmedia` to upload a file larger than 200MB.
+        media_file = tempfile.TemporaryFile()
+        shutil.copyfileobj(res.raw, media_file)
+        if six.PY2:
+            media_file.seek(0)
+
+    elif url.scheme == '':
+        path = url.path
+        if os.path.isabs(path):
+            file_abs_path = os.path.abspath(path)
+        else:
+            file_path = os.path.join(metadata_dir, path)
+            file_abs_path = os.path.abspath(file_path)
+        try:
+            media_file = open(file_abs_path, 'rb')
+        except IOError:
+            raise FetchError(_("""\
+FAIL: Local file {filename} could not be accessed.
+{filename} will not be uploaded.""").format(filename=filename))
+
+    else:
+        raise FetchError(_(
+            "FAIL: {location} is neither a http(s) URL nor a path.").format(
+                location=location))
+
+    try:
+        sniffed = sniff_media(media_file, filename)
+    except:
+        media_file.close()
+        raise
+    return media_file, filename, sniffed
+
+
+def _setup_worker(translations):
+    # Translations are per thread, messages are translated in workers too
+    mg_globals.thread_scope.translations = translations
+
+
+class SerialResult(object):
+    """
+    Stands in for the AsyncResult of a ThreadPool when there are no
+    worker threads, calling function only once its result is needed
+    """
+    def __init__(self, function, args):
+        self.function = function
+        self.args = args
+
+    def get(self):
+        return self.function(*self.args)
+
+
+class ImportCheckpoint(object):
+    """
+    The locations which have been imported, kept in a file with one JSON
+    encoded location per line
+    """
+    def __init__(self, path):
+        self.path = path
+        self.locations = set()
+        if os.path.exists(path):
+            with io.open(path, encoding='utf-8') as checkpoint_file:
+                for line in checkpoint_file:
+                    if line.strip():
+                        self.locations.add(json.loads(line))
+        self._file = io.open(path, 'a', encoding='utf-8')
+
+    def __contains__(self, location):
+        return location in self.locations
+
+    def add(self, location):
+        self.locations.add(location)
+        self._file.write(six.text_type(json.dumps(location)) + '\n')
+        # Flush right away, an interrupted import is what this is for
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class ImportProgress(object):
+    """
+    Prints every interval seconds how many rows are done, how fast that
+    goes and how much longer it will take
+    """
+    def __init__(self, total, interval=10):
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.started = self.last_report = time.time()
+
+    def row_done(self):
+        self.done += 1
+        now = time.time()
+        if now - self.last_report >= self.interval:
+            self.report(now)
+
+    def report(self, now=None):
+        now = now or time.time()
+        self.last_report = now
+        elapsed = now - self.started
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        if rate:
+            eta = datetime.timedelta(
+                seconds=int((self.total - self.done) / rate))
+        else:
+            eta = _('unknown')
+        print(_(
+"{done} of {total} rows done ({rate:.2f} rows/s), time left: {eta}").format(
+            done=self.done, total=self.total, rate=rate, eta=eta))
 
 
 def batchaddmedia(args):
@@ -61,7 +220,7 @@ def batchaddmedia(args):
 
     app = commands_util.setup_app(args)
 
-    files_uploaded, files_attempted = 0, 0
+    files_uploaded, files_attempted, files_skipped = 0, 0, 0
 
     # get the user
     user = app.db.LocalUser.query.filter(
@@ -84,107 +243,57 @@ def batchaddmedia(args):
     abs_metadata_filename = os.path.abspath(metadata_path)
     abs_metadata_dir = os.path.dirname(abs_metadata_filename)
 
-    all_metadata = open(abs_metadata_filename, 'r')
-    media_metadata = csv.DictReader(all_metadata)
-    for index, file_metadata in enumerate(media_metadata):
-        if six.PY2:
-            file_metadata = {k.decode('utf-8'): v.decode('utf-8') for k, v in file_metadata.items()}
+    with open(abs_metadata_filename, 'r') as all_metadata:
+        media_metadata = list(csv.DictReader(all_metadata))
 
-        files_attempted += 1
-        # In case the metadata was not uploaded initialize an empty dictionary.
-        json_ld_metadata = compact_and_validate({})
+    checkpoint = ImportCheckpoint(
+        args.checkpoint or abs_metadata_filename + '.imported')
+    progress = ImportProgress(len(media_metadata))
 
-        # Get all metadata entries starting with 'media' as variables and then
-        # delete them because those are for internal use only.
-        original_location = file_metadata['location']
+    # One query for the slugs instead of one per row
+    existing_slugs = set(
+        slug for (slug,) in MediaEntry.query.filter_by(
+            actor=user.id).with_entities(MediaEntry.slug))
 
-        ### Pull the important media information for mediagoblin from the
-        ### metadata, if it is provided.
-        slug = file_metadata.get('slug')
-        title = file_metadata.get('title') or file_metadata.get('dc:title')
-        description = (file_metadata.get('description') or
-            file_metadata.get('dc:description'))
-        collection_slug = file_metadata.get('collection-slug')
+    # Files are downloaded and sniffed by the pool (at most two per
+    # worker ahead of the row being submitted), submitting them touches
+    # the database and so happens here, in order
+    jobs = max(args.jobs, 1)
+    if jobs > 1:
+        pool = ThreadPool(jobs, _setup_worker,
+                          (mg_globals.thread_scope.translations,))
+        fetch = lambda *fetch_args: pool.apply_async(fetch_media, fetch_args)
+    else:
+        pool = None
+        fetch = lambda *fetch_args: SerialResult(fetch_media, fetch_args)
+    pending = collections.deque()
 
-        license = file_metadata.get('license')
+    def submit_row(row):
+        original_location, slug, submit_kwargs, fetched = row
         try:
-            json_ld_metadata = compact_and_validate(file_metadata)
-        except ValidationError as exc:
-            media_id = file_metadata.get('id') or index
-            error = _("""Error with media '{media_id}' value '{error_path}': {error_msg}
-Metadata was not uploaded.""".format(
-                media_id=media_id,
-                error_path=exc.path[0],
-                error_msg=exc.message))
-            print(error)
-            continue
-
-        if slug and MediaEntry.query.filter_by(actor=user.id, slug=slug).count():
-            # Avoid re-importing media from a previous batch run. Note that this
-            # check isn't quite robust enough, since it requires that a slug is
-            # specified. Probably needs to be based on "location" since this is
-            # the only required field.
-            error = '{}: {}'.format(
-                slug, _('An entry with that slug already exists for this user.'))
-            print(error)
-            continue
-
-        url = urlparse(original_location)
-        filename = url.path.split()[-1]
-
-        if url.scheme.startswith('http'):
-            res = requests.get(url.geturl(), stream=True)
-            if res.headers.get('content-encoding'):
-                # The requests library's "raw" method does not deal with content
-                # encoding. Alternative could be to use iter_content(), and
-                # write chunks to the temporary file.
-                raise NotImplementedError('URL-based media with content-encoding (eg. gzip) are not currently supported.')
-
-            # To avoid loading the media into memory all at once, we write it to
-            # a file before importing. This currently requires free space up to
-            # twice the size of the media file. Memory use can be tested by
-            # running something like `ulimit -Sv 200000` before running
-            # `batchaddmedia` to upload a file larger than 200MB.
-            media_file = tempfile.TemporaryFile()
-            shutil.copyfileobj(res.raw, media_file)
-            if six.PY2:
-                media_file.seek(0)
-
-        elif url.scheme == '':
-            path = url.path
-            if os.path.isabs(path):
-                file_abs_path = os.path.abspath(path)
-            else:
-                file_path = os.path.join(abs_metadata_dir, path)
-                file_abs_path = os.path.abspath(file_path)
-            try:
-                media_file = open(file_abs_path, 'rb')
-            except IOError:
-                print(_("""\
-FAIL: Local file {filename} could not be accessed.
-{filename} will not be uploaded.""".format(filename=filename)))
-                continue
+            media_file, filename, sniffed = fetched.get()
+        except FetchError as exc:
+            print(six.text_type(exc))
+            return False
+
         try:
             entry = submit_media(
                 mg_app=app,
                 user=user,
                 submitted_file=media_file,
                 filename=filename,
-                title=title,
-                description=description,
-                collection_slug=collection_slug,
-                license=license,
-                metadata=json_ld_metadata,
-                tags_string="")
+                sniffed=sniffed,
+                **submit_kwargs)
             if slug:
                 # Slug is automatically set by submit_media, so overwrite it
                 # with the desired slug.
                 entry.slug = slug
                 entry.save()
+            checkpoint.add(original_location)
             print(_("""Successfully submitted {filename}!
 Be sure to look at the Media Processing Panel on your website to be sure it
 uploaded successfully.""".format(filename=filename)))
-            files_uploaded += 1
+            return True
         except FileUploadLimit:
             print(_(
 "FAIL: This file is larger than the upload limits for this site."))
@@ -195,6 +304,92 @@ uploaded successfully.""".format(filename=filename)))
             print(_("FAIL: This user is already past their upload limits."))
         finally:
             media_file.close()
+        return False
+
+    try:
+        for index, file_metadata in enumerate(media_metadata):
+            if six.PY2:
+                file_metadata = {k.decode('utf-8'): v.decode('utf-8') for k, v in file_metadata.items()}
+
+            files_attempted += 1
+            # In case the metadata was not uploaded initialize an empty dictionary.
+            json_ld_metadata = compact_and_validate({})
+
+            # Get all metadata entries starting with 'media' as variables and then
+            # delete them because those are for internal use only.
+            original_location = file_metadata['location']
+
+            if original_location in checkpoint:
+                # Imported by a previous run of this batch
+                files_skipped += 1
+                progress.row_done()
+                continue
+
+            ### Pull the important media information for mediagoblin from the
+            ### metadata, if it is provided.
+            slug = file_metadata.get('slug')
+            title = file_metadata.get('title') or file_metadata.get('dc:title')
+            description = (file_metadata.get('description') or
+                file_metadata.get('dc:description'))
+            collection_slug = file_metadata.get('collection-slug')
+
+            license = file_metadata.get('license')
+            try:
+                json_ld_metadata = compact_and_validate(file_metadata)
+            except ValidationError as exc:
+                media_id = file_metadata.get('id') or index
+                error = _("""Error with media '{media_id}' value '{error_path}': {error_msg}
+Metadata was not uploaded.""".format(
+                    media_id=media_id,
+                    error_path=exc.path[0],
+                    error_msg=exc.message))
+                print(error)
+                progress.row_done()
+                continue
+
+            if slug and slug in existing_slugs:
+                # Avoid re-importing media from a previous batch run
+                # which wasn't recorded in the checkpoint.
+                error = '{}: {}'.format(
+                    slug, _('An entry with that slug already exists for this user.'))
+                print(error)
+                progress.row_done()
+                continue
+
+            if slug:
+                # Taken by this row, even while it's still being fetched
+                existing_slugs.add(slug)
+
+            submit_kwargs = dict(
+                title=title,
+                description=description,
+                collection_slug=collection_slug,
+                license=license,
+                metadata=json_ld_metadata,
+                tags_string="")
+            pending.append((
+                original_location, slug, submit_kwargs,
+                fetch(original_location, abs_metadata_dir)))
+
+            while len(pending) > 2 * jobs or (pending and pool is None):
+                if submit_row(pending.popleft()):
+                    files_uploaded += 1
+                progress.row_done()
+
+        while pending:
+            if submit_row(pending.popleft()):
+                files_uploaded += 1
+            progress.row_done()
+    finally:
+        if pool is not None:
+            pool.terminate()
+        checkpoint.close()
+
+    progress.report()
+    if files_skipped:
+        print(_(
+"{files_skipped} files were skipped, they were imported before").format(
+            files_skipped=files_skipped))
     print(_(
 "{files_uploaded} out of {files_attempted} files successfully submitted".format(
         files_uploaded=files_uploaded,
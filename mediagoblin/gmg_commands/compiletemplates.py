@@ -0,0 +1,62 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function
+import sys
+
+from jinja2 import TemplateSyntaxError
+
+from mediagoblin.gmg_commands import util as commands_util
+from mediagoblin.tools.template import get_jinja_env
+
+
+def parser_setup(subparser):
+    pass
+
+
+def compile_templates(app):
+    """
+    Compile all local, theme, plugin and core templates into the
+    bytecode cache.
+
+    Returns the number of compiled templates and a list of
+    (template name, error) for those which failed to compile.
+    """
+    template_env = get_jinja_env(app, app.template_loader, 'en')
+    compiled = 0
+    failed = []
+    for template_name in app.template_loader.list_templates():
+        try:
+            template_env.get_template(template_name)
+        except (TemplateSyntaxError, UnicodeDecodeError) as error:
+            # Not a template or a broken one, which would fail when used
+            failed.append((template_name, error))
+        else:
+            compiled += 1
+    return compiled, failed
+
+
+def compiletemplates(args):
+    app = commands_util.setup_app(args)
+
+    if app.template_bytecode_cache is None:
+        print('No bytecode_cache_dir set in [jinja2], nothing to do.')
+        sys.exit(1)
+
+    compiled, failed = compile_templates(app)
+    for template_name, error in failed:
+        print('Could not compile %s: %s' % (template_name, error))
+    print('Compiled %d templates.' % compiled)
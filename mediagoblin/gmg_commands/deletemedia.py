@@ -17,6 +17,7 @@
 from __future__ import print_function
 import sys
 
+from mediagoblin.db.deletion import delete_media_entries
 from mediagoblin.gmg_commands import util as commands_util
 
 
@@ -25,6 +26,10 @@ def parser_setup(subparser):
                            help='Comma separated list of media IDs will be deleted.')
 
 
+def print_progress(deleted, total):
+    print('Deleted %d of %d media entries.' % (deleted, total))
+
+
 def deletemedia(args):
     app = commands_util.setup_app(args)
 
@@ -32,14 +37,11 @@ def deletemedia(args):
     if not media_ids:
         print('Can\'t find any valid media ID(s).')
         sys.exit(1)
-    found_medias = set()
     filter_ids = app.db.MediaEntry.id.in_(media_ids)
-    medias = app.db.MediaEntry.query.filter(filter_ids).all()
-    for media in medias:
-        found_medias.add(media.id)
-        media.delete()
-        print('Media ID %d has been deleted.' % media.id)
+    found_medias = set(media_id for (media_id,) in app.db.MediaEntry.query.filter(
+        filter_ids).with_entities(app.db.MediaEntry.id))
     for media in media_ids - found_medias:
         print('Can\'t find a media with ID %d.' % media)
+    delete_media_entries(found_medias, progress=print_progress)
     print('Done.')
     sys.exit(0)
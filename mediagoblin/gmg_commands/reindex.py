@@ -0,0 +1,43 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function
+
+import sys
+
+from mediagoblin.gmg_commands import util as commands_util
+from mediagoblin.search.lib import DOCUMENT_BATCH_SIZE, get_search_index, \
+    reindex_media
+
+
+def parser_setup(subparser):
+    subparser.add_argument(
+        '--batch-size', type=int, default=DOCUMENT_BATCH_SIZE,
+        help='How many media entries to index before committing')
+
+
+def print_progress(indexed, total):
+    print('Indexed %d of %d media entries.' % (indexed, total))
+
+
+def reindex(args):
+    commands_util.setup_app(args)
+
+    if get_search_index() is None:
+        print('Search is disabled, see search_index in the config.')
+        sys.exit(1)
+    reindex_media(args.batch_size, progress=print_progress)
+    print('Done.')
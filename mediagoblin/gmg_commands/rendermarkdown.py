@@ -0,0 +1,72 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function
+
+from sqlalchemy import or_
+
+from mediagoblin.db.base import Session
+from mediagoblin.db.models import User, MediaEntry, TextComment, Collection
+from mediagoblin.gmg_commands import util as commands_util
+from mediagoblin.tools.text import MARKDOWN_RENDERER
+
+
+def parser_setup(subparser):
+    subparser.add_argument(
+        '--batch-size', type=int, default=500,
+        help='How many objects to render before committing')
+    subparser.add_argument(
+        '--all', action='store_true',
+        help='Also render objects rendered by the current renderer')
+
+
+def render_markdown(model, batch_size=500, render_all=False):
+    """
+    Store the HTML of all objects of model whose HTML is missing or was
+    rendered by another renderer, batch_size objects per transaction.
+
+    Returns the number of rendered objects.
+    """
+    query = model.query.order_by(model.id)
+    if not render_all:
+        query = query.filter(or_(model.html_renderer == None,
+                                 model.html_renderer != MARKDOWN_RENDERER))
+
+    rendered = 0
+    last_id = None
+    while True:
+        batch_query = query
+        if last_id is not None:
+            batch_query = batch_query.filter(model.id > last_id)
+        batch = batch_query.limit(batch_size).all()
+        if not batch:
+            return rendered
+
+        for obj in batch:
+            obj.render_markdown()
+        last_id = batch[-1].id
+        rendered += len(batch)
+        Session.commit()
+        # Don't keep what is done in memory
+        Session.expunge_all()
+
+
+def rendermarkdown(args):
+    commands_util.setup_app(args)
+
+    for model in (User, MediaEntry, TextComment, Collection):
+        rendered = render_markdown(model, args.batch_size, args.all)
+        print('Rendered %d %s.' % (rendered, model.__tablename__))
@@ -0,0 +1,75 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function
+
+from sqlalchemy.orm import undefer
+
+from mediagoblin.db.base import Session
+from mediagoblin.gmg_commands import util as commands_util
+from mediagoblin.tools.exif import summarize_exif, exif_dimensions
+
+
+def parser_setup(subparser):
+    subparser.add_argument(
+        '--batch-size', type=int, default=500,
+        help='How many images to summarize before committing')
+
+
+def summarize_images(batch_size=500):
+    """
+    Store the EXIF summary of all images processed before summaries
+    were stored, batch_size images per transaction.
+
+    Returns the number of summarized images.
+    """
+    # Import here, the image media type might not be enabled
+    from mediagoblin.media_types.image.models import ImageData
+
+    query = ImageData.query.filter(ImageData.has_exif == None).options(
+        undefer(ImageData.exif_all)).order_by(ImageData.media_entry)
+
+    summarized = 0
+    while True:
+        # Summarized images don't match the query anymore
+        batch = query.limit(batch_size).all()
+        if not batch:
+            return summarized
+
+        for image in batch:
+            exif_all = image.exif_all or {}
+            for field, value in summarize_exif(exif_all).items():
+                setattr(image, field, value)
+            image.has_exif = bool(exif_all)
+
+            if image.width is None:
+                metadata = image.get_media_entry.get_file_metadata(
+                    'original') or {}
+                dimensions = (metadata.get('width'), metadata.get('height'))
+                if None in dimensions:
+                    dimensions = exif_dimensions(exif_all)
+                if dimensions:
+                    image.width, image.height = dimensions
+        summarized += len(batch)
+        Session.commit()
+        # Don't keep what is done in memory
+        Session.expunge_all()
+
+
+def summarizeexif(args):
+    commands_util.setup_app(args)
+
+    print('Summarized EXIF of %d images.' % summarize_images(args.batch_size))
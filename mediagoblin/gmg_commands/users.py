@@ -24,6 +24,7 @@ from mediagoblin.db.models import LocalUser
 from mediagoblin.gmg_commands import util as commands_util
 from mediagoblin import auth
 from mediagoblin import mg_globals
+from mediagoblin.tools.session import get_session_store
 
 def adduser_parser_setup(subparser):
     subparser.add_argument(
@@ -147,8 +148,45 @@ def deleteuser(args):
         LocalUser.username==args.username.lower()
     ).first()
     if user:
-        user.delete()
+        def print_progress(deleted, total):
+            print('Deleted %d of %d media entries.' % (deleted, total))
+
+        user.delete(progress=print_progress)
         print('The user %s has been deleted.' % args.username)
     else:
         print('The user %s doesn\'t exist.' % args.username)
         sys.exit(1)
+
+
+def revokesessions_parser_setup(subparser):
+    subparser.add_argument(
+        'usernames',
+        help="Users to log out, everybody if none are given",
+        nargs='*',
+        type=six.text_type)
+
+
+def revokesessions(args):
+    app = commands_util.setup_app(args)
+
+    session_store = get_session_store(app.app_config)
+    if session_store is None:
+        print(u'Sessions are kept in cookies, set session_store to be '
+              u'able to revoke them.')
+        sys.exit(1)
+
+    if not args.usernames:
+        session_store.delete_all()
+        print(u'Everybody has been logged out.')
+        return
+
+    db = mg_globals.database
+    for username in args.usernames:
+        user = db.LocalUser.query.filter(
+            LocalUser.username==username.lower()
+        ).first()
+        if user:
+            session_store.delete_user_sessions(user.id)
+            print(u'The user %s has been logged out.' % username)
+        else:
+            print(u'The user %s doesn\'t exist.' % username)
@@ -14,6 +14,9 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import hashlib
+import os
+
 import jinja2
 
 from mediagoblin.tools import staticdirect
@@ -121,6 +124,39 @@ def get_jinja_loader(user_template_path=None, current_theme=None,
     return jinja2.ChoiceLoader(path_list)
 
 
+def get_jinja_bytecode_cache(cache_dir, user_template_path=None,
+                             current_theme=None, plugin_template_paths=None,
+                             template_hooks=None, extensions=None):
+    """
+    Set up the on-disk cache of compiled templates, or return None if
+    cache_dir is not set.
+
+    Jinja checks cached templates against their source, but which source a
+    template name resolves to and which hook templates get inlined into it
+    depend on the theme and plugins.  So each combination of those (and
+    of the MediaGoblin/Jinja versions and extensions) gets its own
+    subdirectory.
+    """
+    if not cache_dir:
+        return None
+
+    from mediagoblin import _version
+    key = repr([
+        _version.__version__, jinja2.__version__,
+        user_template_path,
+        current_theme and current_theme.get('templates_dir'),
+        list(plugin_template_paths or []),
+        sorted((hook, list(templates))
+               for hook, templates in (template_hooks or {}).items()),
+        list(extensions or [])])
+    cache_dir = os.path.join(
+        cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest()[:16])
+
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    return jinja2.FileSystemBytecodeCache(cache_dir)
+
+
 def get_staticdirector(app_config):
     # At minimum, we need the direct_remote_path
     if not 'direct_remote_path' in app_config \
@@ -17,10 +17,11 @@
 from mediagoblin import mg_globals
 from mediagoblin.db.models import MediaEntry
 from mediagoblin.db.util import media_entries_for_tag_slug
-from mediagoblin.decorators import uses_pagination
+from mediagoblin.decorators import uses_pagination, cache_response
 from mediagoblin.plugins.api.tools import get_media_file_paths
-from mediagoblin.tools.pagination import Pagination
+from mediagoblin.tools.pagination import KeysetPagination
 from mediagoblin.tools.response import render_to_response
+from mediagoblin.tools.response_cache import query_validators
 
 from werkzeug.contrib.atom import AtomFeed
 
@@ -46,10 +47,13 @@ def tag_listing(request, page):
     """'Gallery'/listing for this tag slug"""
     tag_slug = request.matchdict[u'tag']
 
-    cursor = media_entries_for_tag_slug(request.db, tag_slug)
+    cursor = MediaEntry.for_listing(
+        media_entries_for_tag_slug(request.db, tag_slug))
     cursor = cursor.order_by(MediaEntry.created.desc())
 
-    pagination = Pagination(page, cursor)
+    pagination = KeysetPagination(
+        page, cursor, page_key=request.page_key,
+        count_cache_key=('tag_listing', tag_slug))
     media_entries = pagination()
 
     tag_name = _get_tag_name_from_entries(media_entries, tag_slug)
@@ -66,6 +70,18 @@ def tag_listing(request, page):
 ATOM_DEFAULT_NR_OF_UPDATED_ITEMS = 15
 
 
+def _get_feed_entries(request):
+    tag_slug = request.matchdict.get(u'tag')
+    if tag_slug:
+        return media_entries_for_tag_slug(request.db, tag_slug)
+    return MediaEntry.query.filter_by(state=u'processed')
+
+
+def _atom_feed_validators(request):
+    return query_validators(_get_feed_entries(request), MediaEntry.updated)
+
+
+@cache_response(_atom_feed_validators, shared=True)
 def atom_feed(request):
     """
     generates the atom feed with the tag images
@@ -76,11 +92,10 @@ def atom_feed(request):
         feed_title += " for tag '%s'" % tag_slug
         link = request.urlgen('mediagoblin.listings.tags_listing',
                               qualified=True, tag=tag_slug )
-        cursor = media_entries_for_tag_slug(request.db, tag_slug)
     else: # all recent item feed
         feed_title += " for all recent items"
         link = request.urlgen('index', qualified=True)
-        cursor = MediaEntry.query.filter_by(state=u'processed')
+    cursor = MediaEntry.for_listing(_get_feed_entries(request))
     cursor = cursor.order_by(MediaEntry.created.desc())
     cursor = cursor.limit(ATOM_DEFAULT_NR_OF_UPDATED_ITEMS)
 
@@ -19,7 +19,9 @@ import logging
 import shutil
 import tempfile
 
-from mediagoblin.tools.pluginapi import hook_handle
+import six
+
+from mediagoblin.tools.pluginapi import hook_handle, PluginManager
 from mediagoblin.tools.translate import lazy_pass_to_ugettext as _
 
 _log = logging.getLogger(__name__)
@@ -59,14 +61,121 @@ class MediaManagerBase(object):
         return hasattr(self, i)
 
 
+# How many bytes of an upload sniffers can look at through SniffedFile.header
+SNIFF_HEADER_SIZE = 4096
+
+
+def get_local_path(media_file):
+    '''
+    Return the path of the file on disk behind media_file, or None if it
+    doesn't have one (eg. an in-memory upload).
+    '''
+    # werkzeug's FileStorage wraps the actual file
+    media_file = getattr(media_file, 'stream', media_file)
+    name = getattr(media_file, 'name', None)
+    if isinstance(name, six.string_types) and os.path.isabs(name) \
+            and os.path.isfile(name):
+        return name
+    return None
+
+
+class SniffedFile(object):
+    '''
+    What sniffers get to look at an upload.
+
+    Reading the first SNIFF_HEADER_SIZE bytes (for magic numbers and the
+    like) through header is cheap.  Sniffers that need a real file on disk
+    (eg. gstreamer discovery) use name, which reuses the upload's own
+    path if it has one and only otherwise copies it to a temporary file,
+    once.  read(), seek() and tell() work on the upload itself.
+    '''
+    def __init__(self, media_file):
+        self.media_file = media_file
+        self._header = None
+        self._name = None
+        self._tmp_file = None
+
+    @property
+    def header(self):
+        if self._header is None:
+            position = self.media_file.tell()
+            self._header = self.media_file.read(SNIFF_HEADER_SIZE)
+            self.media_file.seek(position)
+        return self._header
+
+    @property
+    def name(self):
+        if self._name is None:
+            # Make sure anything written to the upload is on disk
+            if hasattr(self.media_file, 'flush'):
+                self.media_file.flush()
+            self._name = get_local_path(self.media_file)
+
+        if self._name is None:
+            _log.debug('Copying upload to a temporary file for sniffing')
+            self._tmp_file = tempfile.NamedTemporaryFile()
+            position = self.media_file.tell()
+            self.media_file.seek(0)
+            shutil.copyfileobj(self.media_file, self._tmp_file)
+            self.media_file.seek(position)
+            self._tmp_file.flush()
+            self._name = self._tmp_file.name
+
+        return self._name
+
+    def read(self, *args):
+        return self.media_file.read(*args)
+
+    def seek(self, *args):
+        return self.media_file.seek(*args)
+
+    def tell(self):
+        return self.media_file.tell()
+
+    def close(self):
+        if self._tmp_file is not None:
+            self._tmp_file.close()
+            self._tmp_file = None
+            self._name = None
+
+
+def get_sniff_header(media_file):
+    '''
+    Return the first SNIFF_HEADER_SIZE bytes of media_file without moving
+    its position, for sniffers that only need to check magic numbers
+    '''
+    if isinstance(media_file, SniffedFile):
+        return media_file.header
+    position = media_file.tell()
+    header = media_file.read(SNIFF_HEADER_SIZE)
+    media_file.seek(position)
+    return header
+
+
 def sniff_media_contents(media_file, filename):
     '''
     Check media contents using 'expensive' scanning. For example, for video it
     is checking the contents using gstreamer
+
+    Sniffers which don't set a true needs_local_file attribute run first, so
+    that an upload is only copied to disk if none of them accepts it and a
+    sniffer that needs a real file gets to look at it.
     :param media_file: file-like object with 'name' attribute
     :param filename: expected filename of the media
     '''
-    media_type = hook_handle('sniff_handler', media_file, filename)
+    sniffers = PluginManager().get_hook_callables('sniff_handler')
+    sniffers = \
+        [sniffer for sniffer in sniffers
+         if not getattr(sniffer, 'needs_local_file', False)] + \
+        [sniffer for sniffer in sniffers
+         if getattr(sniffer, 'needs_local_file', False)]
+
+    media_type = None
+    for sniffer in sniffers:
+        media_type = sniffer(media_file, filename)
+        if media_type is not None:
+            break
+
     if media_type:
         _log.info('{0} accepts the file'.format(media_type))
         return media_type, hook_handle(('media_manager', media_type))
@@ -141,23 +250,22 @@ def sniff_media(media_file, filename):
     Iterate through the enabled media types and find those suited
     for a certain file.
     '''
-    # copy the contents to a .name-enabled temporary file for further checks
-    # TODO: there are cases when copying is not required
-    tmp_media_file = tempfile.NamedTemporaryFile()
-    shutil.copyfileobj(media_file, tmp_media_file)
-    media_file.seek(0)
-    tmp_media_file.seek(0)
+    # Sniffers only get a copy of the contents on disk if they ask for one
+    sniffed_file = SniffedFile(media_file)
     try:
-        return type_match_handler(tmp_media_file, filename)
-    except TypeNotFound as e:
-        _log.info('No plugins using two-step checking found')
+        try:
+            return type_match_handler(sniffed_file, filename)
+        except TypeNotFound as e:
+            _log.info('No plugins using two-step checking found')
 
-    # keep trying, using old `get_media_type_and_manager`
-    try:
-        return get_media_type_and_manager(filename)
-    except TypeNotFound as e:
-        # again, no luck. Do it expensive way
-        _log.info('No media handler found by file extension')
-    _log.info('Doing it the expensive way...')
-    return sniff_media_contents(tmp_media_file, filename)
+        # keep trying, using old `get_media_type_and_manager`
+        try:
+            return get_media_type_and_manager(filename)
+        except TypeNotFound as e:
+            # again, no luck. Do it expensive way
+            _log.info('No media handler found by file extension')
+        _log.info('Doing it the expensive way...')
+        return sniff_media_contents(sniffed_file, filename)
+    finally:
+        sniffed_file.close()
 
@@ -28,6 +28,11 @@ import os
 
 _log = logging.getLogger(__name__)
 
+# Larger images are drawn in strips of STRIP_LINES lines by
+# AsciiToImage.create_thumbnail
+MAX_PIXELS = 4096 * 4096
+STRIP_LINES = 256
+
 
 class AsciiToImage(object):
     '''
@@ -38,6 +43,9 @@ class AsciiToImage(object):
       default: fonts/Inconsolata.otf
     - font_size: Font size, ``int``
       default: 11
+    - max_pixels: Size of the largest image create_thumbnail draws as a
+      whole, ``int``
+      default: MAX_PIXELS
     '''
     def __init__(self, **kw):
         self._font = kw.get('font', pkg_resources.resource_filename(
@@ -45,6 +53,7 @@ class AsciiToImage(object):
                 os.path.join('fonts', 'Inconsolata.otf')))
 
         self._font_size = kw.get('font_size', 11)
+        self._max_pixels = kw.get('max_pixels', MAX_PIXELS)
 
         self._if = ImageFont.truetype(
             self._font,
@@ -62,6 +71,9 @@ class AsciiToImage(object):
         self._if_dims = self._if.getsize('.')
         #                               `---'
 
+        # Each character's mask and offset, see _glyph
+        self._glyphs = {}
+
     def convert(self, text, destination):
         # TODO: Detect if text is a file-like, if so, act accordingly
         im = self._create_image(text)
@@ -71,27 +83,60 @@ class AsciiToImage(object):
             _log.info('Saved image in {0}'.format(
                     destination))
 
-    def _create_image(self, text):
+    def _glyph(self, char):
         '''
-        Write characters to a PIL image canvas.
+        The mask and offset for drawing char, rasterized once per character
 
-        TODO:
-        - Character set detection and decoding,
-          http://pypi.python.org/pypi/chardet
+        The mask is None for characters which don't draw anything, like
+        spaces.
         '''
-        _log.debug('Drawing image')
+        try:
+            return self._glyphs[char]
+        except KeyError:
+            pass
+
+        mask, offset = self._if.getmask2(char, 'L')
+        if not mask.size[0] or not mask.size[1]:
+            glyph = (None, offset)
+        else:
+            # Draw the character the way ImageDraw.text would, but onto a
+            # tile of its own
+            tile = Image.new('L', mask.size, 0)
+            ImageDraw.Draw(tile).text(
+                (-offset[0], -offset[1]), char, font=self._if, fill=255)
+            if not tile.getbbox():
+                tile = None
+            glyph = (tile, offset)
+
+        self._glyphs[char] = glyph
+        return glyph
+
+    def _split_lines(self, text):
         # Convert the input from str to unicode
         text = text.decode('utf-8')
 
         # TODO: Account for alternative line endings
-        lines = text.split('\n')
+        return text.split('\n')
+
+    def _image_dims(self, lines):
+        '''
+        Destination size based on text input and character size
+        '''
+        return (
+            max(len(line) for line in lines) * self._if_dims[0],
+            len(lines) * self._if_dims[1])
 
-        line_lengths = [len(i) for i in lines]
+    def _create_image(self, text):
+        '''
+        Write characters to a PIL image canvas.
 
-        # Calculate destination size based on text input and character size
-        im_dims = (
-            max(line_lengths) * self._if_dims[0],
-            len(line_lengths) * self._if_dims[1])
+        TODO:
+        - Character set detection and decoding,
+          http://pypi.python.org/pypi/chardet
+        '''
+        _log.debug('Drawing image')
+        lines = self._split_lines(text)
+        im_dims = self._image_dims(lines)
 
         _log.info('Destination image dimensions will be {0}'.format(
                 im_dims))
@@ -100,47 +145,96 @@ class AsciiToImage(object):
             'RGBA',
             im_dims,
             (255, 255, 255, 0))
-
-        draw = ImageDraw.Draw(im)
-
-        char_pos = [0, 0]
-
-        for line in lines:
-            line_length = len(line)
-
-            _log.debug('Writing line at {0}'.format(char_pos))
-
-            for _pos in range(0, line_length):
-                char = line[_pos]
-
-                px_pos = self._px_pos(char_pos)
-
-                _log.debug('Writing character "{0}" at {1} (px pos {2})'.format(
-                        char.encode('ascii', 'replace'),
-                        char_pos,
-                        px_pos))
-
-                draw.text(
-                    px_pos,
-                    char,
-                    font=self._if,
-                    fill=(0, 0, 0, 255))
-
-                char_pos[0] += 1
-
-            # Reset X position, increment Y position
-            char_pos[0] = 0
-            char_pos[1] += 1
-
+        self._draw_lines(im, lines, 0, len(lines), 0)
         return im
 
-    def _px_pos(self, char_pos):
+    def _draw_lines(self, im, lines, start, stop, top):
         '''
-        Helper function to calculate the pixel position based on
-        character position and character dimensions
+        Draw lines[start:stop] onto im, whose first row is at pixel row
+        top of the whole image
         '''
-        px_pos = [0, 0]
-        for index, val in zip(range(0, len(char_pos)), char_pos):
-                px_pos[index] = char_pos[index] * self._if_dims[index]
+        for line_number in range(start, stop):
+            y = line_number * self._if_dims[1] - top
+            for column, char in enumerate(lines[line_number]):
+                tile, offset = self._glyph(char)
+                if tile is None:
+                    continue
+                # Pasting ink through the glyph blends exactly like
+                # ImageDraw.text does
+                im.paste(
+                    (0, 0, 0, 255),
+                    (column * self._if_dims[0] + offset[0], y + offset[1]),
+                    tile)
+
+    def _glyph_overhang(self, lines):
+        '''
+        How many pixels glyphs reach above and below their line
+        '''
+        above = below = 0
+        for char in set(u''.join(lines)):
+            tile, offset = self._glyph(char)
+            if tile is not None:
+                above = max(above, -offset[1])
+                below = max(below, offset[1] + tile.size[1] - self._if_dims[1])
+        return above, below
+
+    def create_strips(self, text, strip_lines=STRIP_LINES):
+        '''
+        Yield the image _create_image would make, as (top, strip image)
+        for strips of strip_lines lines, so only one strip of a very large
+        image needs to be in memory.
 
-        return px_pos
+        Pixels match those of the whole image: the lines of the strips
+        around it which reach into a strip are drawn onto it as well.
+        '''
+        lines = self._split_lines(text)
+        width, height = self._image_dims(lines)
+        line_height = self._if_dims[1]
+        above, below = self._glyph_overhang(lines)
+        # Lines that far away can reach into a strip
+        lines_above = -(-below // line_height)
+        lines_below = -(-above // line_height)
+
+        for start in range(0, len(lines), strip_lines):
+            stop = min(start + strip_lines, len(lines))
+            top = start * line_height
+            strip = Image.new(
+                'RGBA',
+                (width, (stop - start) * line_height),
+                (255, 255, 255, 0))
+            self._draw_lines(
+                strip, lines, max(start - lines_above, 0),
+                min(stop + lines_below, len(lines)), top)
+            yield top, strip
+
+    def create_thumbnail(self, text, size):
+        '''
+        A thumbnail of the image of text, fitting into size
+
+        Images of more than max_pixels pixels are drawn and scaled down
+        in strips.
+        '''
+        lines = self._split_lines(text)
+        width, height = self._image_dims(lines)
+        if width * height <= self._max_pixels:
+            thumb = self._create_image(text)
+            thumb.thumbnail(size, Image.ANTIALIAS)
+            return thumb
+
+        # Like Image.thumbnail, keep the aspect ratio
+        scale = min(float(size[0]) / width, float(size[1]) / height, 1)
+        thumb_width = max(int(round(width * scale)), 1)
+        thumb = Image.new(
+            'RGBA',
+            (thumb_width, max(int(round(height * scale)), 1)),
+            (255, 255, 255, 0))
+        _log.info('Drawing {0}x{1} image in strips'.format(width, height))
+        for top, strip in self.create_strips(text):
+            strip_top = int(round(top * scale))
+            strip_bottom = int(round((top + strip.size[1]) * scale))
+            if strip_bottom > strip_top:
+                thumb.paste(
+                    strip.resize((thumb_width, strip_bottom - strip_top),
+                                 Image.ANTIALIAS),
+                    (0, strip_top))
+        return thumb
@@ -16,10 +16,6 @@
 import argparse
 import chardet
 import os
-try:
-    from PIL import Image
-except ImportError:
-    import Image
 import logging
 
 import six
@@ -140,10 +136,8 @@ class CommonAsciiProcessor(MediaProcessor):
             converter = asciitoimage.AsciiToImage(
                 **ascii_converter_args)
 
-            thumb = converter._create_image(
-                orig_file.read())
-
-            thumb.thumbnail(thumb_size, Image.ANTIALIAS)
+            thumb = converter.create_thumbnail(
+                orig_file.read(), thumb_size)
             thumb.save(tmp_thumb);
 
             thumb_info = {'font': font,
@@ -47,6 +47,9 @@ def sniff_handler(media_file, filename):
         return MEDIA_TYPE
     return None
 
+# gstreamer discovery needs the upload on disk, see sniff_media_contents
+sniff_handler.needs_local_file = True
+
 
 class CommonAudioProcessor(MediaProcessor):
     """
@@ -125,6 +128,7 @@ class CommonAudioProcessor(MediaProcessor):
             webm_audio_tmp,
             quality=quality,
             progress_callback=progress_callback)
+        progress_callback.flush()
 
         self._keep_best()
 
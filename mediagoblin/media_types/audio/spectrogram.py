@@ -28,6 +28,9 @@ except ImportError:
 import math
 import numpy
 
+from mediagoblin.media_types.audio.audioprocessing import compute_spectra, \
+    get_seek_points
+
 try:
     import scikits.audiolab as audiolab
 except ImportError:
@@ -82,6 +85,16 @@ class SpectrogramImage(object):
         # so we store all the pixels in an array and then create the image when saving
         self.pixels = []
 
+        # the same lookup as arrays, to draw all columns at once in draw_spectra
+        self.bin_indexes = numpy.array(
+            [index for (index, alpha) in self.y_to_bin], dtype=numpy.intp)
+        self.bin_alphas = numpy.array(
+            [alpha for (index, alpha) in self.y_to_bin], dtype=numpy.float64)
+        # RGBA palette, putdata() makes RGB colors opaque
+        self.palette_array = numpy.array(
+            [color + (255,) for color in self.palette], dtype=numpy.uint8)
+        self.image = None
+
     def draw_spectrum(self, x, spectrum):
         # for all frequencies, draw the pixels
         for index, alpha in self.y_to_bin:
@@ -93,13 +106,32 @@ class SpectrogramImage(object):
         for y in range(len(self.y_to_bin), self.image_height):
             self.pixels.append(self.palette[0])
 
+    def draw_spectra(self, spectra):
+        """ draw all columns at once from an array of db spectra of shape
+        (image_width, fft_size/2 + 1), such as returned by
+        audioprocessing.compute_spectra """
+        values = ((255.0 - self.bin_alphas) * spectra[:, self.bin_indexes]
+                  + self.bin_alphas * spectra[:, self.bin_indexes + 1])
+
+        color_indexes = numpy.zeros(
+            (self.image_width, self.image_height), dtype=numpy.intp)
+        color_indexes[:, :len(self.y_to_bin)] = values.astype(numpy.intp)
+
+        # low frequencies at the bottom, time from left to right
+        pixels = self.palette_array[color_indexes.T[::-1]]
+        self.image = Image.fromarray(numpy.ascontiguousarray(pixels), 'RGBA')
+
     def save(self, filename, quality=90):
-        self.image = Image.new(
-                'RGBA',
-                (self.image_height, self.image_width))
+        if self.image is None:
+            self.image = Image.new(
+                    'RGBA',
+                    (self.image_height, self.image_width))
+
+            self.image.putdata(self.pixels)
+            self.image = self.image.transpose(Image.ROTATE_90)
 
-        self.image.putdata(self.pixels)
-        self.image.transpose(Image.ROTATE_90).save(
+        # JPEG has no alpha channel
+        self.image.convert('RGB').save(
                 filename,
                 quality=quality)
 
@@ -170,7 +202,7 @@ class AudioProcessor(object):
 
         if resize_if_less and (add_to_start > 0 or add_to_end > 0):
             if add_to_start > 0:
-                samples = numpy.concatenate((numpy.zeros(add_to_start), samples), axis=1)
+                samples = numpy.concatenate((numpy.zeros(add_to_start), samples))
 
             if add_to_end > 0:
                 samples = numpy.resize(samples, size)
@@ -181,7 +213,7 @@ class AudioProcessor(object):
     def spectral_centroid(self, seek_point, spec_range=110.0):
         """ starting at seek_point read fft_size samples, and calculate the spectral centroid """
 
-        samples = self.read(seek_point - self.fft_size/2, self.fft_size, True)
+        samples = self.read(seek_point - self.fft_size // 2, self.fft_size, True)
 
         samples *= self.window
         fft = numpy.fft.rfft(samples)
@@ -198,7 +230,7 @@ class AudioProcessor(object):
         if energy > 1e-60:
             # calculate the spectral centroid
 
-            if self.spectrum_range == None:
+            if self.spectrum_range is None:
                 self.spectrum_range = numpy.arange(length)
 
             spectral_centroid = (spectrum * self.spectrum_range).sum() / (energy * (length - 1)) * self.audio_file.samplerate * 0.5
@@ -259,21 +291,16 @@ class AudioProcessor(object):
 def create_spectrogram_image(source_filename, output_filename,
         image_size, fft_size, progress_callback=None):
 
-    processor = AudioProcessor(source_filename, fft_size, numpy.hamming)
-    samples_per_pixel = processor.audio_file.nframes / float(image_size[0])
-
-    spectrogram = SpectrogramImage(image_size, fft_size)
-
-    for x in range(image_size[0]):
-        if progress_callback and x % (image_size[0] / 10) == 0:
-            progress_callback((x * 100) / image_size[0])
-
-        seek_point = int(x * samples_per_pixel)
-        next_seek_point = int((x + 1) * samples_per_pixel)
+    audio_file = audiolab.Sndfile(source_filename, 'r')
+    nframes = audio_file.nframes
+    audio_file.close()
 
-        (spectral_centroid, db_spectrum) = processor.spectral_centroid(seek_point)
+    spectra = compute_spectra(
+        source_filename, get_seek_points(nframes, image_size[0]),
+        fft_size, numpy.hamming, progress_callback=progress_callback)
 
-        spectrogram.draw_spectrum(x, db_spectrum)
+    spectrogram = SpectrogramImage(image_size, fft_size)
+    spectrogram.draw_spectra(spectra)
 
     if progress_callback:
         progress_callback(100)
@@ -57,25 +57,20 @@ class AudioThumbnailer(object):
         height = int(kw.get('height', float(width) * 0.3))
         fft_size = kw.get('fft_size', 2048)
         callback = kw.get('progress_callback')
-        processor = audioprocessing.AudioProcessor(
+
+        audio_file = audioprocessing.audiolab.Sndfile(src, 'r')
+        nframes = audio_file.nframes
+        audio_file.close()
+
+        spectra = audioprocessing.compute_spectra(
             src,
+            audioprocessing.get_seek_points(nframes, width),
             fft_size,
-            numpy.hanning)
-
-        samples_per_pixel = processor.audio_file.nframes / float(width)
+            numpy.hanning,
+            progress_callback=callback)
 
         spectrogram = audioprocessing.SpectrogramImage(width, height, fft_size)
-
-        for x in range(width):
-            if callback and x % (width / 10) == 0:
-                callback((x * 100) / width)
-
-            seek_point = int(x * samples_per_pixel)
-
-            (spectral_centroid, db_spectrum) = processor.spectral_centroid(
-                seek_point)
-
-            spectrogram.draw_spectrum(x, db_spectrum)
+        spectrogram.draw_spectra(spectra)
 
         if callback:
             callback(100)
@@ -60,9 +60,7 @@ class Blog(Base, BlogMixin):
     def delete(self, **kwargs):
         all_posts = self.get_all_blog_posts()
         for post in all_posts:
-            post.delete(del_orphan_tags=False, commit=False)
-        from mediagoblin.db.util import clean_orphan_tags
-        clean_orphan_tags(commit=False)
+            post.delete(commit=False)
         super(Blog, self).delete(**kwargs)
         
         
@@ -13,7 +13,6 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
-import datetime
 import logging
 
 from mediagoblin.media_types import MediaManagerBase
@@ -39,21 +38,10 @@ class ImageMediaManager(MediaManagerBase):
         Get the original date and time from the EXIF information. Returns
         either a datetime object or None (if anything goes wrong)
         """
-        if not self.entry.media_data or not self.entry.media_data.exif_all:
-            return None
-
-        try:
-            # Try wrapped around all since exif_all might be none,
-            # EXIF DateTimeOriginal or printable might not exist
-            # or strptime might not be able to parse date correctly
-            exif_date = self.entry.media_data.exif_all[
-                'EXIF DateTimeOriginal']['printable']
-            original_date = datetime.datetime.strptime(
-                exif_date,
-                '%Y:%m:%d %H:%M:%S')
-            return original_date
-        except (KeyError, ValueError):
+        summary = self.entry.exif_summary()
+        if not summary:
             return None
+        return summary['taken']
 
 def get_media_type_and_manager(ext):
     if ext in ACCEPTED_EXTENSIONS:
@@ -0,0 +1,50 @@
+"""add exif summary columns
+
+Revision ID: 3e1f6b0c9a52
+Revises: a98c1a320e88
+Create Date: 2026-10-18 15:21:47.903516
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3e1f6b0c9a52'
+down_revision = 'a98c1a320e88'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    """
+    The summaries of already processed images are filled in by
+    "gmg summarizeexif".
+    """
+    op.add_column('image__mediadata', sa.Column('has_exif', sa.Boolean()))
+    op.add_column('image__mediadata', sa.Column('taken', sa.DateTime()))
+    op.add_column('image__mediadata', sa.Column('camera_make', sa.Unicode()))
+    op.add_column('image__mediadata', sa.Column('camera_model', sa.Unicode()))
+    op.add_column('image__mediadata', sa.Column('lens', sa.Unicode()))
+    op.add_column('image__mediadata',
+                  sa.Column('exposure_time', sa.Unicode()))
+    op.add_column('image__mediadata', sa.Column('aperture', sa.Float()))
+    op.add_column('image__mediadata', sa.Column('iso', sa.Integer()))
+    op.add_column('image__mediadata', sa.Column('focal_length', sa.Float()))
+    op.create_index(op.f('ix_image__mediadata_taken'), 'image__mediadata',
+                    ['taken'], unique=False)
+    op.create_index(op.f('ix_image__mediadata_camera_model'),
+                    'image__mediadata', ['camera_model'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_image__mediadata_camera_model'),
+                  table_name='image__mediadata')
+    op.drop_index(op.f('ix_image__mediadata_taken'),
+                  table_name='image__mediadata')
+    # SQLite can't drop columns in place
+    with op.batch_alter_table('image__mediadata') as batch_op:
+        for column in ('focal_length', 'iso', 'aperture', 'exposure_time',
+                       'lens', 'camera_model', 'camera_make', 'taken',
+                       'has_exif'):
+            batch_op.drop_column(column)
@@ -18,8 +18,8 @@
 from mediagoblin.db.base import Base
 
 from sqlalchemy import (
-    Column, Integer, Float, ForeignKey)
-from sqlalchemy.orm import relationship, backref
+    Column, Integer, Float, ForeignKey, Boolean, DateTime, Unicode)
+from sqlalchemy.orm import relationship, backref, deferred
 from mediagoblin.db.extratypes import JSONEncoded
 
 
@@ -38,7 +38,21 @@ class ImageData(Base):
 
     width = Column(Integer)
     height = Column(Integer)
-    exif_all = Column(JSONEncoded)
+    # All tags, only loaded when used
+    exif_all = deferred(Column(JSONEncoded))
+
+    # What pages show and what can be searched for, see
+    # mediagoblin.tools.exif.summarize_exif.  has_exif is None for
+    # images processed before, until "gmg summarizeexif" is run.
+    has_exif = Column(Boolean)
+    taken = Column(DateTime, index=True)
+    camera_make = Column(Unicode)
+    camera_model = Column(Unicode, index=True)
+    lens = Column(Unicode)
+    exposure_time = Column(Unicode)
+    aperture = Column(Float)
+    iso = Column(Integer)
+    focal_length = Column(Float)
 
 
 DATA_MODEL = ImageData
@@ -35,7 +35,7 @@ from mediagoblin.processing import (
     store_public, copy_original)
 from mediagoblin.tools.exif import exif_fix_image_orientation, \
     extract_exif, clean_exif, get_gps_data, get_useful, \
-    exif_image_needs_rotation
+    exif_image_needs_rotation, summarize_exif
 
 _log = logging.getLogger(__name__)
 
@@ -48,32 +48,21 @@ PIL_FILTERS = {
 MEDIA_TYPE = 'mediagoblin.media_types.image'
 
 
-def resize_image(entry, resized, keyname, target_name, new_size,
-                 exif_tags, workdir, quality, filter):
-    """
-    Store a resized version of an image and return its pathname.
-
-    Arguments:
-    proc_state -- the processing state for the image to resize
-    resized -- an image from Image.open() of the original image being resized
-    keyname -- Under what key to save in the db.
-    target_name -- public file path for the new resized image
-    exif_tags -- EXIF data for the original image
-    workdir -- directory path for storing converted image files
-    new_size -- 2-tuple size for the resized image
-    quality -- level of compression used when resizing images
-    filter -- One of BICUBIC, BILINEAR, NEAREST, ANTIALIAS
-    """
-    resized = exif_fix_image_orientation(resized, exif_tags)  # Fix orientation
-
+def _get_resize_filter(filter):
     try:
-        resize_filter = PIL_FILTERS[filter.upper()]
+        return PIL_FILTERS[filter.upper()]
     except KeyError:
         raise Exception('Filter "{0}" not found, choose one of {1}'.format(
             six.text_type(filter),
             u', '.join(PIL_FILTERS.keys())))
 
-    resized.thumbnail(new_size, resize_filter)
+
+def _store_resized_image(entry, resized, keyname, target_name, new_size,
+                         workdir, quality, filter):
+    """
+    Shrink an already oriented image in place and store it under keyname
+    """
+    resized.thumbnail(new_size, _get_resize_filter(filter))
 
     # Copy the new file to the conversion subdir, then remotely.
     tmp_resized_filename = os.path.join(workdir, target_name)
@@ -89,39 +78,115 @@ def resize_image(entry, resized, keyname, target_name, new_size,
     entry.set_file_metadata(keyname, **image_info)
 
 
+def resize_image(entry, resized, keyname, target_name, new_size,
+                 exif_tags, workdir, quality, filter):
+    """
+    Store a resized version of an image and return its pathname.
+
+    Arguments:
+    proc_state -- the processing state for the image to resize
+    resized -- an image from Image.open() of the original image being resized
+    keyname -- Under what key to save in the db.
+    target_name -- public file path for the new resized image
+    exif_tags -- EXIF data for the original image
+    workdir -- directory path for storing converted image files
+    new_size -- 2-tuple size for the resized image
+    quality -- level of compression used when resizing images
+    filter -- One of BICUBIC, BILINEAR, NEAREST, ANTIALIAS
+    """
+    resized = exif_fix_image_orientation(resized, exif_tags)  # Fix orientation
+    _store_resized_image(entry, resized, keyname, target_name, new_size,
+                         workdir, quality, filter)
+
+
+def _get_default_size(keyname):
+    max_width = mgg.global_config['media:' + keyname]['max_width']
+    max_height = mgg.global_config['media:' + keyname]['max_height']
+    return (max_width, max_height)
+
+
 def resize_tool(entry,
                 force, keyname, orig_file, target_name,
                 conversions_subdir, exif_tags, quality, filter, new_size=None):
     # Use the default size if new_size was not given
     if not new_size:
-        max_width = mgg.global_config['media:' + keyname]['max_width']
-        max_height = mgg.global_config['media:' + keyname]['max_height']
-        new_size = (max_width, max_height)
+        new_size = _get_default_size(keyname)
+
+    resize_pyramid(entry, orig_file,
+                   [(keyname, target_name, new_size, force)],
+                   conversions_subdir, exif_tags, quality, filter)
+
 
+def resize_pyramid(entry, orig_file, renditions,
+                   conversions_subdir, exif_tags, quality, filter):
+    """
+    Store several resized versions of an image, decoding the original once.
+
+    The original is opened once (letting the JPEG decoder downscale it
+    while decoding where possible), oriented once, and then each
+    rendition is derived from the previous, larger one instead of from
+    the full resolution original.
+
+    Arguments:
+    renditions -- list of (keyname, target_name, new_size, force) tuples.
+      A rendition is only created if forced, if the original exceeds
+      new_size or if the original needs rotation.
+    """
     # If thumb or medium is already the same quality and size, then don't
     # reprocess
-    if _skip_resizing(entry, keyname, new_size, quality, filter):
-        _log.info('{0} of same size and quality already in use, skipping '
-                  'resizing of media {1}.'.format(keyname, entry.id))
+    wanted = []
+    for keyname, target_name, new_size, force in renditions:
+        if _skip_resizing(entry, keyname, new_size, quality, filter):
+            _log.info('{0} of same size and quality already in use, '
+                      'skipping resizing of media {1}.'.format(
+                          keyname, entry.id))
+        else:
+            wanted.append(
+                (six.text_type(keyname), target_name, tuple(new_size), force))
+
+    if not wanted:
         return
 
-    # If the size of the original file exceeds the specified size for the desized
-    # file, a target_name file is created and later associated with the media
-    # entry.
-    # Also created if the file needs rotation, or if forced.
     try:
         im = Image.open(orig_file)
     except IOError:
         raise BadMediaFail()
-    if force \
-        or im.size[0] > new_size[0]\
-        or im.size[1] > new_size[1]\
-        or exif_image_needs_rotation(exif_tags):
-        resize_image(
-            entry, im, six.text_type(keyname), target_name,
-            tuple(new_size),
-            exif_tags, conversions_subdir,
-            quality, filter)
+
+    # If the size of the original file exceeds the specified size for the
+    # desized file, a target_name file is created and later associated with
+    # the media entry.
+    # Also created if the file needs rotation, or if forced.
+    needs_rotation = exif_image_needs_rotation(exif_tags)
+    wanted = [rendition for rendition in wanted
+              if rendition[3] or needs_rotation
+              or im.size[0] > rendition[2][0]
+              or im.size[1] > rendition[2][1]]
+
+    if not wanted:
+        return
+
+    # Largest first, so every level can be derived from the previous one
+    wanted.sort(key=lambda rendition: rendition[2][0] * rendition[2][1],
+                reverse=True)
+
+    # Only decode as many pixels as the largest rendition needs.  This is
+    # a no-op for anything but JPEG, which can scale by 1/2, 1/4 or 1/8
+    # while decoding and never goes below the requested size.  Use the
+    # larger side for both dimensions as the image may still be rotated.
+    largest = max(max(rendition[2]) for rendition in wanted)
+    im.draft(None, (largest, largest))
+
+    im = exif_fix_image_orientation(im, exif_tags)  # Fix orientation
+
+    source, source_size = im, None
+    for keyname, target_name, new_size, force in wanted:
+        if source_size is not None and (new_size[0] > source_size[0]
+                                        or new_size[1] > source_size[1]):
+            source = im
+        resized = source.copy()
+        _store_resized_image(entry, resized, keyname, target_name, new_size,
+                             conversions_subdir, quality, filter)
+        source, source_size = resized, new_size
 
 
 def _skip_resizing(entry, keyname, size, quality, filter):
@@ -150,6 +215,30 @@ def _skip_resizing(entry, keyname, size, quality, filter):
     return skip
 
 
+def parse_extra_sizes(extra_sizes):
+    """
+    Parse the extra_sizes config option into (keyname, (width, height))
+
+    Each entry looks like "thumb_2x:360x360".
+    """
+    parsed = []
+    for extra_size in extra_sizes:
+        try:
+            keyname, size = extra_size.split(':')
+            width, height = size.lower().split('x')
+            size = (int(width), int(height))
+        except ValueError:
+            raise ValueError(
+                'Invalid extra_sizes entry "{0}", expected something '
+                'like "thumb_2x:360x360"'.format(extra_size))
+        keyname = keyname.strip()
+        if keyname in ('original', 'medium', 'thumb'):
+            raise ValueError(
+                'extra_sizes may not replace the "{0}" file'.format(keyname))
+        parsed.append((keyname, size))
+    return parsed
+
+
 SUPPORTED_FILETYPES = ['png', 'gif', 'jpg', 'jpeg', 'tiff']
 
 
@@ -219,6 +308,33 @@ class CommonImageProcessor(MediaProcessor):
                     self.conversions_subdir, self.exif_tags, quality,
                     filter, size)
 
+    def generate_resized_images(self, size=None, thumb_size=None,
+                                quality=None, filter=None):
+        """
+        Generate the medium, the thumbnail and any extra_sizes renditions
+        with a single decode of the original
+        """
+        if not quality:
+            quality = self.image_config['quality']
+        if not filter:
+            filter = self.image_config['resize_filter']
+
+        renditions = [
+            ('medium', self.name_builder.fill('{basename}.medium{ext}'),
+             size or _get_default_size('medium'), False),
+            ('thumb', self.name_builder.fill('{basename}.thumbnail{ext}'),
+             thumb_size or _get_default_size('thumb'), True)]
+        for keyname, extra_size in parse_extra_sizes(
+                self.image_config['extra_sizes']):
+            renditions.append(
+                (keyname,
+                 self.name_builder.fill('{basename}.%s{ext}' % keyname),
+                 extra_size, False))
+
+        resize_pyramid(self.entry, self.process_filename, renditions,
+                       self.conversions_subdir, self.exif_tags, quality,
+                       filter)
+
     def copy_original(self):
         copy_original(
             self.entry, self.process_filename,
@@ -232,12 +348,6 @@ class CommonImageProcessor(MediaProcessor):
         if len(gps_data):
             Location.create({"position": gps_data}, self.entry)
 
-        # Insert exif data into database
-        exif_all = clean_exif(self.exif_tags)
-
-        if len(exif_all):
-            self.entry.media_data_init(exif_all=exif_all)
-
         # Extract file metadata
         try:
             im = Image.open(self.process_filename)
@@ -249,6 +359,12 @@ class CommonImageProcessor(MediaProcessor):
             "height": im.size[1],
         }
 
+        # Insert exif data and what's shown of it into database
+        exif_all = clean_exif(self.exif_tags)
+        self.entry.media_data_init(
+            exif_all=exif_all or None, has_exif=bool(exif_all),
+            **dict(summarize_exif(exif_all), **metadata))
+
         self.entry.set_file_metadata(file, **metadata)
 
 
@@ -312,9 +428,8 @@ class InitialProcessor(CommonImageProcessor):
 
     def process(self, size=None, thumb_size=None, quality=None, filter=None):
         self.common_setup()
-        self.generate_medium_if_applicable(size=size, filter=filter,
-                                           quality=quality)
-        self.generate_thumb(size=thumb_size, filter=filter, quality=quality)
+        self.generate_resized_images(size=size, thumb_size=thumb_size,
+                                     filter=filter, quality=quality)
         self.copy_original()
         self.extract_metadata('original')
         self.delete_queue_file()
@@ -22,32 +22,22 @@ try:
     CONFIG = json.loads(os.environ["RENDER_SETUP"])
     MODEL_EXT = CONFIG["model_ext"]
     MODEL_PATH = CONFIG["model_path"]
-    CAMERA_COORD = CONFIG["camera_coord"]
-    CAMERA_FOCUS = CONFIG["camera_focus"]
-    CAMERA_CLIP = CONFIG["camera_clip"]
-    CAMERA_TYPE = CONFIG["projection"]
-    CAMERA_ORTHO = CONFIG["greatest"] * 1.5
-    RENDER_WIDTH = CONFIG["width"]
-    RENDER_HEIGHT = CONFIG["height"]
-    RENDER_FILE = CONFIG["out_file"]
+    # Every shot is rendered from the same import of the model
+    SHOTS = CONFIG["shots"]
 except KeyError:
     print("Failed to load RENDER_SETUP environment variable.")
     exit(1)
 
 
 # add and setup camera
-bpy.ops.object.camera_add(view_align=False, enter_editmode=False,
-                          location = CAMERA_COORD)
+bpy.ops.object.camera_add(view_align=False, enter_editmode=False)
 camera_ob = bpy.data.objects[0]
 camera = bpy.data.cameras[0]
-camera.clip_end = CAMERA_CLIP
-camera.ortho_scale = CAMERA_ORTHO
-camera.type = CAMERA_TYPE
 
 
 
 # add an empty for focusing the camera
-bpy.ops.object.add(location=CAMERA_FOCUS)
+bpy.ops.object.add()
 target = bpy.data.objects[1]
 bpy.ops.object.select_all(action="SELECT")
 bpy.ops.object.track_set(type="TRACKTO")
@@ -68,17 +58,23 @@ elif MODEL_EXT == 'obj':
         axis_up="Z")
 
 
-# rotate the imported objects with meshes in the scene
-if CAMERA_TYPE == "PERSP":
-    for obj in bpy.data.objects[2:]:
-        obj.rotation_euler[2]=-.3
-
-
-# attempt to render
 scene = bpy.data.scenes.values()[0]
 scene.camera = camera_ob
-scene.render.filepath = RENDER_FILE
-scene.render.resolution_x = RENDER_WIDTH
-scene.render.resolution_y = RENDER_HEIGHT
 scene.render.resolution_percentage = 100
-bpy.ops.render.render(write_still=True)
+
+for shot in SHOTS:
+    camera_ob.location = shot["camera_coord"]
+    target.location = shot["camera_focus"]
+    camera.clip_end = shot["camera_clip"]
+    camera.ortho_scale = shot["greatest"] * 1.5
+    camera.type = shot["projection"]
+
+    # rotate the imported objects with meshes in the scene
+    for obj in bpy.data.objects[2:]:
+        obj.rotation_euler[2] = -.3 if shot["projection"] == "PERSP" else 0
+
+    # attempt to render
+    scene.render.filepath = shot["out_file"]
+    scene.render.resolution_x = shot["width"]
+    scene.render.resolution_y = shot["height"]
+    bpy.ops.render.render(write_still=True)
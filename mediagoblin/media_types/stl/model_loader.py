@@ -15,7 +15,23 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-import struct
+import itertools
+import os
+
+import numpy
+
+
+# Binary STL triangle records: the normal, the three vertices and two
+# attribute bytes
+STL_TRIANGLE = numpy.dtype([
+    ('normal', '<f4', (3,)),
+    ('verts', '<f4', (3, 3)),
+    ('attribute', '<u2')])
+STL_HEADER_SIZE = 84
+
+# Models are looked at this many triangles or lines at a time, so only
+# this much of them is ever in memory as arrays
+CHUNK_SIZE = 1 << 16
 
 
 class ThreeDeeParseError(Exception):
@@ -27,78 +43,195 @@ class ThreeDee(object):
     3D model parser base class.  Derrived classes are used for basic
     analysis of 3D models, and are not intended to be used for 3D
     rendering.
+
+    The vertices are not kept; load() passes them to add_verts() in
+    chunks, which only keeps their count, bounds and sum.
     """
 
     def __init__(self, fileob):
-        self.verts = []
-        self.average = [0, 0, 0]
-        self.min = [None, None, None]
-        self.max = [None, None, None]
-        self.width = 0  # x axis
-        self.depth = 0  # y axis
-        self.height = 0 # z axis
+        self.vertex_count = 0
+        self._sum = numpy.zeros(3)
+        self._min = numpy.full(3, numpy.inf)
+        self._max = numpy.full(3, -numpy.inf)
 
         self.load(fileob)
-        if not len(self.verts):
+        if not self.vertex_count:
             raise ThreeDeeParseError("Empty model.")
 
-        for vector in self.verts:
-            for i in range(3):
-                num = vector[i]
-                self.average[i] += num
-                if not self.min[i]:
-                    self.min[i] = num
-                    self.max[i] = num
-                else:
-                    if self.min[i] > num:
-                        self.min[i] = num
-                    if self.max[i] < num:
-                        self.max[i] = num
-
-        for i in range(3):
-            self.average[i]/=len(self.verts)
+        # Plain floats, these end up in the json passed to blender
+        self.average = [float(total / self.vertex_count)
+                        for total in self._sum]
+        self.min = [float(num) for num in self._min]
+        self.max = [float(num) for num in self._max]
 
-        self.width = abs(self.min[0] - self.max[0])
-        self.depth = abs(self.min[1] - self.max[1])
-        self.height = abs(self.min[2] - self.max[2])
+        self.width = abs(self.min[0] - self.max[0])  # x axis
+        self.depth = abs(self.min[1] - self.max[1])  # y axis
+        self.height = abs(self.min[2] - self.max[2]) # z axis
 
+    def add_verts(self, verts):
+        """Account for verts, an array of shape (n, 3)."""
+        if not len(verts):
+            return
+        if not numpy.isfinite(verts).all():
+            raise ThreeDeeParseError("Model has invalid coordinates.")
+        self.vertex_count += len(verts)
+        self._sum += verts.sum(axis=0, dtype=numpy.float64)
+        numpy.minimum(self._min, verts.min(axis=0), out=self._min)
+        numpy.maximum(self._max, verts.max(axis=0), out=self._max)
 
     def load(self, fileob):
         """Override this method in your subclass."""
         pass
 
+    def triangles(self, fileob):
+        """
+        Yield the triangles of the model in fileob, as arrays of shape
+        (n, 3, 3).  Override this method in your subclass.
+        """
+        raise NotImplementedError
+
 
 class ObjModel(ThreeDee):
     """
     Parser for textureless wavefront obj files.  File format
     reference: http://en.wikipedia.org/wiki/Wavefront_.obj_file
+
+    Ascii stl files list their vertices much the same way, so this
+    parses those as well.
     """
+    vertex_keywords = (b'v', b'vertex')
+
+    def _read_chunks(self, fileob):
+        """
+        Yield the vertices (an array of shape (n, 3)) and the faces of
+        each chunk of lines.  Faces are (vertices of the chunk before the
+        face, list of vertex numbers as written in the file).
+        """
+        fileob.seek(0)
+        lines = iter(fileob)
+        while True:
+            chunk = list(itertools.islice(lines, CHUNK_SIZE))
+            if not chunk:
+                break
+            coords = []
+            faces = []
+            for line in chunk:
+                fields = line.split()
+                if not fields:
+                    continue
+                if fields[0] in self.vertex_keywords:
+                    # obj vertices may have a fourth (w) coordinate
+                    if len(fields) < 4:
+                        raise ThreeDeeParseError("Vertex needs 3 coordinates.")
+                    coords.extend(fields[1:4])
+                elif fields[0] == b'f':
+                    # Faces list v, v/vt, v//vn or v/vt/vn
+                    faces.append((
+                        len(coords) // 3,
+                        [field.split(b'/')[0] for field in fields[1:]]))
+            try:
+                verts = numpy.array(coords, dtype=numpy.float64)
+            except ValueError:
+                raise ThreeDeeParseError("Vertex coordinates are not numbers.")
+            yield verts.reshape(-1, 3), faces
 
-    def __vector(self, line, expected=3):
-        nums = map(float, line.strip().split(" ")[1:])
-        return tuple(nums[:expected])
-    
     def load(self, fileob):
-        for line in fileob:
-            line = line.strip()
-            if line[0] == "v":
-                self.verts.append(self.__vector(line))
-            
+        for verts, faces in self._read_chunks(fileob):
+            self.add_verts(verts)
+
+    def triangles(self, fileob):
+        verts = []
+        vertex_count = 0
+        indexes = []
+        for chunk_verts, faces in self._read_chunks(fileob):
+            verts.append(chunk_verts)
+            for verts_before, face in faces:
+                # Negative numbers count back from the last vertex before
+                # the face
+                face = [int(number) - 1 if int(number) > 0
+                        else vertex_count + verts_before + int(number)
+                        for number in face]
+                # Split polygons into a fan of triangles
+                for i in range(1, len(face) - 1):
+                    indexes.append((face[0], face[i], face[i + 1]))
+            vertex_count += len(chunk_verts)
+        verts = numpy.concatenate(verts)
+
+        if indexes:
+            indexes = numpy.array(indexes, dtype=numpy.intp)
+            if indexes.min() < 0 or indexes.max() >= len(verts):
+                raise ThreeDeeParseError("Face refers to a missing vertex.")
+        else:
+            # Ascii stl files, where every three vertices are a triangle
+            indexes = numpy.arange(len(verts) // 3 * 3).reshape(-1, 3)
+
+        for start in range(0, len(indexes), CHUNK_SIZE):
+            yield verts[indexes[start:start + CHUNK_SIZE]]
+
 
 class BinaryStlModel(ThreeDee):
     """
-    Parser for ascii-encoded stl files.  File format reference:
+    Parser for binary stl files.  File format reference:
     http://en.wikipedia.org/wiki/STL_%28file_format%29#Binary_STL
+
+    Files on disk are memory mapped rather than read.
     """
 
+    def _map_triangles(self, fileob):
+        count, size = stl_triangle_count(fileob)
+        if count is None:
+            raise ThreeDeeParseError("Truncated stl header.")
+        if size < STL_HEADER_SIZE + count * STL_TRIANGLE.itemsize:
+            raise ThreeDeeParseError(
+                "File is too short for {0} triangles.".format(count))
+        if not count:
+            return numpy.zeros(0, dtype=STL_TRIANGLE)
+
+        try:
+            fileob.fileno()
+        except (AttributeError, IOError, OSError):
+            # Not a real file, like an upload kept in memory
+            fileob.seek(STL_HEADER_SIZE)
+            return numpy.frombuffer(
+                fileob.read(count * STL_TRIANGLE.itemsize),
+                dtype=STL_TRIANGLE)
+        return numpy.memmap(
+            fileob, dtype=STL_TRIANGLE, mode='r',
+            offset=STL_HEADER_SIZE, shape=(count,))
+
     def load(self, fileob):
-        fileob.seek(80) # skip the header
-        count = struct.unpack("<I", fileob.read(4))[0]
-        for i in range(count):
-            fileob.read(12) # skip the normal vector
-            for v in range(3):
-                self.verts.append(struct.unpack("<3f", fileob.read(12)))
-            fileob.read(2) # skip the attribute bytes
+        for verts in self.triangles(fileob):
+            self.add_verts(verts.reshape(-1, 3))
+
+    def triangles(self, fileob):
+        triangles = self._map_triangles(fileob)
+        for start in range(0, len(triangles), CHUNK_SIZE):
+            yield triangles['verts'][start:start + CHUNK_SIZE]
+
+
+def stl_triangle_count(fileob):
+    """
+    The triangle count in fileob's binary stl header (None if it is too
+    short to have one) and fileob's size
+    """
+    fileob.seek(80) # skip the header
+    count = fileob.read(4)
+    fileob.seek(0, os.SEEK_END)
+    size = fileob.tell()
+    fileob.seek(0)
+    if len(count) != 4:
+        return None, size
+    return int(numpy.frombuffer(count, dtype='<u4')[0]), size
+
+
+def is_binary_stl(fileob):
+    """
+    Whether fileob's size matches its binary stl triangle count exactly,
+    which text files practically never do.
+    """
+    count, size = stl_triangle_count(fileob)
+    return (count is not None and
+            size == STL_HEADER_SIZE + count * STL_TRIANGLE.itemsize)
 
 
 def auto_detect(fileob, hint):
@@ -113,6 +246,12 @@ def auto_detect(fileob, hint):
             pass
 
     if hint == "stl" or not hint:
+        if is_binary_stl(fileob):
+            # Don't go looking for lines in it, see below
+            try:
+                return BinaryStlModel(fileob)
+            except ThreeDeeParseError:
+                pass
         try:
             # HACK Ascii formatted stls are similar enough to obj
             # files that we can just use the same parser for both.
@@ -15,6 +15,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import argparse
+import errno
 import os
 import json
 import logging
@@ -28,7 +29,7 @@ from mediagoblin.processing import (
     get_process_filename, store_public,
     copy_original)
 
-from mediagoblin.media_types.stl import model_loader
+from mediagoblin.media_types.stl import model_loader, rasterizer
 
 
 _log = logging.getLogger(__name__)
@@ -65,15 +66,23 @@ def sniff_handler(media_file, filename):
 
 def blender_render(config):
     """
-    Called to prerender a model.
+    Called to prerender a model, from all of config's shots in one go.
+
+    Returns False if Blender is not installed.
     """
     env = {"RENDER_SETUP" : json.dumps(config), "DISPLAY":":0"}
-    subprocess.call(
-        ["blender",
-         "-b", BLEND_FILE,
-         "-F", "JPEG",
-         "-P", BLEND_SCRIPT],
-        env=env)
+    try:
+        subprocess.call(
+            ["blender",
+             "-b", BLEND_FILE,
+             "-F", "JPEG",
+             "-P", BLEND_SCRIPT],
+            env=env)
+    except OSError as error:
+        if error.errno != errno.ENOENT:
+            raise
+        return False
+    return True
 
 
 class CommonStlProcessor(MediaProcessor):
@@ -91,6 +100,7 @@ class CommonStlProcessor(MediaProcessor):
         self._set_ext()
         self._set_model()
         self._set_greatest()
+        self.shots = []
 
     def _set_ext(self):
         ext = self.name_builder.ext[1:]
@@ -118,12 +128,14 @@ class CommonStlProcessor(MediaProcessor):
             self.entry, self.process_filename,
             self.name_builder.fill('{basename}{ext}'))
 
-    def _snap(self, keyname, name, camera, size, project="ORTHO"):
+    def _snap(self, keyname, name, camera, size, project="ORTHO",
+              **file_metadata):
+        """
+        Add a shot to the views rendered by render_views
+        """
         filename = self.name_builder.fill(name)
         workbench_path = self.workbench.joinpath(filename)
         shot = {
-            "model_path": self.process_filename,
-            "model_ext": self.ext,
             "camera_coord": camera,
             "camera_focus": self.model.average,
             "camera_clip": self.greatest*10,
@@ -133,13 +145,37 @@ class CommonStlProcessor(MediaProcessor):
             "height": size[1],
             "out_file": workbench_path,
             }
-        blender_render(shot)
+        self.shots.append((keyname, filename, shot, file_metadata))
 
-        # make sure the image rendered to the workbench path
-        assert os.path.exists(workbench_path)
+    def render_views(self):
+        """
+        Render all views added by the generate_* methods, starting Blender
+        and importing the model only once.  Without Blender they are drawn
+        by the (much simpler) rasterizer.
+        """
+        if not self.shots:
+            return
 
-        # copy it up!
-        store_public(self.entry, keyname, workbench_path, filename)
+        shots = [shot for keyname, filename, shot, metadata in self.shots]
+        config = {
+            "model_path": self.process_filename,
+            "model_ext": self.ext,
+            "shots": shots,
+            }
+        if not blender_render(config):
+            _log.info('Blender is not installed, rasterizing the views')
+            with open(self.process_filename, 'rb') as model_file:
+                rasterizer.render(
+                    self.model.triangles(model_file), shots)
+
+        for keyname, filename, shot, file_metadata in self.shots:
+            # make sure the image rendered to the workbench path
+            assert os.path.exists(shot["out_file"])
+
+            # copy it up!
+            store_public(self.entry, keyname, shot["out_file"], filename)
+            self.entry.set_file_metadata(keyname, **file_metadata)
+        self.shots = []
 
     def _skip_processing(self, keyname, **kwargs):
         file_metadata = self.entry.get_file_metadata(keyname)
@@ -170,9 +206,8 @@ class CommonStlProcessor(MediaProcessor):
             "{basename}.thumb.jpg",
             [0, self.greatest*-1.5, self.greatest],
             thumb_size,
-            project="PERSP")
-
-        self.entry.set_file_metadata('thumb', thumb_size=thumb_size)
+            project="PERSP",
+            thumb_size=thumb_size)
 
     def generate_perspective(self, size=None):
         if not size:
@@ -187,9 +222,8 @@ class CommonStlProcessor(MediaProcessor):
             "{basename}.perspective.jpg",
             [0, self.greatest*-1.5, self.greatest],
             size,
-            project="PERSP")
-
-        self.entry.set_file_metadata('perspective', size=size)
+            project="PERSP",
+            size=size)
 
     def generate_topview(self, size=None):
         if not size:
@@ -204,9 +238,8 @@ class CommonStlProcessor(MediaProcessor):
             "{basename}.top.jpg",
             [self.model.average[0], self.model.average[1],
              self.greatest*2],
-            size)
-
-        self.entry.set_file_metadata('top', size=size)
+            size,
+            size=size)
 
     def generate_frontview(self, size=None):
         if not size:
@@ -221,9 +254,8 @@ class CommonStlProcessor(MediaProcessor):
             "{basename}.front.jpg",
             [self.model.average[0], self.greatest*-2,
              self.model.average[2]],
-            size)
-
-        self.entry.set_file_metadata('front', size=size)
+            size,
+            size=size)
 
     def generate_sideview(self, size=None):
         if not size:
@@ -238,9 +270,8 @@ class CommonStlProcessor(MediaProcessor):
             "{basename}.side.jpg",
             [self.greatest*-2, self.model.average[1],
              self.model.average[2]],
-            size)
-
-        self.entry.set_file_metadata('side', size=size)
+            size,
+            size=size)
 
     def store_dimensions(self):
         """
@@ -307,6 +338,7 @@ class InitialProcessor(CommonStlProcessor):
         self.generate_topview(size=size)
         self.generate_frontview(size=size)
         self.generate_sideview(size=size)
+        self.render_views()
         self.store_dimensions()
         self.copy_original()
         self.delete_queue_file()
@@ -361,6 +393,7 @@ class Resizer(CommonStlProcessor):
             self.generate_sideview(size=size)
         elif file == 'thumb':
             self.generate_thumb(thumb_size=size)
+        self.render_views()
 
 
 class StlProcessingManager(ProcessingManager):
@@ -0,0 +1,267 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Software renderer for the shots of blender_render.py, used when Blender
+is not installed.  It draws flat shaded triangles with a z-buffer and
+is only meant for previews.
+"""
+
+import logging
+import math
+
+import numpy
+try:
+    from PIL import Image
+except ImportError:
+    import Image
+
+
+_log = logging.getLogger(__name__)
+
+# Blender's default camera: a 35mm lens on a 32mm sensor
+PERSPECTIVE_FOV = 2 * math.atan(16 / 35.)
+# blender_render.py turns the model this much around z for perspectives
+PERSPECTIVE_ROTATION = -.3
+
+BACKGROUND = (255, 255, 255)
+MODEL_COLOR = numpy.array([150, 165, 185])
+AMBIENT = 0.35
+
+# Triangles covering up to this many pixels across are drawn in batches
+# of about BATCH_PIXELS pixels, bigger ones one at a time
+BATCH_BOX_SIZE = 32
+BATCH_PIXELS = 1 << 20
+
+
+def _normalized(vector):
+    return vector / numpy.linalg.norm(vector)
+
+
+def _barycentric(x, y, columns, rows):
+    """
+    Weights of the corners (x, y) of triangles at the points (columns,
+    rows), which are all at least 0 inside of them
+    """
+    area = ((x[1] - x[0]) * (y[2] - y[0]) -
+            (x[2] - x[0]) * (y[1] - y[0]))
+    # Triangles seen from their edge have no inside
+    area = numpy.where(area == 0, numpy.inf, area)
+    weight1 = ((columns - x[0]) * (y[2] - y[0]) -
+               (x[2] - x[0]) * (rows - y[0])) / area
+    weight2 = ((x[1] - x[0]) * (rows - y[0]) -
+               (columns - x[0]) * (y[1] - y[0])) / area
+    weight0 = numpy.where(numpy.isinf(area), -1, 1 - weight1 - weight2)
+    return weight0, weight1, weight2
+
+
+class Canvas(object):
+    """
+    A z-buffered image for one shot, which triangles are drawn onto a
+    chunk at a time
+    """
+
+    def __init__(self, shot):
+        self.shot = shot
+        self.width = shot['width']
+        self.height = shot['height']
+        self.depth = numpy.full((self.height, self.width), numpy.inf)
+        self.image = numpy.empty((self.height, self.width, 3), numpy.uint8)
+        self.image[:] = BACKGROUND
+
+        self.eye = numpy.array(shot['camera_coord'], dtype=numpy.float64)
+        forward = _normalized(
+            numpy.array(shot['camera_focus'], dtype=numpy.float64) - self.eye)
+        up = numpy.array([0., 0., 1.])
+        if abs(forward.dot(up)) > 0.999:
+            # Looking straight down, like the top view
+            up = numpy.array([0., 1., 0.])
+        right = _normalized(numpy.cross(forward, up))
+        # Rows of camera space: right, up and away from the camera
+        self.camera = numpy.array(
+            [right, numpy.cross(right, forward), forward])
+
+        self.perspective = shot['projection'] == 'PERSP'
+        longest = max(self.width, self.height)
+        if self.perspective:
+            self.scale = longest / 2. / math.tan(PERSPECTIVE_FOV / 2)
+            angle = PERSPECTIVE_ROTATION
+            self.rotation = numpy.array([
+                [math.cos(angle), -math.sin(angle), 0],
+                [math.sin(angle), math.cos(angle), 0],
+                [0, 0, 1]])
+        else:
+            self.scale = longest / (shot['greatest'] * 1.5)
+            self.rotation = None
+
+    def _project(self, triangles):
+        """
+        Pixel coordinates (x, y) and distances from the camera of the
+        corners of triangles
+        """
+        points = triangles.reshape(-1, 3).astype(numpy.float64)
+        if self.rotation is not None:
+            points = points.dot(self.rotation.T)
+        points = (points - self.eye).dot(self.camera.T)
+        distance = points[:, 2]
+        if self.perspective:
+            # Corners behind the camera are dropped by draw()
+            factor = self.scale / numpy.where(distance > 0, distance, 1)
+        else:
+            factor = self.scale
+        x = self.width / 2. + points[:, 0] * factor
+        y = self.height / 2. - points[:, 1] * factor
+        shape = triangles.shape[:2]
+        return (x.reshape(shape), y.reshape(shape), distance.reshape(shape))
+
+    def _shades(self, triangles):
+        """
+        Colors of triangles, lit from the camera
+        """
+        triangles = triangles.astype(numpy.float64)
+        if self.rotation is not None:
+            triangles = triangles.dot(self.rotation.T)
+        normals = numpy.cross(triangles[:, 1] - triangles[:, 0],
+                              triangles[:, 2] - triangles[:, 0])
+        lengths = numpy.linalg.norm(normals, axis=1)
+        lengths[lengths == 0] = 1
+        light = numpy.abs(normals.dot(self.camera[2])) / lengths
+        shade = AMBIENT + (1 - AMBIENT) * light
+        return (shade[:, numpy.newaxis] * MODEL_COLOR).astype(numpy.uint8)
+
+    def draw(self, triangles):
+        x, y, distance = self._project(triangles)
+        visible = (distance > 0).all(axis=1)
+        x, y, distance = x[visible], y[visible], distance[visible]
+        colors = self._shades(triangles[visible])
+
+        left = numpy.floor(x.min(axis=1)).astype(int)
+        right = numpy.ceil(x.max(axis=1)).astype(int)
+        top = numpy.floor(y.min(axis=1)).astype(int)
+        bottom = numpy.ceil(y.max(axis=1)).astype(int)
+        onscreen = ((right >= 0) & (left < self.width) &
+                    (bottom >= 0) & (top < self.height))
+        size = numpy.maximum(right - left, bottom - top)
+        small = onscreen & (size <= 1)
+
+        # Triangles within a pixel are drawn as that pixel, all at once
+        self._draw_points(
+            x[small].mean(axis=1), y[small].mean(axis=1),
+            distance[small].mean(axis=1), colors[small])
+
+        # Others that are not too big are drawn together with others of
+        # about their size
+        box = 2
+        drawn = small
+        while box <= BATCH_BOX_SIZE:
+            batch = numpy.nonzero(onscreen & ~drawn & (size < box))[0]
+            step = max(1, BATCH_PIXELS // (box * box))
+            for start in range(0, len(batch), step):
+                part = batch[start:start + step]
+                self._draw_triangles(
+                    x[part], y[part], distance[part], colors[part],
+                    left[part], top[part], box)
+            drawn = drawn | (size < box)
+            box *= 2
+
+        for i in numpy.nonzero(onscreen & ~drawn)[0]:
+            self._draw_triangle(
+                x[i], y[i], distance[i], colors[i],
+                max(left[i], 0), min(right[i], self.width - 1),
+                max(top[i], 0), min(bottom[i], self.height - 1))
+
+    def _draw_points(self, x, y, distance, colors):
+        column = numpy.floor(x).astype(int)
+        row = numpy.floor(y).astype(int)
+        self._draw_pixels(column, row, distance, colors)
+
+    def _draw_pixels(self, column, row, distance, colors):
+        """
+        Draw pixels with the given distances and colors, in any order
+        """
+        inside = ((column >= 0) & (column < self.width) &
+                  (row >= 0) & (row < self.height))
+        if not inside.any():
+            return
+        pixel = row[inside] * self.width + column[inside]
+        distance = distance[inside]
+        depth = self.depth.reshape(-1)
+        numpy.minimum.at(depth, pixel, distance)
+        nearest = depth[pixel] == distance
+        self.image.reshape(-1, 3)[pixel[nearest]] = colors[inside][nearest]
+
+    def _draw_triangles(self, x, y, distance, colors, left, top, box):
+        """
+        Draw triangles which fit into box pixels from their left and top
+        """
+        offsets = numpy.arange(box)
+        # Pixels of each triangle's box, shaped (triangles, box, box)
+        columns = (left[:, numpy.newaxis, numpy.newaxis] +
+                   offsets[numpy.newaxis, numpy.newaxis, :])
+        rows = (top[:, numpy.newaxis, numpy.newaxis] +
+                offsets[numpy.newaxis, :, numpy.newaxis])
+        columns, rows = numpy.broadcast_arrays(columns, rows)
+
+        corner = (numpy.newaxis, numpy.newaxis)
+        weights = _barycentric(
+            [x[(slice(None), i) + corner] for i in range(3)],
+            [y[(slice(None), i) + corner] for i in range(3)],
+            columns + .5, rows + .5)
+        inside = ((weights[0] >= 0) & (weights[1] >= 0) &
+                  (weights[2] >= 0))
+        pixel_distance = sum(
+            weight * distance[(slice(None), i) + corner]
+            for i, weight in enumerate(weights))
+        triangle = numpy.broadcast_to(
+            numpy.arange(len(x))[:, numpy.newaxis, numpy.newaxis],
+            inside.shape)
+        self._draw_pixels(columns[inside], rows[inside],
+                          pixel_distance[inside], colors[triangle[inside]])
+
+    def _draw_triangle(self, x, y, distance, color,
+                       left, right, top, bottom):
+        columns, rows = numpy.meshgrid(
+            numpy.arange(left, right + 1) + .5,
+            numpy.arange(top, bottom + 1) + .5)
+        weights = _barycentric(x, y, columns, rows)
+        inside = ((weights[0] >= 0) & (weights[1] >= 0) &
+                  (weights[2] >= 0))
+        if not inside.any():
+            return
+
+        pixel_distance = sum(
+            weight * distance[i] for i, weight in enumerate(weights))
+        depth = self.depth[top:bottom + 1, left:right + 1]
+        nearer = inside & (pixel_distance < depth)
+        depth[nearer] = pixel_distance[nearer]
+        self.image[top:bottom + 1, left:right + 1][nearer] = color
+
+    def save(self):
+        Image.fromarray(self.image).save(self.shot['out_file'], 'JPEG')
+
+
+def render(triangle_chunks, shots):
+    """
+    Render all shots (see blender_render.py) of the model made of
+    triangle_chunks, reading it only once
+    """
+    canvases = [Canvas(shot) for shot in shots]
+    for triangles in triangle_chunks:
+        for canvas in canvases:
+            canvas.draw(triangles)
+    for canvas in canvases:
+        canvas.save()
+        _log.debug('Rendered {0}'.format(canvas.shot['out_file']))
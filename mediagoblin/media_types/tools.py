@@ -14,11 +14,19 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import logging
+import os
+import threading
+from collections import OrderedDict
 
 from mediagoblin import mg_globals
 
 _log = logging.getLogger(__name__)
 
+# Discoverer results of the files discovered last, see discover()
+DISCOVERED_CACHE_SIZE = 16
+_discovered = OrderedDict()
+_discovered_lock = threading.Lock()
+
 
 def media_type_warning():
     if mg_globals.app_config.get('media_types'):
@@ -27,9 +35,49 @@ def media_type_warning():
                      ' to plugins to continue using them.')
 
 
+def file_identity(path):
+    """
+    Key identifying the contents of the file at path, which changes when
+    the file is replaced or written to
+    """
+    stat = os.stat(path)
+    return (os.path.realpath(path), stat.st_size, stat.st_mtime)
+
+
 def discover(src):
     '''
     Discover properties about a media file
+
+    The sniffers and every processing step look at the same file, so the
+    results for the files discovered last are kept and reused as long as
+    the file is unchanged.
+    '''
+    try:
+        key = file_identity(src)
+    except OSError:
+        key = None
+
+    if key is not None:
+        with _discovered_lock:
+            info = _discovered.pop(key, None)
+            if info is not None:
+                _discovered[key] = info
+                _log.debug('Reusing discovered {0}'.format(src))
+                return info
+
+    info = discover_uncached(src)
+
+    if key is not None:
+        with _discovered_lock:
+            _discovered[key] = info
+            while len(_discovered) > DISCOVERED_CACHE_SIZE:
+                _discovered.popitem(last=False)
+    return info
+
+
+def discover_uncached(src):
+    '''
+    Discover properties about a media file with GStreamer's Discoverer
     '''
     # GStreamer might be not installed, so it should not be initialized on
     # import, or an exception will be raised.
@@ -17,7 +17,6 @@
 import argparse
 import os.path
 import logging
-import datetime
 import celery
 
 import six
@@ -34,7 +33,8 @@ from mediagoblin.tools.translate import lazy_pass_to_ugettext as _
 from mediagoblin.media_types import MissingComponents
 
 from . import transcoders
-from .util import skip_transcode, ACCEPTED_RESOLUTIONS
+from .util import skip_transcode, serialize_metadata, get_tags, \
+    ACCEPTED_RESOLUTIONS
 
 _log = logging.getLogger(__name__)
 _log.setLevel(logging.DEBUG)
@@ -98,78 +98,15 @@ def sniff_handler(media_file, filename):
         _log.error('Could not discover {0}'.format(filename))
         return None
 
-def get_tags(stream_info):
-    'gets all tags and their values from stream info'
-    taglist = stream_info.get_tags()
-    if not taglist:
-        return {}
-    tags = []
-    taglist.foreach(
-            lambda list, tag: tags.append((tag, list.get_value_index(tag, 0))))
-    tags = dict(tags)
-
-    # date/datetime should be converted from GDate/GDateTime to strings
-    if 'date' in tags:
-        date = tags['date']
-        tags['date'] = "%s-%s-%s" % (
-                date.year, date.month, date.day)
-
-    if 'datetime' in tags:
-        # TODO: handle timezone info; gst.get_time_zone_offset +
-        # python's tzinfo should help
-        dt = tags['datetime']
-        try:
-            tags['datetime'] = datetime.datetime(
-                dt.get_year(), dt.get_month(), dt.get_day(), dt.get_hour(),
-                dt.get_minute(), dt.get_second(),
-                dt.get_microsecond()).isoformat()
-        except:
-            tags['datetime'] = None
-    for k, v in tags.copy().items():
-        # types below are accepted by json; others must not present
-        if not isinstance(v, (dict, list, six.string_types, int, float, bool,
-                              type(None))):
-            del tags[k]
-    return dict(tags)
+# gstreamer discovery needs the upload on disk, see sniff_media_contents
+sniff_handler.needs_local_file = True
+
 
 def store_metadata(media_entry, metadata):
     """
     Store metadata from this video for this media entry.
     """
-    stored_metadata = dict()
-    audio_info_list = metadata.get_audio_streams()
-    if audio_info_list:
-        stored_metadata['audio'] = []
-    for audio_info in audio_info_list:
-        stored_metadata['audio'].append(
-                {
-                    'channels': audio_info.get_channels(),
-                    'bitrate': audio_info.get_bitrate(),
-                    'depth': audio_info.get_depth(),
-                    'languange': audio_info.get_language(),
-                    'sample_rate': audio_info.get_sample_rate(),
-                    'tags': get_tags(audio_info)
-                })
-
-    video_info_list = metadata.get_video_streams()
-    if video_info_list:
-        stored_metadata['video'] = []
-    for video_info in video_info_list:
-        stored_metadata['video'].append(
-                {
-                    'width': video_info.get_width(),
-                    'height': video_info.get_height(),
-                    'bitrate': video_info.get_bitrate(),
-                    'depth': video_info.get_depth(),
-                    'videorate': [video_info.get_framerate_num(),
-                                  video_info.get_framerate_denom()],
-                    'tags': get_tags(video_info)
-                })
-
-    stored_metadata['common'] = {
-        'duration': metadata.get_duration(),
-        'tags': get_tags(metadata),
-    }
+    stored_metadata = serialize_metadata(metadata)
     # Only save this field if there's something to save
     if len(stored_metadata):
         media_entry.media_data_init(orig_metadata=stored_metadata)
@@ -185,12 +122,12 @@ def main_task(entry_id, resolution, medium_size, **process_info):
     entry, manager = get_entry_and_processing_manager(entry_id)
     with CommonVideoProcessor(manager, entry) as processor:
         processor.common_setup(resolution)
+        processor.store_orig_metadata()
         processor.transcode(medium_size=tuple(medium_size),
                             vp8_quality=process_info['vp8_quality'],
                             vp8_threads=process_info['vp8_threads'],
                             vorbis_quality=process_info['vorbis_quality'])
         processor.generate_thumb(thumb_size=process_info['thumb_size'])
-        processor.store_orig_metadata()
     # Make state of entry as processed
     entry.state = u'processed'
     entry.save()
@@ -215,6 +152,27 @@ def complementary_task(entry_id, resolution, medium_size, **process_info):
         entry.id, medium_size))
 
 
+@celery.task()
+def single_pass_task(entry_id, resolutions, **process_info):
+    """
+    Celery task to transcode the video to all resolutions in one pass, used
+    instead of main_task and complementary_task with single_pass_transcoding
+    """
+    entry, manager = get_entry_and_processing_manager(entry_id)
+    with CommonVideoProcessor(manager, entry) as processor:
+        processor.common_setup()
+        processor.store_orig_metadata()
+        processor.transcode_all(resolutions,
+                                vp8_quality=process_info['vp8_quality'],
+                                vp8_threads=process_info['vp8_threads'],
+                                vorbis_quality=process_info['vorbis_quality'])
+        processor.generate_thumb(thumb_size=process_info['thumb_size'])
+    entry.state = u'processed'
+    entry.save()
+    _log.info(u'MediaEntry ID {0} is transcoded to {1}'.format(
+        entry.id, ', '.join(resolutions)))
+
+
 @celery.task()
 def processing_cleanup(entry_id):
     _log.debug('Entered processing_cleanup')
@@ -337,9 +295,7 @@ class CommonVideoProcessor(MediaProcessor):
         if self._skip_processing(self.curr_file, **file_metadata):
             return
 
-        metadata = transcoders.discover(self.process_filename)
-        orig_dst_dimensions = (metadata.get_video_streams()[0].get_width(),
-                               metadata.get_video_streams()[0].get_height())
+        metadata = self.get_metadata()
 
         # Figure out whether or not we need to transcode this video or
         # if we can skip it
@@ -364,7 +320,9 @@ class CommonVideoProcessor(MediaProcessor):
                                       vp8_threads=vp8_threads,
                                       vorbis_quality=vorbis_quality,
                                       progress_callback=progress_callback,
-                                      dimensions=tuple(medium_size))
+                                      dimensions=tuple(medium_size),
+                                      metadata=metadata)
+            progress_callback.flush()
             if self.transcoder.dst_data:
                 # Push transcoded video to public storage
                 _log.debug('Saving medium...')
@@ -375,6 +333,74 @@ class CommonVideoProcessor(MediaProcessor):
 
                 self.did_transcode = True
 
+    def transcode_all(self, resolutions, vp8_quality=None, vp8_threads=None,
+                      vorbis_quality=None):
+        """
+        Like calling transcode for every resolution after common_setup with
+        it, but decoding the video only once
+        """
+        progress_callback = ProgressCallback(self.entry)
+        if not vp8_quality:
+            vp8_quality = self.video_config['vp8_quality']
+        if not vp8_threads:
+            vp8_threads = self.video_config['vp8_threads']
+        if not vorbis_quality:
+            vorbis_quality = self.video_config['vorbis_quality']
+
+        metadata = self.get_metadata()
+
+        destinations = []
+        for resolution in resolutions:
+            keyname = 'webm_' + str(resolution)
+            medium_size = ACCEPTED_RESOLUTIONS[resolution]
+            file_metadata = {'medium_size': medium_size,
+                             'vp8_threads': vp8_threads,
+                             'vp8_quality': vp8_quality,
+                             'vorbis_quality': vorbis_quality}
+
+            if self._skip_processing(keyname, **file_metadata):
+                continue
+
+            if skip_transcode(metadata, medium_size):
+                _log.debug('Skipping transcoding to {0}'.format(resolution))
+                if self.entry.media_files.get('original') and \
+                   self.entry.media_files.get(keyname):
+                    self.entry.media_files[keyname].delete()
+                continue
+
+            part_filename = self.name_builder.fill(
+                '{basename}.' + str(resolution) + '.webm')
+            destinations.append((
+                resolution, keyname, part_filename, file_metadata,
+                os.path.join(self.workbench.dir, part_filename)))
+
+        if not destinations:
+            return
+
+        _log.debug('Entered transcoder')
+        transcoder = transcoders.MultiResolutionTranscoder()
+        transcoder.transcode(
+            self.process_filename,
+            [(resolution, tuple(file_metadata['medium_size']), tmp_dst)
+             for resolution, keyname, part_filename, file_metadata, tmp_dst
+             in destinations],
+            self.video_config['default_resolution'],
+            len(self.video_config['available_resolutions']),
+            vp8_quality=vp8_quality,
+            vp8_threads=vp8_threads,
+            vorbis_quality=vorbis_quality,
+            progress_callback=progress_callback,
+            metadata=metadata)
+        progress_callback.flush()
+
+        for resolution, keyname, part_filename, file_metadata, tmp_dst \
+                in destinations:
+            if transcoder.dst_data[resolution]:
+                _log.debug('Saving {0}...'.format(resolution))
+                store_public(self.entry, keyname, tmp_dst, part_filename)
+                self.entry.set_file_metadata(keyname, **file_metadata)
+                self.did_transcode = True
+
     def generate_thumb(self, thumb_size=None):
         _log.debug("Enter generate_thumb()")
         # Temporary file for the video thumbnail (cleaned up with workbench)
@@ -406,8 +432,24 @@ class CommonVideoProcessor(MediaProcessor):
 
         self.entry.set_file_metadata('thumb', thumb_size=thumb_size)
 
+    def get_metadata(self):
+        """
+        The serialized stream info of the original, as stored by
+        store_orig_metadata, so the video is only discovered once for all
+        processing steps and later reprocessing
+        """
+        orig_metadata = self.entry.media_data and \
+            self.entry.media_data.orig_metadata
+        if orig_metadata and orig_metadata.get('video'):
+            return orig_metadata
+        return serialize_metadata(
+            transcoders.discover(self.process_filename))
+
     def store_orig_metadata(self):
         # Extract metadata and keep a record of it
+        if self.entry.media_data and self.entry.media_data.orig_metadata:
+            _log.debug("Original video metadata already stored")
+            return
         metadata = transcoders.discover(self.process_filename)
 
         # metadata's stream info here is a DiscovererContainerInfo instance,
@@ -609,6 +651,18 @@ class VideoProcessingManager(ProcessingManager):
         if 'thumb_size' not in reprocess_info:
             reprocess_info['thumb_size'] = None
 
+        if video_config['single_pass_transcoding']:
+            # Put the default resolution first, like the separate tasks
+            resolutions = [def_res] + [
+                res for res in video_config['available_resolutions']
+                if res != def_res]
+            transcoding_tasks = group([single_pass_task.signature(
+                args=(entry.id, resolutions), kwargs=reprocess_info,
+                queue='default', priority=priority_num, immutable=True)])
+            cleanup_task = processing_cleanup.signature(
+                args=(entry.id,), queue='default', immutable=True)
+            return (transcoding_tasks, cleanup_task)
+
         tasks_list = [main_task.signature(args=(entry.id, def_res,
                                           ACCEPTED_RESOLUTIONS[def_res]),
                                           kwargs=reprocess_info, queue='default',
@@ -24,7 +24,7 @@ import multiprocessing
 from mediagoblin import mg_globals as mgg
 from mediagoblin.media_types.tools import discover
 from mediagoblin.tools.translate import lazy_pass_to_ugettext as _
-from .util import ACCEPTED_RESOLUTIONS
+from .util import ACCEPTED_RESOLUTIONS, serialize_metadata
 
 #os.environ['GST_DEBUG'] = '4,python:4'
 
@@ -145,6 +145,25 @@ def capture_thumb(video_path, dest_path, width=None, height=None, percent=0.5):
     pipeline.set_state(Gst.State.NULL)
 
 
+def scaled_video_caps(video_info, dimensions):
+    '''
+    Caps for scaling the video stream described by video_info (from
+    serialize_metadata) to fit dimensions
+    '''
+    caps_struct = Gst.Structure.new_empty('video/x-raw')
+    caps_struct.set_value('pixel-aspect-ratio', Gst.Fraction(1, 1))
+    caps_struct.set_value('framerate', Gst.Fraction(30, 1))
+    if video_info['height'] > video_info['width']:
+        # portrait
+        caps_struct.set_value('height', dimensions[1])
+    else:
+        # landscape
+        caps_struct.set_value('width', dimensions[0])
+    caps = Gst.Caps.new_empty()
+    caps.append_structure(caps_struct)
+    return caps
+
+
 class VideoTranscoder(object):
     '''
     Video transcoder
@@ -186,6 +205,9 @@ class VideoTranscoder(object):
 
         self._progress_callback = kwargs.get('progress_callback') or None
 
+        # The source's serialize_metadata(), when the caller already has it
+        self.metadata = kwargs.get('metadata')
+
         # Get number of resolutions available for the video
         self.num_of_resolutions = num_res
         self.default_resolution = default_res
@@ -194,7 +216,8 @@ class VideoTranscoder(object):
             raise Exception('dimensions must be tuple: (width, height)')
 
         self._setup_pipeline()
-        self.data = discover(self.source_path)
+        if self.metadata is None:
+            self.metadata = serialize_metadata(discover(self.source_path))
         self._link_elements()
         self.__setup_videoscale_capsfilter()
         self.pipeline.set_state(Gst.State.PLAYING)
@@ -297,7 +320,7 @@ class VideoTranscoder(object):
         self.capsfilter.link(self.vp8enc)
         self.vp8enc.link(self.webmmux)
 
-        if self.data.get_audio_streams():
+        if self.metadata.get('audio'):
             self.audioqueue.link(self.audiorate)
             self.audiorate.link(self.audioconvert)
             self.audioconvert.link(self.audiocapsfilter)
@@ -334,19 +357,8 @@ class VideoTranscoder(object):
         '''
         Sets up the output format (width, height) for the video
         '''
-        caps_struct = Gst.Structure.new_empty('video/x-raw')
-        caps_struct.set_value('pixel-aspect-ratio', Gst.Fraction(1, 1))
-        caps_struct.set_value('framerate', Gst.Fraction(30, 1))
-        video_info = self.data.get_video_streams()[0]
-        if video_info.get_height() > video_info.get_width():
-            # portrait
-            caps_struct.set_value('height', self.destination_dimensions[1])
-        else:
-            # landscape
-            caps_struct.set_value('width', self.destination_dimensions[0])
-        caps = Gst.Caps.new_empty()
-        caps.append_structure(caps_struct)
-        self.capsfilter.set_property('caps', caps)
+        self.capsfilter.set_property('caps', scaled_video_caps(
+            self.metadata['video'][0], self.destination_dimensions))
 
     def _on_message(self, bus, message):
         _log.debug((bus, message, message.type))
@@ -399,6 +411,188 @@ class VideoTranscoder(object):
         self.loop.quit()
 
 
+class MultiResolutionTranscoder(object):
+    '''
+    Video transcoder for several resolutions at once
+
+    Transcodes the SRC video file to VP8 WebM video files of several sizes
+    in one pass: the source is decoded once and a tee feeds the decoded
+    video to one scale, vp8enc and webmmux branch per size.  The audio is
+    encoded once and muxed into every file.
+    '''
+    def __init__(self):
+        _log.info('Initializing MultiResolutionTranscoder...')
+        self.loop = GLib.MainLoop()
+
+    def transcode(self, src, destinations, default_res, num_res, **kwargs):
+        '''
+        Transcode src to destinations, a list of (resolution, dimensions,
+        path) tuples.
+
+        Afterwards dst_data maps each resolution to the discovered
+        output, or to None if transcoding failed.
+        '''
+        self.source_path = src
+        self.destinations = destinations
+
+        # See VideoTranscoder.transcode
+        self.vp8_quality = kwargs.get('vp8_quality', 8)
+        self.vp8_threads = kwargs.get('vp8_threads', CPU_COUNT - 1)
+        if self.vp8_threads == 0:
+            self.vp8_threads = CPU_COUNT
+        self.vorbis_quality = kwargs.get('vorbis_quality', 0.3)
+
+        self._progress_callback = kwargs.get('progress_callback') or None
+
+        # The source's serialize_metadata(), when the caller already has it
+        self.metadata = kwargs.get('metadata')
+
+        self.num_of_resolutions = num_res
+        self.default_resolution = default_res
+        self.progress_percentage = dict(
+            (resolution, 0) for resolution, dimensions, path in destinations)
+        self.dst_data = dict(
+            (resolution, None) for resolution, dimensions, path in destinations)
+
+        if self.metadata is None:
+            self.metadata = serialize_metadata(discover(self.source_path))
+        self._setup_pipeline()
+        self._setup_bus()
+        self.pipeline.set_state(Gst.State.PLAYING)
+        _log.info('Transcoding to {0} resolutions...'.format(
+            len(destinations)))
+        self.loop.run()
+
+    def _add_element(self, factory_name, name=None, **properties):
+        element = Gst.ElementFactory.make(factory_name, name)
+        for key, value in properties.items():
+            element.set_property(key.replace('_', '-'), value)
+        self.pipeline.add(element)
+        return element
+
+    def _link(self, *elements):
+        for src, sink in zip(elements, elements[1:]):
+            src.link(sink)
+
+    def _setup_pipeline(self):
+        _log.debug('Setting up transcoding pipeline')
+        self.pipeline = Gst.Pipeline.new('MultiResolutionTranscoderPipeline')
+
+        filesrc = self._add_element('filesrc', location=self.source_path)
+        decoder = self._add_element('decodebin')
+        decoder.connect('pad-added', self._on_dynamic_pad)
+        filesrc.link(decoder)
+
+        # Decoded video, split up for the sizes
+        self.videoqueue = self._add_element('queue')
+        self.videorate = self._add_element('videorate')
+        videoconvert = self._add_element('videoconvert')
+        videotee = self._add_element('tee')
+        self._link(self.videoqueue, self.videorate, videoconvert, videotee)
+
+        # Encoded audio, split up for the muxers
+        self.audioqueue = None
+        if self.metadata.get('audio'):
+            self.audioqueue = self._add_element('queue')
+            audiorate = self._add_element('audiorate', tolerance=80000000)
+            audioconvert = self._add_element('audioconvert')
+            audiocapsfilter = self._add_element(
+                'capsfilter', caps=Gst.Caps.from_string('audio/x-raw'))
+            vorbisenc = self._add_element(
+                'vorbisenc', quality=self.vorbis_quality)
+            audiotee = self._add_element('tee')
+            self._link(self.audioqueue, audiorate, audioconvert,
+                       audiocapsfilter, vorbisenc, audiotee)
+
+        video_info = self.metadata['video'][0]
+        for resolution, dimensions, path in self.destinations:
+            webmmux = self._add_element('webmmux')
+            self._link(
+                videotee,
+                self._add_element('queue'),
+                self._add_element('videoscale'),
+                self._add_element(
+                    'capsfilter',
+                    caps=scaled_video_caps(video_info, dimensions)),
+                self._add_element('vp8enc', threads=self.vp8_threads),
+                webmmux,
+                # Its name tells _on_message which branch made progress
+                self._add_element(
+                    'progressreport', 'progressreport_' + resolution,
+                    update_freq=1, silent=True),
+                self._add_element('filesink', location=path))
+            if self.audioqueue is not None:
+                self._link(audiotee, self._add_element('queue'), webmmux)
+
+    def _on_dynamic_pad(self, dbin, pad):
+        '''
+        Callback called when ``decodebin`` has a pad that we can connect to
+        '''
+        if (self.videorate.get_static_pad('sink').get_pad_template()
+                .get_caps().intersect(pad.query_caps()).is_empty()):
+            if self.audioqueue is not None:
+                _log.debug('linking audio to the pad dynamically')
+                pad.link(self.audioqueue.get_static_pad('sink'))
+        else:
+            _log.debug('linking video to the pad dynamically')
+            pad.link(self.videoqueue.get_static_pad('sink'))
+
+    def _setup_bus(self):
+        self.bus = self.pipeline.get_bus()
+        self.bus.add_signal_watch()
+        self.bus.connect('message', self._on_message)
+
+    def _on_message(self, bus, message):
+        _log.debug((bus, message, message.type))
+        if message.type == Gst.MessageType.EOS:
+            # Only posted once every branch is done
+            for resolution, dimensions, path in self.destinations:
+                self.dst_data[resolution] = discover(path)
+            self._stop()
+            _log.info('Done')
+        elif message.type == Gst.MessageType.ELEMENT:
+            if message.has_name('progress'):
+                resolution = message.src.get_name()[len('progressreport_'):]
+                (success, percent) = message.get_structure().get_int(
+                    'percent')
+                self._update_progress(resolution, percent, success)
+        elif message.type == Gst.MessageType.ERROR:
+            _log.error('Got error: {0}'.format(message.parse_error()))
+            self._stop()
+
+    def _update_progress(self, resolution, percent, success):
+        '''
+        Report the progress of one branch the way VideoTranscoder reports
+        the progress of its only one
+        '''
+        last_percent = self.progress_percentage[resolution]
+        if last_percent == percent or not success:
+            return
+        # See the FIXME in VideoTranscoder._on_message
+        if last_percent > percent and percent == 0:
+            percent = 100
+        percent_increment = percent - last_percent
+        self.progress_percentage[resolution] = percent
+        if self._progress_callback:
+            if resolution == self.default_resolution:
+                self._progress_callback(
+                    percent_increment / self.num_of_resolutions, percent)
+            else:
+                self._progress_callback(
+                    percent_increment / self.num_of_resolutions)
+        _log.info('{percent}% of {dest} resolution done...'.format(
+            percent=percent, dest=resolution))
+
+    def _stop(self):
+        self.pipeline.set_state(Gst.State.NULL)
+        # This kills the loop, mercifully
+        GLib.idle_add(self._stop_mainloop)
+
+    def _stop_mainloop(self):
+        _log.info('Terminating MainLoop')
+        self.loop.quit()
+
+
 if __name__ == '__main__':
     os.nice(19)
     from optparse import OptionParser
@@ -14,8 +14,11 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import datetime
 import logging
 
+import six
+
 from mediagoblin import mg_globals as mgg
 
 ACCEPTED_RESOLUTIONS = {
@@ -33,7 +36,8 @@ _log = logging.getLogger(__name__)
 
 def skip_transcode(metadata, size):
     '''
-    Checks video metadata against configuration values for skip_transcode.
+    Checks video metadata (as returned by serialize_metadata) against
+    configuration values for skip_transcode.
 
     Returns True if the video matches the requirements in the configuration.
     '''
@@ -45,43 +49,117 @@ def skip_transcode(metadata, size):
 
     _log.debug('skip_transcode config: {0}'.format(config))
 
-    metadata_tags = metadata.get_tags()
+    metadata_tags = metadata.get('common', {}).get('tags')
     if not metadata_tags:
         return False
 
-    if config['mime_types'] and metadata_tags.get_string('mimetype')[0]:
-        if not metadata_tags.get_string('mimetype')[1] in config['mime_types']:
+    if config['mime_types'] and metadata_tags.get('mimetype'):
+        if not metadata_tags['mimetype'] in config['mime_types']:
             return False
 
-    if (config['container_formats'] and
-            metadata_tags.get_string('container-format')[0]):
-        if not (metadata_tags.get_string('container-format')[1] in
+    if config['container_formats'] and metadata_tags.get('container-format'):
+        if not (metadata_tags['container-format'] in
                 config['container_formats']):
             return False
 
     if config['video_codecs']:
-        for video_info in metadata.get_video_streams():
-            video_tags = video_info.get_tags()
+        for video_info in metadata.get('video', []):
+            video_tags = video_info['tags']
             if not video_tags:
                 return False
-            if not (video_tags.get_string('video-codec')[1] in
-                    config['video_codecs']):
+            if not video_tags.get('video-codec') in config['video_codecs']:
                 return False
 
     if config['audio_codecs']:
-        for audio_info in metadata.get_audio_streams():
-            audio_tags = audio_info.get_tags()
+        for audio_info in metadata.get('audio', []):
+            audio_tags = audio_info['tags']
             if not audio_tags:
                 return False
-            if not (audio_tags.get_string('audio-codec')[1] in
-                    config['audio_codecs']):
+            if not audio_tags.get('audio-codec') in config['audio_codecs']:
                 return False
 
     if config['dimensions_match']:
-        for video_info in metadata.get_video_streams():
-            if not video_info.get_height() <= size[1]:
+        for video_info in metadata.get('video', []):
+            if not video_info['height'] <= size[1]:
                 return False
-            if not video_info.get_width() <= size[0]:
+            if not video_info['width'] <= size[0]:
                 return False
 
     return True
+
+
+def get_tags(stream_info):
+    'gets all tags and their values from stream info'
+    taglist = stream_info.get_tags()
+    if not taglist:
+        return {}
+    tags = []
+    taglist.foreach(
+            lambda list, tag: tags.append((tag, list.get_value_index(tag, 0))))
+    tags = dict(tags)
+
+    # date/datetime should be converted from GDate/GDateTime to strings
+    if 'date' in tags:
+        date = tags['date']
+        tags['date'] = "%s-%s-%s" % (
+                date.year, date.month, date.day)
+
+    if 'datetime' in tags:
+        # TODO: handle timezone info; gst.get_time_zone_offset +
+        # python's tzinfo should help
+        dt = tags['datetime']
+        try:
+            tags['datetime'] = datetime.datetime(
+                dt.get_year(), dt.get_month(), dt.get_day(), dt.get_hour(),
+                dt.get_minute(), dt.get_second(),
+                dt.get_microsecond()).isoformat()
+        except:
+            tags['datetime'] = None
+    for k, v in tags.copy().items():
+        # types below are accepted by json; others must not present
+        if not isinstance(v, (dict, list, six.string_types, int, float, bool,
+                              type(None))):
+            del tags[k]
+    return dict(tags)
+
+
+def serialize_metadata(metadata):
+    """
+    The stream info discovered for a video as a json-able dict, the way it
+    is stored in VideoData.orig_metadata
+    """
+    stored_metadata = dict()
+    audio_info_list = metadata.get_audio_streams()
+    if audio_info_list:
+        stored_metadata['audio'] = []
+    for audio_info in audio_info_list:
+        stored_metadata['audio'].append(
+                {
+                    'channels': audio_info.get_channels(),
+                    'bitrate': audio_info.get_bitrate(),
+                    'depth': audio_info.get_depth(),
+                    'languange': audio_info.get_language(),
+                    'sample_rate': audio_info.get_sample_rate(),
+                    'tags': get_tags(audio_info)
+                })
+
+    video_info_list = metadata.get_video_streams()
+    if video_info_list:
+        stored_metadata['video'] = []
+    for video_info in video_info_list:
+        stored_metadata['video'].append(
+                {
+                    'width': video_info.get_width(),
+                    'height': video_info.get_height(),
+                    'bitrate': video_info.get_bitrate(),
+                    'depth': video_info.get_depth(),
+                    'videorate': [video_info.get_framerate_num(),
+                                  video_info.get_framerate_denom()],
+                    'tags': get_tags(video_info)
+                })
+
+    stored_metadata['common'] = {
+        'duration': metadata.get_duration(),
+        'tags': get_tags(metadata),
+    }
+    return stored_metadata
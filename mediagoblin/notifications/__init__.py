@@ -16,6 +16,8 @@
 
 import logging
 
+from sqlalchemy.orm import joinedload
+
 from mediagoblin.db.models import Notification, CommentSubscription, User, \
                                   Comment, GenericModelReference
 from mediagoblin.notifications.task import email_notification_task
@@ -157,9 +159,18 @@ def get_notifications(user_id, only_unseen=True):
     if only_unseen:
         query = query.filter_by(seen=False)
 
-    notifications = query.limit(
+    notifications = query.options(
+        joinedload(Notification.object_helper)).limit(
         NOTIFICATION_FETCH_LIMIT).all()
 
+    # The comment links, then the comments and what they are on
+    links = GenericModelReference.load_objects(
+        [notification.object_helper for notification in notifications])
+    links = [link for link in links if isinstance(link, Comment)]
+    GenericModelReference.load_objects(
+        [link.comment_helper for link in links] +
+        [link.target_helper for link in links])
+
     return notifications
 
 
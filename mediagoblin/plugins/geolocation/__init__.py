@@ -22,6 +22,16 @@ PLUGIN_DIR = os.path.dirname(__file__)
 def setup_plugin():
     config = pluginapi.get_config('mediagoblin.plugins.geolocation')
 
+    routes = [
+        ('mediagoblin.plugins.geolocation.site_map',
+         '/map/',
+         'mediagoblin.plugins.geolocation.views:site_map'),
+        ('mediagoblin.plugins.geolocation.clusters',
+         '/map/clusters/',
+         'mediagoblin.plugins.geolocation.views:clusters')]
+
+    pluginapi.register_routes(routes)
+
     # Register the template path.
     pluginapi.register_template_path(os.path.join(PLUGIN_DIR, 'templates'))
 
@@ -0,0 +1,116 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import math
+
+from sqlalchemy import Integer, case, cast, func, or_
+
+from mediagoblin.db.base import Session
+from mediagoblin.db.models import Location, MediaEntry
+
+# Media closer than about this many pixels on the map are one cluster
+CLUSTER_PIXELS = 64
+TILE_PIXELS = 256
+MAX_ZOOM = 20
+# Bigger clusters are made for boxes which would have more
+MAX_CLUSTERS = 1024
+
+
+def _wrap_longitude(longitude):
+    if -180 <= longitude <= 180:
+        return longitude
+    return (longitude + 180) % 360 - 180
+
+
+def parse_bbox(bbox):
+    """
+    Parse a "west,south,east,north" box like maps ask for, returning
+    (west, south, east, north) within the range of coordinates.  West
+    is greater than east for boxes across the antimeridian, however
+    they were given.
+
+    Raises ValueError for anything else.
+    """
+    west, south, east, north = [float(value) for value in bbox.split(',')]
+    if any(math.isinf(value) or math.isnan(value)
+           for value in (west, south, east, north)):
+        raise ValueError('Coordinates must be finite')
+    if south > north:
+        raise ValueError('Box must be given as west,south,east,north')
+
+    south, north = max(south, -90.), min(north, 90.)
+    if east - west >= 360:
+        west, east = -180., 180.
+    else:
+        west, east = _wrap_longitude(west), _wrap_longitude(east)
+    return west, south, east, north
+
+
+def media_clusters(west, south, east, north, zoom):
+    """
+    Group the processed media located within the box (see parse_bbox)
+    into clusters of about CLUSTER_PIXELS at zoom level zoom.
+
+    Returns a list of dicts with the "count" of media in each cluster,
+    their average "latitude" and "longitude", their "bounds" as
+    [south, west, north, east] and, for clusters of one, its "media_id".
+    """
+    if east < west:
+        # Across the antimeridian, count longitudes on from west
+        east += 360
+        longitude = case([(Location.longitude < west,
+                           Location.longitude + 360)],
+                         else_=Location.longitude)
+        in_box = or_(Location.longitude >= west,
+                     Location.longitude <= east - 360)
+    else:
+        longitude = Location.longitude
+        in_box = Location.longitude.between(west, east)
+
+    zoom = min(max(zoom, 0), MAX_ZOOM)
+    cell = 360. / 2 ** zoom * CLUSTER_PIXELS / TILE_PIXELS
+    cell = max(cell, math.sqrt((east - west) * (north - south) / MAX_CLUSTERS))
+
+    # Cells are only used to group by, so it doesn't matter if databases
+    # round or truncate
+    row = cast((Location.latitude - south) / cell, Integer)
+    column = cast((longitude - west) / cell, Integer)
+
+    query = Session.query(
+        func.count(MediaEntry.id), func.min(MediaEntry.id),
+        func.avg(Location.latitude), func.avg(longitude),
+        func.min(Location.latitude), func.min(longitude),
+        func.max(Location.latitude), func.max(longitude),
+    ).join(Location, MediaEntry.location == Location.id).filter(
+        MediaEntry.state == u'processed',
+        Location.latitude.between(south, north),
+        in_box,
+    ).group_by(row, column)
+
+    clusters = []
+    for (count, media_id, latitude, longitude,
+         min_latitude, min_longitude, max_latitude, max_longitude) in query:
+        cluster = {
+            'count': count,
+            'latitude': latitude,
+            'longitude': _wrap_longitude(longitude),
+            'bounds': [min_latitude, _wrap_longitude(min_longitude),
+                       max_latitude, _wrap_longitude(max_longitude)],
+        }
+        if count == 1:
+            cluster['media_id'] = media_id
+        clusters.append(cluster)
+    return clusters
@@ -0,0 +1,59 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from mediagoblin.db.models import MediaEntry
+from mediagoblin.plugins.geolocation.tools import media_clusters, parse_bbox
+from mediagoblin.tools.response import render_to_response, json_response, \
+    json_error
+
+
+def site_map(request):
+    """ A map of all located media """
+    return render_to_response(
+        request, 'mediagoblin/plugins/geolocation/site_map.html', {})
+
+
+def clusters(request):
+    """
+    The clusters of located media in the bbox=west,south,east,north of a
+    map at zoom, see media_clusters
+    """
+    try:
+        west, south, east, north = parse_bbox(request.args['bbox'])
+        zoom = int(request.args.get('zoom', 0))
+    except (KeyError, ValueError):
+        return json_error(
+            'Give the area as bbox=west,south,east,north and zoom=level')
+
+    clusters = media_clusters(west, south, east, north, zoom)
+
+    media_ids = [cluster['media_id'] for cluster in clusters
+                 if 'media_id' in cluster]
+    if media_ids:
+        entries = dict(
+            (entry.id, entry) for entry in MediaEntry.for_listing(
+                MediaEntry.query.filter(MediaEntry.id.in_(media_ids))))
+        for cluster in clusters:
+            if 'media_id' not in cluster:
+                continue
+            entry = entries[cluster.pop('media_id')]
+            cluster['media'] = {
+                'id': entry.id,
+                'title': entry.title,
+                'url': entry.url_for_self(request.urlgen),
+                'thumb_url': entry.thumb_url}
+
+    return json_response({'clusters': clusters})
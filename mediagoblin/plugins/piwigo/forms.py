@@ -38,7 +38,11 @@ class AddForm(wtforms.Form):
     thumbnail_sum = wtforms.StringField(None,
         [wtforms.validators.Optional(),
          _md5_validator])
-    file_sum = wtforms.StringField(None, [_md5_validator])
+    file_sum = wtforms.StringField(None,
+        [wtforms.validators.Optional(),
+         _md5_validator])
+    original_filename = wtforms.StringField()
     name = wtforms.StringField()
+    comment = wtforms.StringField()
     date_creation = wtforms.StringField()
     categories = wtforms.StringField()
@@ -15,11 +15,15 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from collections import namedtuple
+import hashlib
 import logging
+import os
+import shutil
 
 import six
 import lxml.etree as ET
 from werkzeug.exceptions import MethodNotAllowed, BadRequest
+from werkzeug.utils import secure_filename
 
 from mediagoblin.tools.request import setup_user_in_request
 from mediagoblin.tools.response import Response
@@ -163,3 +167,122 @@ class PWGSession(object):
         assert self.in_pwg_session
         self.session_manager.save_session_to_cookie(self.request.session,
             self.request, response)
+
+
+class ChunkedUpload(object):
+    """
+    A file sent in chunks with pwg.images.addChunk, put together in the
+    queue store, so it can be queued from there without copying it.
+
+    Chunks are appended to the file in the order of their positions.  A
+    chunk sent again (clients retry failed requests) replaces itself and
+    all chunks after it.  Where each chunk ends is kept in a second file,
+    until the upload is finished and the file gets its real name.
+    """
+    READ_SIZE = 1 << 20
+
+    def __init__(self, queue_store, user, original_sum):
+        directory = [u'piwigo', six.text_type(user.id),
+                     six.text_type(original_sum.lower())]
+        self.queue_store = queue_store
+        self.directory = directory
+        self.filepath = directory + [u'file']
+        self.chunks_filepath = directory + [u'chunks']
+
+    @property
+    def in_progress(self):
+        return self.queue_store.file_exists(self.chunks_filepath)
+
+    @property
+    def queued(self):
+        """ Whether this file was finished and is still queued """
+        return (self.queue_store.file_exists(self.directory)
+                and not self.in_progress)
+
+    @property
+    def size(self):
+        chunks = self._read_chunks()
+        return chunks[-1][1] if chunks else 0
+
+    def _read_chunks(self):
+        """ The (position, end) of the chunks so far """
+        if not self.in_progress:
+            return []
+        with self.queue_store.get_file(self.chunks_filepath, 'rb') as f:
+            lines = f.read().decode('ascii').splitlines()
+        return [tuple(int(number) for number in line.split())
+                for line in lines]
+
+    def add_chunk(self, position, data):
+        """
+        Put data at chunk position.  Raises ValueError if chunks before
+        it are missing.
+        """
+        chunks = self._read_chunks()
+        positions = [chunk_position for chunk_position, end in chunks]
+        if position in positions:
+            chunks = chunks[:positions.index(position)]
+        elif chunks and position < positions[0]:
+            # Starting over from before the first chunk
+            chunks = []
+        elif chunks and position != positions[-1] + 1:
+            raise ValueError(
+                'Chunk %d is missing' % (positions[-1] + 1))
+        start = chunks[-1][1] if chunks else 0
+        # Following all chunks so far, as almost all chunks do
+        appending = chunks and len(chunks) == len(positions)
+
+        # The data first, so whatever isn't noted after a crash is
+        # overwritten when the chunk is sent again
+        if chunks:
+            with self.queue_store.get_file(self.filepath, 'r+b') as f:
+                f.seek(start)
+                f.write(data)
+                f.truncate()
+        else:
+            with self.queue_store.get_file(self.filepath, 'wb') as f:
+                f.write(data)
+
+        chunk_line = u'%d %d\n' % (position, start + len(data))
+        if appending:
+            with self.queue_store.get_file(self.chunks_filepath, 'ab') as f:
+                f.write(chunk_line.encode('ascii'))
+        else:
+            lines = [u'%d %d\n' % chunk for chunk in chunks] + [chunk_line]
+            with self.queue_store.get_file(self.chunks_filepath, 'wb') as f:
+                f.write(u''.join(lines).encode('ascii'))
+
+    def md5(self):
+        md5sum = hashlib.md5()
+        with self.queue_store.get_file(self.filepath, 'rb') as f:
+            for data in iter(lambda: f.read(self.READ_SIZE), b''):
+                md5sum.update(data)
+        return md5sum.hexdigest()
+
+    def finish(self, filename):
+        """
+        Stop taking chunks and return where the file is, named after
+        filename like prepare_queue_task names queued files (processing
+        goes by the extension)
+        """
+        self.queue_store.delete_file(self.chunks_filepath)
+        filepath = self.directory + [secure_filename(filename)]
+        if filepath == self.filepath:
+            return filepath
+
+        if self.queue_store.local_storage:
+            os.rename(self.queue_store.get_local_path(self.filepath),
+                      self.queue_store.get_local_path(filepath))
+        else:
+            with self.queue_store.get_file(self.filepath, 'rb') as source:
+                with self.queue_store.get_file(filepath, 'wb') as dest:
+                    shutil.copyfileobj(source, dest, self.READ_SIZE)
+            self.queue_store.delete_file(self.filepath)
+        self.filepath = filepath
+        return filepath
+
+    def discard(self):
+        for filepath in (self.chunks_filepath, self.filepath):
+            if self.queue_store.file_exists(filepath):
+                self.queue_store.delete_file(filepath)
+        self.queue_store.delete_dir(self.directory)
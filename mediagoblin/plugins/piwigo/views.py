@@ -14,8 +14,10 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import base64
 import logging
 import re
+from os.path import splitext
 
 import six
 
@@ -34,7 +36,7 @@ from mediagoblin.user_pages.lib import add_media_to_collection
 from mediagoblin.db.models import Collection
 
 from .tools import CmdTable, response_xml, check_form, \
-    PWGSession, PwgNamedArray, PwgError
+    PWGSession, PwgNamedArray, PwgError, ChunkedUpload
 from .forms import AddSimpleForm, AddForm
 
 
@@ -128,19 +130,29 @@ def pwg_images_addSimple(request):
     if not check_file_field(request, 'image'):
         raise BadRequest()
 
+    return _submit_media(
+        request, [form.category.data],
+        submitted_file=request.files['image'],
+        filename=request.files['image'].filename,
+        title=six.text_type(form.name.data),
+        description=six.text_type(form.comment.data))
+
+
+def _submit_media(request, collection_ids, **kwargs):
+    """
+    Submit the media like submit_media(**kwargs) and add it to the
+    user's collections of collection_ids
+    """
     try:
         entry = submit_media(
-            mg_app=request.app, user=request.user,
-            submitted_file=request.files['image'],
-            filename=request.files['image'].filename,
-            title=six.text_type(form.name.data),
-            description=six.text_type(form.comment.data))
-
-        collection_id = form.category.data
-        if collection_id > 0:
-            collection = Collection.query.get(collection_id)
-            if collection is not None and collection.actor == request.user.id:
-                add_media_to_collection(collection, entry, "")
+            mg_app=request.app, user=request.user, **kwargs)
+
+        for collection_id in collection_ids:
+            if collection_id and collection_id > 0:
+                collection = Collection.query.get(collection_id)
+                if (collection is not None
+                        and collection.actor == request.user.id):
+                    add_media_to_collection(collection, entry, "")
 
         return {
             'image_id': entry.id,
@@ -183,10 +195,15 @@ def pwg_images_addChunk(request):
     data = request.form.get('data')
 
     # Validate params:
-    pos = int(pos)
+    try:
+        pos = int(pos)
+    except (TypeError, ValueError):
+        raise BadRequest("Parameter position is not a number")
     if not typ in ("file", "thumb"):
         _log.error("type %r not allowed for now", typ)
         return False
+    if data is None:
+        raise BadRequest("Parameter data missing")
 
     _log.info("addChunk for %r, type %r, position %d, len: %d",
               o_sum, typ, pos, len(data))
@@ -194,6 +211,27 @@ def pwg_images_addChunk(request):
         _log.info("addChunk: Ignoring thumb, because we create our own")
         return True
 
+    if not request.user:
+        return PwgError(401, 'Access denied')
+    upload = ChunkedUpload(request.app.queue_store, request.user, o_sum)
+    if upload.queued:
+        return PwgError(1003, 'This file was added already')
+
+    try:
+        data = base64.b64decode(data)
+    except (TypeError, ValueError):
+        raise BadRequest("Parameter data is not base64")
+
+    upload_limit, max_file_size = get_upload_file_limits(request.user)
+    if max_file_size and \
+            upload.size + len(data) > max_file_size * 1024 * 1024:
+        upload.discard()
+        raise BadRequest(_(u'Sorry, the file size is too big.'))
+
+    try:
+        upload.add_chunk(pos, data)
+    except ValueError as error:
+        return PwgError(1003, str(error))
     return True
 
 
@@ -203,7 +241,44 @@ def pwg_images_add(request):
     form = AddForm(request.form)
     check_form(form)
 
-    return {'image_id': 123456, 'url': ''}
+    if not request.user:
+        return PwgError(401, 'Access denied')
+    upload = ChunkedUpload(
+        request.app.queue_store, request.user, form.original_sum.data)
+    if not upload.in_progress:
+        return PwgError(1003, 'No chunks of this file were added')
+
+    md5sum = (form.file_sum.data or form.original_sum.data).lower()
+    if upload.md5() != md5sum:
+        upload.discard()
+        return PwgError(1003, 'The file does not match its checksum')
+
+    filename = six.text_type(
+        form.original_filename.data or form.name.data or u'upload')
+    if not splitext(filename)[1]:
+        # Without a name to tell, it's a photo, like almost all uploads
+        filename += u'.jpg'
+
+    collection_ids = []
+    for category in (form.categories.data or u'').split(';'):
+        # Categories are "id" or "id,rank"
+        try:
+            collection_ids.append(int(category.split(',')[0]))
+        except ValueError:
+            pass
+
+    try:
+        queued_filepath = upload.finish(filename)
+        with request.app.queue_store.get_file(queued_filepath, 'rb') as f:
+            return _submit_media(
+                request, collection_ids,
+                submitted_file=f, filename=filename,
+                title=six.text_type(form.name.data or u'') or None,
+                description=six.text_type(form.comment.data or u''),
+                queued_filepath=queued_filepath)
+    except Exception:
+        upload.discard()
+        raise
 
 
 @csrf_exempt
@@ -86,7 +86,7 @@ def edit_subtitles(request, media):
                 created=datetime.utcnow(),
                 ))
 
-        media.save()
+        media.save(set_updated=True)
 
         messages.add_message(
             request,
@@ -149,7 +149,7 @@ def custom_subtitles(request,media,id=None):
             if subtitle["id"] == id:
                 delete_container = index
                 media.subtitle_files.pop(delete_container)
-                media.save()
+                media.save(set_updated=True)
                 break
             index += 1
         messages.add_message(
@@ -173,7 +173,7 @@ def delete_subtitles(request,media):
             mg_globals.public_store.delete_file(path)
             delete_container = index
             media.subtitle_files.pop(delete_container)
-            media.save()
+            media.save(set_updated=True)
             break
         index += 1
 
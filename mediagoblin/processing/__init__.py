@@ -23,10 +23,14 @@ except:
 
 import logging
 import os
+import time
 
 import six
+from sqlalchemy import case, func
+from sqlalchemy.exc import SQLAlchemyError
 
 from mediagoblin import mg_globals as mgg
+from mediagoblin.db.base import Session
 from mediagoblin.db.util import atomic_update
 from mediagoblin.db.models import MediaEntry
 from mediagoblin.tools.pluginapi import hook_handle
@@ -36,18 +40,69 @@ _log = logging.getLogger(__name__)
 
 
 class ProgressCallback(object):
+    """
+    Keeps the transcoding progress of entry up to date.
+
+    Transcoders report progress every second, so it is collected here and
+    only written every progress_update_interval seconds, or as soon as it
+    grew by progress_update_delta percent.  Call flush() when done.
+
+    Only the progress columns are updated, in a transaction of its own,
+    so this neither commits nor expires what processing has in its
+    session.  Progress is added in the database, which keeps it right
+    when several tasks transcode the same entry.
+    """
     def __init__(self, entry):
         self.entry = entry
+        self.entry_id = entry.id
+        app_config = mgg.app_config or {}
+        self.update_interval = app_config.get('progress_update_interval', 5)
+        self.update_delta = app_config.get('progress_update_delta', 10)
+
+        self.pending_progress = 0
+        self.default_quality_progress = None
+        # Write the first progress right away
+        self.last_update = 0
 
     def __call__(self, progress, default_quality_progress=None):
         if progress:
-            if 100 - (self.entry.transcoding_progress + progress) < 0.01:
-                self.entry.transcoding_progress = 100
-            else:
-                self.entry.transcoding_progress += round(progress, 2)
+            self.pending_progress += round(progress, 2)
             if default_quality_progress:
-                self.entry.main_transcoding_progress = default_quality_progress
-            self.entry.save()
+                self.default_quality_progress = default_quality_progress
+
+            if (self.pending_progress >= self.update_delta
+                    or default_quality_progress == 100
+                    or time.time() - self.last_update >= self.update_interval):
+                self.flush()
+
+    def flush(self):
+        """
+        Write the progress collected so far
+        """
+        if not self.pending_progress and self.default_quality_progress is None:
+            return
+
+        table = MediaEntry.__table__
+        progress = (func.coalesce(table.c.transcoding_progress, 0)
+                    + self.pending_progress)
+        values = {'transcoding_progress': case(
+            [(progress > 99.99, 100)], else_=progress)}
+        if self.default_quality_progress is not None:
+            values['main_transcoding_progress'] = self.default_quality_progress
+
+        try:
+            with Session.get_bind().begin() as connection:
+                connection.execute(table.update().where(
+                    table.c.id == self.entry_id).values(**values))
+        except SQLAlchemyError as exc:
+            # Only progress, try again with the next one
+            _log.warning('Could not update progress of entry {0}: {1}'.format(
+                self.entry_id, exc))
+            return
+
+        self.pending_progress = 0
+        self.default_quality_progress = None
+        self.last_update = time.time()
 
 
 def create_pub_filepath(entry, filename):
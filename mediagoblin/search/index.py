@@ -0,0 +1,310 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Search index backends.
+
+Documents are the text of a media entry, as a dict of SEARCH_FIELDS,
+stored under the id of the entry.  Searches are lists of terms (see
+tokenize()) which all have to be found in a document; matches come
+best first, titles counting most and comments least.
+
+The database backends use the connection they are given, so changes to
+the index are part of the transaction changing the media.  Their tables
+are created by a migration, as the table of the backend for the
+database's dialect.
+"""
+
+import math
+import re
+import sqlite3
+import threading
+from collections import defaultdict
+
+import six
+from sqlalchemy import text
+
+# The fields of documents, and how much a term found in each counts
+SEARCH_FIELDS = ('title', 'tags', 'description', 'comments')
+FIELD_WEIGHTS = {'title': 10., 'tags': 5., 'description': 2., 'comments': 1.}
+
+# Rows of the database indexes written or deleted per statement
+WRITE_BATCH_SIZE = 500
+# Only this many of the newest matches of a search are ranked and
+# counted.  Words found in most documents would otherwise have all of
+# them scored for every page.
+MAX_MATCHES = 10000
+
+_TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    """
+    The lower case words of text, as the indexes see them
+    """
+    return _TERM_RE.findall((text or u'').lower())
+
+
+def _batches(items, size=WRITE_BATCH_SIZE):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class BaseSearchIndex(object):
+    """
+    Interface of the search index backends
+    """
+
+    def __init__(self, **kwargs):
+        pass
+
+    def update(self, connection, documents):
+        """
+        Store documents, a dict of media entry id -> document, replacing
+        what was stored for these entries
+        """
+        raise NotImplementedError
+
+    def remove(self, connection, media_ids):
+        raise NotImplementedError
+
+    def clear(self, connection):
+        raise NotImplementedError
+
+    def count(self, connection, terms):
+        """
+        How many documents contain all of terms, up to MAX_MATCHES
+        """
+        raise NotImplementedError
+
+    def search(self, connection, terms, limit, offset=0):
+        """
+        Ids of the media entries whose documents contain all of terms,
+        best matches (among the newest MAX_MATCHES) first
+        """
+        raise NotImplementedError
+
+
+class MemorySearchIndex(BaseSearchIndex):
+    """
+    Inverted index in the memory of this process, which neither sees
+    changes made by other processes nor survives restarts.  Meant for
+    tests.
+    """
+
+    def __init__(self, **kwargs):
+        # term -> {media id: weighted number of occurrences}
+        self._postings = defaultdict(dict)
+        # media id -> terms of its document
+        self._terms = {}
+        self._lock = threading.Lock()
+
+    def update(self, connection, documents):
+        with self._lock:
+            for media_id, document in six.iteritems(documents):
+                self._remove(media_id)
+                weights = defaultdict(float)
+                for field in SEARCH_FIELDS:
+                    for term in tokenize(document.get(field)):
+                        weights[term] += FIELD_WEIGHTS[field]
+                for term, weight in six.iteritems(weights):
+                    self._postings[term][media_id] = weight
+                self._terms[media_id] = list(weights)
+
+    def _remove(self, media_id):
+        for term in self._terms.pop(media_id, ()):
+            postings = self._postings[term]
+            postings.pop(media_id, None)
+            if not postings:
+                del self._postings[term]
+
+    def remove(self, connection, media_ids):
+        with self._lock:
+            for media_id in media_ids:
+                self._remove(media_id)
+
+    def clear(self, connection):
+        with self._lock:
+            self._postings.clear()
+            self._terms.clear()
+
+    def _scores(self, terms):
+        scores = None
+        for term in set(terms):
+            postings = self._postings.get(term, {})
+            idf = math.log(1 + len(self._terms) / float(len(postings) or 1))
+            if scores is None:
+                scores = dict((media_id, weight * idf)
+                              for media_id, weight in six.iteritems(postings))
+            else:
+                scores = dict((media_id, score + postings[media_id] * idf)
+                              for media_id, score in six.iteritems(scores)
+                              if media_id in postings)
+        if not scores:
+            return {}
+        newest = sorted(scores, reverse=True)[:MAX_MATCHES]
+        return dict((media_id, scores[media_id]) for media_id in newest)
+
+    def count(self, connection, terms):
+        with self._lock:
+            return len(self._scores(terms))
+
+    def search(self, connection, terms, limit, offset=0):
+        with self._lock:
+            scores = self._scores(terms)
+        ranked = sorted(scores, key=lambda media_id: (-scores[media_id],
+                                                      -media_id))
+        return ranked[offset:offset + limit]
+
+
+class SQLiteSearchIndex(BaseSearchIndex):
+    """
+    SQLite FTS5 table, ranked with bm25.  The rowid of each row is the
+    id of its media entry.
+    """
+    table = 'core__search_index'
+
+    @classmethod
+    def is_supported(cls):
+        """
+        Whether the SQLite library has FTS5
+        """
+        connection = sqlite3.connect(':memory:')
+        try:
+            connection.execute(
+                "CREATE VIRTUAL TABLE fts5_check USING fts5(content)")
+        except sqlite3.OperationalError:
+            return False
+        finally:
+            connection.close()
+        return True
+
+    def _match(self, terms):
+        # Terms are words, quoting keeps FTS5 from reading them as syntax
+        return u' '.join(u'"{0}"'.format(term) for term in terms)
+
+    def update(self, connection, documents):
+        self.remove(connection, documents)
+        insert = text(
+            "INSERT INTO {0} (rowid, {1}) VALUES (:media_id, {2})".format(
+                self.table, ', '.join(SEARCH_FIELDS),
+                ', '.join(':' + field for field in SEARCH_FIELDS)))
+        for batch in _batches(six.iteritems(documents)):
+            connection.execute(insert, [
+                dict(document, media_id=media_id)
+                for media_id, document in batch])
+
+    def remove(self, connection, media_ids):
+        for batch in _batches(media_ids):
+            connection.execute(text(
+                "DELETE FROM {0} WHERE rowid IN ({1})".format(
+                    self.table, ', '.join(str(int(media_id))
+                                          for media_id in batch))))
+
+    def clear(self, connection):
+        connection.execute(text("DELETE FROM {0}".format(self.table)))
+
+    def count(self, connection, terms):
+        return connection.execute(text(
+            "SELECT count(*) FROM (SELECT rowid FROM {0} "
+            "WHERE {0} MATCH :match LIMIT {1})".format(
+                self.table, MAX_MATCHES)),
+            match=self._match(terms)).scalar()
+
+    def search(self, connection, terms, limit, offset=0):
+        weights = ', '.join(str(FIELD_WEIGHTS[field])
+                            for field in SEARCH_FIELDS)
+        # FTS5 goes through matches by rowid, so only the newest ones
+        # are scored
+        return [media_id for (media_id,) in connection.execute(text(
+            "SELECT rowid FROM (SELECT rowid, bm25({0}, {1}) AS score "
+            "FROM {0} WHERE {0} MATCH :match "
+            "ORDER BY rowid DESC LIMIT {2}) "
+            "ORDER BY score, rowid DESC "
+            "LIMIT :limit OFFSET :offset".format(
+                self.table, weights, MAX_MATCHES)),
+            match=self._match(terms), limit=limit, offset=offset)]
+
+
+class PostgreSQLSearchIndex(BaseSearchIndex):
+    """
+    Table of tsvectors with a GIN index, ranked with ts_rank.  Fields
+    are weighted A (title) to D (comments).
+    """
+    table = 'core__search_index'
+    # Without stemming or stop words, as media is in all languages
+    text_search_config = 'simple'
+
+    def _query(self):
+        return "to_tsquery('{0}', :query)".format(self.text_search_config)
+
+    def _tsquery(self, terms):
+        # Terms are words, quoting keeps to_tsquery from reading them as
+        # operators
+        return u' & '.join(u"'{0}'".format(term) for term in terms)
+
+    def update(self, connection, documents):
+        self.remove(connection, documents)
+        weights = dict(zip(SEARCH_FIELDS, 'ABCD'))
+        vector = ' || '.join(
+            "setweight(to_tsvector('{0}', :{1}), '{2}')".format(
+                self.text_search_config, field, weights[field])
+            for field in SEARCH_FIELDS)
+        insert = text(
+            "INSERT INTO {0} (media_entry, document) "
+            "VALUES (:media_id, {1})".format(self.table, vector))
+        for batch in _batches(six.iteritems(documents)):
+            connection.execute(insert, [
+                dict(document, media_id=media_id)
+                for media_id, document in batch])
+
+    def remove(self, connection, media_ids):
+        for batch in _batches(media_ids):
+            connection.execute(text(
+                "DELETE FROM {0} WHERE media_entry IN ({1})".format(
+                    self.table, ', '.join(str(int(media_id))
+                                          for media_id in batch))))
+
+    def clear(self, connection):
+        connection.execute(text("DELETE FROM {0}".format(self.table)))
+
+    def count(self, connection, terms):
+        return connection.execute(text(
+            "SELECT count(*) FROM (SELECT media_entry FROM {0} "
+            "WHERE document @@ {1} LIMIT {2}) AS matches".format(
+                self.table, self._query(), MAX_MATCHES)),
+            query=self._tsquery(terms)).scalar()
+
+    def search(self, connection, terms, limit, offset=0):
+        # ts_rank takes weights of D, C, B and A
+        weights = ', '.join(str(FIELD_WEIGHTS[field] / FIELD_WEIGHTS['title'])
+                            for field in reversed(SEARCH_FIELDS))
+        return [media_id for (media_id,) in connection.execute(text(
+            "SELECT media_entry FROM (SELECT media_entry, document "
+            "FROM {0} WHERE document @@ {1} "
+            "ORDER BY media_entry DESC LIMIT {3}) AS newest "
+            "ORDER BY ts_rank(CAST('{{{2}}}' AS float4[]), document, {1}) "
+            "DESC, media_entry DESC LIMIT :limit OFFSET :offset".format(
+                self.table, self._query(), weights, MAX_MATCHES)),
+            query=self._tsquery(terms), limit=limit, offset=offset)]
+
+
+# The backends used for search_index = "database", by SQLAlchemy dialect
+DATABASE_SEARCH_INDEXES = {
+    'sqlite': SQLiteSearchIndex,
+    'postgresql': PostgreSQLSearchIndex,
+}
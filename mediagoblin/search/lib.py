@@ -0,0 +1,338 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+
+from sqlalchemy import and_, event, inspect, select
+from sqlalchemy.orm import object_session
+
+from mediagoblin import mg_globals
+from mediagoblin.db.base import Session
+from mediagoblin.db.models import MediaEntry, MediaTag, Comment, \
+    TextComment, GenericModelReference
+from mediagoblin.search.index import DATABASE_SEARCH_INDEXES, \
+    SEARCH_FIELDS, SQLiteSearchIndex, tokenize
+from mediagoblin.tools import common
+
+_log = logging.getLogger(__name__)
+
+# Media entries whose documents are read per query
+DOCUMENT_BATCH_SIZE = 500
+# Words of a search beyond these are ignored
+MAX_QUERY_TERMS = 16
+# Changes to these make a media entry's document change
+INDEXED_MEDIA_FIELDS = ('title', 'description', 'state')
+
+# The configured search index, created on first use
+_search_index = None
+_search_index_created = False
+
+
+def setup_search_index():
+    """
+    Forget the search index of an earlier app, which might have been
+    set up for another database (in tests)
+    """
+    global _search_index, _search_index_created
+    _search_index = None
+    _search_index_created = False
+
+
+def _create_search_index(index_class):
+    if index_class == 'database':
+        dialect = Session.get_bind().dialect.name
+        index_class = DATABASE_SEARCH_INDEXES.get(dialect)
+        if index_class is None:
+            _log.warning('No search index for {0} databases, search is '
+                         'disabled'.format(dialect))
+            return None
+        if index_class is SQLiteSearchIndex and \
+                not SQLiteSearchIndex.is_supported():
+            _log.warning('SQLite is built without FTS5, search is disabled')
+            return None
+        if not Session.get_bind().has_table(index_class.table):
+            _log.warning('The search index table is missing, search is '
+                         'disabled until "gmg dbupdate" creates it')
+            return None
+        return index_class()
+    return common.import_component(index_class)()
+
+
+def get_search_index():
+    """
+    The search index configured in search_index, or None
+    """
+    global _search_index, _search_index_created
+    index_class = (mg_globals.app_config or {}).get('search_index')
+    if not index_class:
+        return None
+
+    if not _search_index_created:
+        _search_index = _create_search_index(index_class)
+        _search_index_created = True
+    return _search_index
+
+
+def _batches(ids):
+    ids = list(ids)
+    for start in range(0, len(ids), DOCUMENT_BATCH_SIZE):
+        yield ids[start:start + DOCUMENT_BATCH_SIZE]
+
+
+def _comment_links():
+    """
+    Tables of the comment links joined to the references of their media
+    entries (target) and text comments (reply)
+    """
+    target = GenericModelReference.__table__.alias('target')
+    reply = GenericModelReference.__table__.alias('reply')
+    links = Comment.__table__
+    joined = links.join(target, links.c.target_id == target.c.id).join(
+        reply, links.c.comment_id == reply.c.id)
+    criteria = and_(target.c.model_type == MediaEntry.__tablename__,
+                    reply.c.model_type == TextComment.__tablename__)
+    return joined, target, reply, criteria
+
+
+def media_documents(connection, media_ids):
+    """
+    The documents of the processed media entries of media_ids, as a dict
+    of media entry id -> document
+    """
+    entries = MediaEntry.__table__
+    tags = MediaTag.__table__
+    comments = TextComment.__table__
+    joined, target, reply, criteria = _comment_links()
+
+    documents = {}
+    for batch in _batches(media_ids):
+        found = {}
+        for media_id, title, description in connection.execute(
+                select([entries.c.id, entries.c.title, entries.c.description])
+                .where(entries.c.id.in_(batch))
+                .where(entries.c.state == u'processed')):
+            found[media_id] = {'title': [title], 'description': [description],
+                               'tags': [], 'comments': []}
+        if not found:
+            continue
+
+        for media_id, name in connection.execute(
+                select([tags.c.media_entry, tags.c.name])
+                .where(tags.c.media_entry.in_(list(found)))):
+            found[media_id]['tags'].append(name)
+
+        for media_id, content in connection.execute(
+                select([target.c.obj_pk, comments.c.content])
+                .select_from(joined.join(
+                    comments, reply.c.obj_pk == comments.c.id))
+                .where(criteria)
+                .where(target.c.obj_pk.in_(list(found)))):
+            found[media_id]['comments'].append(content)
+
+        for media_id, fields in found.items():
+            documents[media_id] = dict(
+                (field, u'\n'.join(value for value in fields[field] if value))
+                for field in SEARCH_FIELDS)
+    return documents
+
+
+def update_search_index(connection, media_ids, index=None):
+    """
+    Index the media entries of media_ids as they are now, removing the
+    ones which are gone or not processed from the index
+    """
+    if index is None:
+        index = get_search_index()
+    media_ids = set(media_ids)
+    documents = media_documents(connection, media_ids)
+    index.remove(connection, media_ids.difference(documents))
+    index.update(connection, documents)
+
+
+def remove_from_search_index(media_ids):
+    """
+    Remove deleted media entries which the session never loaded (like
+    ones deleted with bulk queries) from the search index
+    """
+    index = get_search_index()
+    if index is not None:
+        index.remove(Session.connection(), media_ids)
+
+
+def parse_query(query):
+    """
+    The terms to search for in the words of query
+    """
+    terms = []
+    for term in tokenize(query):
+        if term not in terms:
+            terms.append(term)
+    return terms[:MAX_QUERY_TERMS]
+
+
+class SearchResults(object):
+    """
+    The processed media entries matching a search, best match first, as
+    a cursor for Pagination
+    """
+
+    def __init__(self, query, index=None):
+        self.index = index or get_search_index()
+        self.terms = parse_query(query)
+
+    def count(self):
+        if not self.terms:
+            return 0
+        return self.index.count(Session.connection(), self.terms)
+
+    def slice(self, start, stop):
+        if not self.terms or stop <= start:
+            return []
+        media_ids = self.index.search(
+            Session.connection(), self.terms, stop - start, start)
+        if not media_ids:
+            return []
+        entries = dict((entry.id, entry) for entry in MediaEntry.for_listing(
+            MediaEntry.query.filter(MediaEntry.id.in_(media_ids))))
+        return [entries[media_id] for media_id in media_ids
+                if media_id in entries]
+
+
+def reindex_media(batch_size=DOCUMENT_BATCH_SIZE, progress=None):
+    """
+    Build the search index anew from all processed media entries,
+    committing after each batch_size entries
+
+    progress is called with the number of entries indexed so far and
+    the number of entries to index after each batch.  Returns the number
+    of indexed entries.
+    """
+    index = get_search_index()
+    index.clear(Session.connection())
+
+    processed = MediaEntry.query.filter(MediaEntry.state == u'processed')
+    total = processed.count()
+    ids = processed.with_entities(MediaEntry.id).order_by(MediaEntry.id)
+    indexed = 0
+    last_id = None
+    while True:
+        # Keyset pagination, so late batches are as cheap as early ones
+        batch = ids if last_id is None else ids.filter(
+            MediaEntry.id > last_id)
+        media_ids = [media_id for (media_id,) in batch.limit(batch_size)]
+        if not media_ids:
+            break
+
+        connection = Session.connection()
+        documents = media_documents(connection, media_ids)
+        index.update(connection, documents)
+        Session.commit()
+
+        indexed += len(documents)
+        last_id = media_ids[-1]
+        if progress is not None:
+            progress(indexed, total)
+    Session.commit()
+    return indexed
+
+
+###########################################
+# Keeping the index up to date as media and
+# comments are saved and deleted
+###########################################
+
+def _pending(target):
+    session = object_session(target)
+    return session.info.setdefault(
+        'search_index_pending',
+        {'media': set(), 'targets': set(), 'comments': set()})
+
+
+def _media_entry_changed(mapper, connection, target):
+    if get_search_index() is not None:
+        _pending(target)['media'].add(target.id)
+
+
+def _media_entry_updated(mapper, connection, target):
+    # Not for changes the index doesn't care about, like the processing
+    # progress
+    state = inspect(target)
+    if any(state.attrs[field].history.has_changes()
+           for field in INDEXED_MEDIA_FIELDS):
+        _media_entry_changed(mapper, connection, target)
+
+
+def _media_tag_changed(mapper, connection, target):
+    if get_search_index() is not None:
+        _pending(target)['media'].add(target.media_entry)
+
+
+def _comment_link_changed(mapper, connection, target):
+    if get_search_index() is not None:
+        _pending(target)['targets'].add(target.target_id)
+
+
+def _text_comment_updated(mapper, connection, target):
+    if get_search_index() is not None and \
+            inspect(target).attrs.content.history.has_changes():
+        _pending(target)['comments'].add(target.id)
+
+
+def _commented_media(connection, target_ids, comment_ids):
+    """
+    The media entries of the references target_ids and the ones the
+    text comments of comment_ids are on
+    """
+    media_ids = set()
+    references = GenericModelReference.__table__
+    for batch in _batches(target_ids):
+        media_ids.update(media_id for (media_id,) in connection.execute(
+            select([references.c.obj_pk])
+            .where(references.c.id.in_(batch))
+            .where(references.c.model_type == MediaEntry.__tablename__)))
+
+    joined, target, reply, criteria = _comment_links()
+    for batch in _batches(comment_ids):
+        media_ids.update(media_id for (media_id,) in connection.execute(
+            select([target.c.obj_pk]).select_from(joined)
+            .where(criteria)
+            .where(reply.c.obj_pk.in_(batch))))
+    return media_ids
+
+
+def _update_after_flush(session, flush_context):
+    pending = session.info.pop('search_index_pending', None)
+    index = get_search_index()
+    if not pending or index is None:
+        return
+
+    connection = session.connection()
+    media_ids = pending['media']
+    media_ids.update(_commented_media(
+        connection, pending['targets'], pending['comments']))
+    media_ids.discard(None)
+    update_search_index(connection, media_ids, index)
+
+
+event.listen(MediaEntry, 'after_insert', _media_entry_changed)
+event.listen(MediaEntry, 'after_update', _media_entry_updated)
+event.listen(MediaEntry, 'after_delete', _media_entry_changed)
+for _event in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(MediaTag, _event, _media_tag_changed)
+event.listen(Comment, 'after_insert', _comment_link_changed)
+event.listen(Comment, 'after_delete', _comment_link_changed)
+event.listen(TextComment, 'after_update', _text_comment_updated)
+event.listen(Session, 'after_flush', _update_after_flush)
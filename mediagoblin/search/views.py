@@ -0,0 +1,42 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from mediagoblin.decorators import uses_pagination
+from mediagoblin.search.lib import get_search_index, SearchResults
+from mediagoblin.tools.pagination import Pagination
+from mediagoblin.tools.response import render_to_response, render_404
+
+
+@uses_pagination
+def search_results(request, page):
+    """Processed media entries matching the words of the 'q' parameter"""
+    index = get_search_index()
+    if index is None:
+        return render_404(request)
+
+    query = request.GET.get('q', u'').strip()
+    media_entries = []
+    pagination = None
+    if query:
+        pagination = Pagination(page, SearchResults(query, index))
+        media_entries = pagination()
+
+    return render_to_response(
+        request,
+        'mediagoblin/search/results.html',
+        {'query': query,
+         'media_entries': media_entries,
+         'pagination': pagination})
@@ -0,0 +1,81 @@
+/**
+ * GNU MediaGoblin -- federated, autonomous media hosting
+ * Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU Affero General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU Affero General Public License for more details.
+ *
+ * You should have received a copy of the GNU Affero General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses/>.
+ */
+
+$(document).ready(function () {
+    var element = $('#site-map');
+    if (!element.length) {
+        return;
+    }
+
+    var map = new L.Map('site-map');
+    map.attributionControl.setPrefix('');
+    map.addLayer(new L.TileLayer(
+        'https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png',
+        {maxZoom: 18}));
+
+    var markers = new L.LayerGroup();
+    map.addLayer(markers);
+
+    function mediaPopup(media) {
+        var link = $('<a>').attr('href', media.url);
+        link.append($('<img>').attr('src', media.thumb_url));
+        link.append($('<br>'));
+        link.append($('<span>').text(media.title));
+        return link[0];
+    }
+
+    function clusterMarker(cluster) {
+        var location = new L.LatLng(cluster.latitude, cluster.longitude);
+        if (cluster.media) {
+            return new L.Marker(location).bindPopup(mediaPopup(cluster.media));
+        }
+
+        var marker = new L.Marker(location, {
+            icon: new L.DivIcon({
+                className: 'map_cluster',
+                html: String(cluster.count),
+                iconSize: [36, 36]})});
+        marker.on('click', function () {
+            var bounds = cluster.bounds;
+            map.fitBounds([[bounds[0], bounds[1]], [bounds[2], bounds[3]]]);
+        });
+        return marker;
+    }
+
+    // Only the clusters of the latest view are shown
+    var request = null;
+    function update() {
+        var bounds = map.getBounds();
+        if (request) {
+            request.abort();
+        }
+        request = $.getJSON(element.data('clusters-url'), {
+            bbox: [bounds.getWest(), bounds.getSouth(),
+                   bounds.getEast(), bounds.getNorth()].join(','),
+            zoom: map.getZoom()
+        }, function (data) {
+            markers.clearLayers();
+            $.each(data.clusters, function (i, cluster) {
+                markers.addLayer(clusterMarker(cluster));
+            });
+        });
+    }
+
+    map.on('moveend', update);
+    map.setView(new L.LatLng(20, 0), 2);
+});
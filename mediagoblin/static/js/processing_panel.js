@@ -0,0 +1,58 @@
+'use strict';
+/**
+ * GNU MediaGoblin -- federated, autonomous media hosting
+ * Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU Affero General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU Affero General Public License for more details.
+ *
+ * You should have received a copy of the GNU Affero General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses/>.
+ */
+
+// Keep the progress of media in processing up to date, without reloading
+// the whole panel
+$(document).ready(function () {
+    var panel = $('table.media_panel.processing[data-progress-url]');
+    if (!panel.find('tr[data-entry-id]').length) {
+        return;
+    }
+
+    var show_progress = function (cell, progress) {
+        cell.text(progress ? progress + '%' : 'Unknown');
+    };
+
+    var update_progress = function () {
+        $.getJSON(panel.data('progress-url'), function (entries) {
+            var done = false;
+            panel.find('tr[data-entry-id]').each(function () {
+                var row = $(this);
+                var entry = entries[row.data('entry-id')];
+                if (entry === undefined) {
+                    // Processed or failed, which the panel shows better
+                    done = true;
+                    return false;
+                }
+                show_progress(row.find('.transcoding_progress'),
+                              entry.transcoding_progress);
+                show_progress(row.find('.main_transcoding_progress'),
+                              entry.main_transcoding_progress);
+            });
+
+            if (done) {
+                window.location.reload();
+            } else {
+                setTimeout(update_progress, 5000);
+            }
+        });
+    };
+
+    setTimeout(update_progress, 5000);
+});
@@ -14,17 +14,95 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import errno
+import hashlib
 import io
 import os
 import shutil
+import tempfile
 
 import six.moves.urllib.parse as urlparse
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 from mediagoblin.storage import (
     StorageInterface,
     clean_listy_filepath,
     NoWebServing)
 
+# ioctl to make a file share the data blocks of another (copy on write),
+# supported by btrfs, xfs and others on Linux
+FICLONE = 0x40049409
+
+COPY_CHUNK_SIZE = 4 * 1048576
+
+# Where content addressed blobs are kept, relative to base_dir.  Starts
+# with a dot so no cleaned storage filepath can collide with it.
+BLOB_DIR = u'.blobs'
+
+# Symlinks to the blobs named by their device and inode, to find the blob
+# of a file without hashing it again.  Blob subdirectories are named by
+# two hex digits, so they can't collide with it.
+BLOB_INODE_DIR = u'inodes'
+
+# os.replace is Python 3 only; os.rename replaces files on POSIX too
+_replace = getattr(os, 'replace', os.rename)
+
+
+def _reflink(source_file, dest_file):
+    if fcntl is None:
+        raise OSError(errno.ENOTSUP, "reflinks need fcntl")
+    fcntl.ioctl(dest_file.fileno(), FICLONE, source_file.fileno())
+
+
+def _sendfile(source_file, dest_file):
+    """Copy in the kernel, without moving the data through Python"""
+    if not hasattr(os, 'sendfile'):
+        raise OSError(errno.ENOTSUP, "os.sendfile not available")
+    size = os.fstat(source_file.fileno()).st_size
+    offset = 0
+    while offset < size:
+        sent = os.sendfile(dest_file.fileno(), source_file.fileno(),
+                           offset, min(size - offset, 1 << 30))
+        if sent == 0:
+            break
+        offset += sent
+
+
+def copy_file(filename, dest_path):
+    """
+    Copy filename to dest_path as cheaply as the filesystem allows
+
+    Tries a reflink, then os.sendfile, and falls back to copying in
+    COPY_CHUNK_SIZE chunks.  Like shutil.copy, permission bits are copied.
+    """
+    with open(filename, 'rb') as source_file:
+        with open(dest_path, 'wb') as dest_file:
+            for fast_copy in (_reflink, _sendfile):
+                try:
+                    fast_copy(source_file, dest_file)
+                    break
+                except (OSError, IOError):
+                    # Not supported here, start over with the next way
+                    dest_file.seek(0)
+                    dest_file.truncate()
+            else:
+                source_file.seek(0)
+                shutil.copyfileobj(source_file, dest_file, COPY_CHUNK_SIZE)
+    shutil.copymode(filename, dest_path)
+
+
+def file_digest(filename):
+    """SHA-256 hex digest of the file's contents"""
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as source_file:
+        for chunk in iter(lambda: source_file.read(COPY_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
 class FileObjectAwareFile(io.FileIO):
     def write(self, data):
         if hasattr(data, 'read'):
@@ -42,15 +120,25 @@ class BasicFileStorage(StorageInterface):
 
     local_storage = True
 
-    def __init__(self, base_dir, base_url=None, **kwargs):
+    def __init__(self, base_dir, base_url=None, link_files=False,
+                 content_addressed=False, **kwargs):
         """
         Keyword arguments:
         - base_dir: Base directory things will be served out of.  MUST
           be an absolute path.
         - base_url: URL files will be served from
+        - link_files: hard link files copied in from the same filesystem
+          instead of copying them.  Only safe if the copied files aren't
+          changed in place afterwards, which MediaGoblin never does with
+          queued files and workbenches.
+        - content_addressed: keep one blob per distinct content (named by
+          its SHA-256) and hard link all files with that content to it.
+          The blob goes away with the last file linking to it.
         """
         self.base_dir = base_dir
         self.base_url = base_url
+        self.link_files = link_files
+        self.content_addressed = content_addressed
 
     def _resolve_filepath(self, filepath):
         """
@@ -62,22 +150,64 @@ class BasicFileStorage(StorageInterface):
     def file_exists(self, filepath):
         return os.path.exists(self._resolve_filepath(filepath))
 
-    def get_file(self, filepath, mode='r'):
-        # Make directories if necessary
+    def _make_parent_dirs(self, filepath):
         if len(filepath) > 1:
             directory = self._resolve_filepath(filepath[:-1])
             if not os.path.exists(directory):
                 os.makedirs(directory)
 
+    def _unshare(self, path, keep_contents):
+        """Give path its own copy of a hard linked file before writing"""
+        try:
+            if os.stat(path).st_nlink < 2:
+                return
+        except OSError:
+            return
+
+        if not keep_contents:
+            os.remove(path)
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        os.close(fd)
+        copy_file(path, tmp_path)
+        _replace(tmp_path, path)
+
+    def get_file(self, filepath, mode='r'):
+        # Make directories if necessary
+        self._make_parent_dirs(filepath)
+
+        # Don't write through to other files sharing this one's data
+        path = self._resolve_filepath(filepath)
+        if 'w' in mode:
+            self._unshare(path, keep_contents=False)
+        elif 'a' in mode or '+' in mode:
+            self._unshare(path, keep_contents=True)
+
         # Grab and return the file in the mode specified
-        return FileObjectAwareFile(self._resolve_filepath(filepath), mode)
+        return FileObjectAwareFile(path, mode)
 
     def delete_file(self, filepath):
         """Delete file at filepath
 
         Raises OSError in case filepath is a directory."""
         #TODO: log error
-        os.remove(self._resolve_filepath(filepath))
+        path = self._resolve_filepath(filepath)
+        if not self.content_addressed:
+            os.remove(path)
+            return
+
+        path_stat = os.stat(path)
+        blob = None
+        if path_stat.st_nlink > 1:
+            blob = self._find_blob(path_stat)
+        os.remove(path)
+
+        # If the other link is the blob, it is unused from now on
+        if blob is not None:
+            blob_path, index_path = blob
+            if os.stat(blob_path).st_nlink == 1:
+                os.remove(blob_path)
+                os.remove(index_path)
 
     def delete_dir(self, dirpath, recursive=False):
         """returns True on succes, False on failure"""
@@ -111,17 +241,116 @@ class BasicFileStorage(StorageInterface):
     def get_local_path(self, filepath):
         return self._resolve_filepath(filepath)
 
+    def copy_locally(self, filepath, dest_path):
+        copy_file(self.get_local_path(filepath), dest_path)
+
     def copy_local_to_storage(self, filename, filepath):
         """
         Copy this file from locally to the storage system.
+
+        The file is put together next to its destination and renamed into
+        place, so existing files (which may share their data with others)
+        are replaced rather than overwritten.
         """
         # Make directories if necessary
-        if len(filepath) > 1:
-            directory = self._resolve_filepath(filepath[:-1])
-            if not os.path.exists(directory):
-                os.makedirs(directory)
-        # This uses chunked copying of 16kb buffers (Py2.7):
-        shutil.copy(filename, self.get_local_path(filepath))
+        self._make_parent_dirs(filepath)
+        dest_path = self.get_local_path(filepath)
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(dest_path))
+        os.close(fd)
+        try:
+            if self.content_addressed:
+                self._link_to_blob(filename, tmp_path)
+                if os.path.exists(dest_path):
+                    # Let go of the replaced file's blob
+                    self.delete_file(filepath)
+            else:
+                self._copy_or_link(filename, tmp_path)
+            _replace(tmp_path, dest_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _copy_or_link(self, filename, dest_path):
+        """Copy filename to dest_path, replacing whatever is there"""
+        if self.link_files:
+            os.remove(dest_path)
+            try:
+                os.link(filename, dest_path)
+                return
+            except OSError:
+                # Different filesystem or no hard links there
+                pass
+        copy_file(filename, dest_path)
+
+    def _blob_path(self, digest):
+        return os.path.join(self.base_dir, BLOB_DIR, digest[:2], digest[2:])
+
+    def _blob_index_path(self, stat_result):
+        return os.path.join(
+            self.base_dir, BLOB_DIR, BLOB_INODE_DIR,
+            '%x-%x' % (stat_result.st_dev, stat_result.st_ino))
+
+    def _index_blob(self, blob_path):
+        """Remember blob_path by its inode, see _find_blob"""
+        index_path = self._blob_index_path(os.stat(blob_path))
+        index_dir = os.path.dirname(index_path)
+        if not os.path.exists(index_dir):
+            os.makedirs(index_dir)
+        if os.path.lexists(index_path):
+            # Left from a deleted blob whose inode got reused
+            os.remove(index_path)
+        try:
+            os.symlink(os.path.relpath(blob_path, index_dir), index_path)
+        except (OSError, NotImplementedError, AttributeError):
+            # No symlinks here, the blob stays when its files are deleted
+            pass
+
+    def _find_blob(self, path_stat):
+        """
+        The (blob path, index path) of the blob which the file of
+        path_stat is a link to, or None
+        """
+        index_path = self._blob_index_path(path_stat)
+        try:
+            blob_path = os.path.join(os.path.dirname(index_path),
+                                     os.readlink(index_path))
+            blob_stat = os.stat(blob_path)
+        except (OSError, AttributeError):
+            return None
+        if not os.path.samestat(path_stat, blob_stat):
+            return None
+        return blob_path, index_path
+
+    def _link_to_blob(self, filename, dest_path):
+        """Make dest_path a link to the blob with filename's content"""
+        blob_path = self._blob_path(file_digest(filename))
+        blob_dir = os.path.dirname(blob_path)
+        if not os.path.exists(blob_dir):
+            os.makedirs(blob_dir)
+
+        # The blob can vanish when its last other file is deleted in the
+        # meantime, so it is created again once
+        for attempt in range(2):
+            if not os.path.exists(blob_path):
+                fd, tmp_blob_path = tempfile.mkstemp(dir=blob_dir)
+                os.close(fd)
+                self._copy_or_link(filename, tmp_blob_path)
+                _replace(tmp_blob_path, blob_path)
+                self._index_blob(blob_path)
+
+            if os.path.exists(dest_path):
+                os.remove(dest_path)
+            try:
+                os.link(blob_path, dest_path)
+                return
+            except OSError as error:
+                if error.errno != errno.ENOENT:
+                    # e.g. too many links, keep a separate copy
+                    copy_file(blob_path, dest_path)
+                    return
+        copy_file(filename, dest_path)
 
     def get_file_size(self, filepath):
         return os.stat(self._resolve_filepath(filepath)).st_size
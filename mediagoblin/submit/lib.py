@@ -106,7 +106,8 @@ class UserPastUploadLimit(UploadLimitError):
 def submit_media(mg_app, user, submitted_file, filename,
                  title=None, description=None, collection_slug=None,
                  license=None, metadata=None, tags_string=u"",
-                 callback_url=None, urlgen=None,):
+                 callback_url=None, urlgen=None, sniffed=None,
+                 queued_filepath=None):
     """
     Args:
      - mg_app: The MediaGoblinApp instantiated for this process
@@ -125,6 +126,11 @@ def submit_media(mg_app, user, submitted_file, filename,
      - callback_url: possible post-hook to call after submission
      - urlgen: if provided, used to do the feed_url update and assign a public
                ID used in the API (very important).
+     - sniffed: the (media_type, media_manager) sniff_media returned for
+       submitted_file, if it has been sniffed already
+     - queued_filepath: where submitted_file already is in the queue
+       store (like uploads put together there), to queue it from there
+       instead of copying it.  Processing deletes it and its directory.
     """
     upload_limit, max_file_size = get_upload_file_limits(user)
     if upload_limit and user.uploaded >= upload_limit:
@@ -136,7 +142,9 @@ def submit_media(mg_app, user, submitted_file, filename,
 
     # Sniff the submitted media to determine which
     # media plugin should handle processing
-    media_type, media_manager = sniff_media(submitted_file, filename)
+    if sniffed is None:
+        sniffed = sniff_media(submitted_file, filename)
+    media_type, media_manager = sniffed
 
     # create entry and save in database
     entry = new_upload_entry(user)
@@ -155,10 +163,14 @@ def submit_media(mg_app, user, submitted_file, filename,
     # Generate a slug from the title
     entry.generate_slug()
 
-    queue_file = prepare_queue_task(mg_app, entry, filename)
+    if queued_filepath:
+        entry.queued_task_id = six.text_type(uuid.uuid4())
+        entry.queued_media_file = queued_filepath
+    else:
+        queue_file = prepare_queue_task(mg_app, entry, filename)
 
-    with queue_file:
-        queue_file.write(submitted_file)
+        with queue_file:
+            queue_file.write(submitted_file)
 
     # Get file size and round to 2 decimal places
     file_size = mg_app.queue_store.get_file_size(
@@ -16,9 +16,16 @@
 
 import celery
 import datetime
+import logging
 import pytz
 
+from mediagoblin import mg_globals
 from mediagoblin.db.models import MediaEntry
+from mediagoblin.db.util import clean_orphan_tags
+from mediagoblin.tools.session import get_session_store
+
+_log = logging.getLogger(__name__)
+
 
 @celery.task()
 def collect_garbage():
@@ -36,3 +43,30 @@ def collect_garbage():
 
     for entry in garbage.all():
         entry.delete()
+
+    # Tags removed from media entries while editing them are left behind
+    orphans = clean_orphan_tags()
+    if orphans:
+        _log.info('Deleted {0} unused tags'.format(orphans))
+
+    # Sessions which have expired can't be used anymore
+    session_store = get_session_store(mg_globals.app_config)
+    if session_store is not None:
+        session_store.delete_expired()
+
+
+@celery.task()
+def delete_public_files(filepaths):
+    """
+    Delete files of deleted media entries from the public store
+    """
+    no_such_files = []
+    for filepath in filepaths:
+        try:
+            mg_globals.public_store.delete_file(filepath)
+        except OSError:
+            no_such_files.append("/".join(filepath))
+
+    if no_such_files:
+        _log.error('No such files to delete: {0}'.format(
+            ", ".join(no_such_files)))
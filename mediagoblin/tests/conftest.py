@@ -39,3 +39,19 @@ def pt_fixture_enable_testing():
     py.test fixture to enable testing mode in tools.
     """
     _activate_testing()
+
+
+@pytest.fixture()
+def process_media_locally(monkeypatch):
+    """
+    py.test fixture to run media processing tasks in the test process
+    right away, like CELERY_ALWAYS_EAGER does, but without connecting
+    to the broker (which newer kombu versions can't do for the sqlite://
+    broker of the test configs).
+    """
+    from mediagoblin.processing.task import ProcessMedia
+
+    def apply_async(self, args=None, kwargs=None, **options):
+        return self.apply(args, kwargs, **options)
+
+    monkeypatch.setattr(ProcessMedia, 'apply_async', apply_async)
@@ -26,7 +26,7 @@ from webtest import AppError
 from .resources import GOOD_JPG
 from mediagoblin import mg_globals
 from mediagoblin.db.models import User, MediaEntry, TextComment
-from mediagoblin.tests.tools import fixture_add_user
+from mediagoblin.tests.tools import fixture_add_user, fixture_media_entry
 from mediagoblin.moderation.tools import take_away_privileges
 
 
@@ -721,3 +721,24 @@ class TestAPI(object):
             .first()
 
         assert model.content == activity["object"]["content"]
+
+    def test_search(self, test_app):
+        """ Test that media can be searched for """
+        entry = fixture_media_entry(title=u"Mountain lake",
+                                    uploader=self.user.id,
+                                    state=u"processed")
+        entry.set_file_metadata("thumb", width=180, height=120)
+        entry.set_file_metadata("original", width=640, height=480)
+
+        with self.mock_oauth():
+            response = test_app.get("/api/search/", {"q": "mountain"})
+            results = json.loads(response.body.decode())
+
+            assert results["totalItems"] == 1
+            assert results["items"][0]["displayName"] == u"Mountain lake"
+
+            response = test_app.get("/api/search/", {"q": "sea"})
+            results = json.loads(response.body.decode())
+
+            assert results["totalItems"] == 0
+            assert results["items"] == []
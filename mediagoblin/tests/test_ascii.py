@@ -0,0 +1,78 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+pytest.importorskip("chardet")
+
+try:
+    from PIL import Image, ImageChops, ImageDraw
+except ImportError:
+    import Image
+    import ImageChops
+    import ImageDraw
+
+from mediagoblin.media_types.ascii.asciitoimage import AsciiToImage
+
+
+ASCII_ART = u'''\
+   _____
+  /     \\   gjpqy|
+ | () () |  ─│█ äöü
+  \\  ^  /
+   |||||
+'''.encode('utf-8')
+
+
+def draw_with_text(converter, text):
+    """ Draw every character with ImageDraw.text, as it used to be done """
+    lines = text.decode('utf-8').split(u'\n')
+    width, height = converter._if_dims
+    im = Image.new('RGBA', (max(len(line) for line in lines) * width,
+                            len(lines) * height), (255, 255, 255, 0))
+    draw = ImageDraw.Draw(im)
+    for row, line in enumerate(lines):
+        for column, char in enumerate(line):
+            draw.text((column * width, row * height), char,
+                      font=converter._if, fill=(0, 0, 0, 255))
+    return im
+
+
+@pytest.mark.parametrize('font_size', [11, 24])
+def test_glyph_atlas_matches_text_drawing(font_size):
+    converter = AsciiToImage(font_size=font_size)
+    im = converter._create_image(ASCII_ART)
+    expected = draw_with_text(converter, ASCII_ART)
+    assert im.size == expected.size
+    assert ImageChops.difference(im, expected).getbbox() is None
+
+
+def test_strips_match_whole_image():
+    converter = AsciiToImage(font_size=24)
+    whole = converter._create_image(ASCII_ART)
+    tops = []
+    for top, strip in converter.create_strips(ASCII_ART, strip_lines=2):
+        tops.append(top)
+        part = whole.crop((0, top, whole.size[0], top + strip.size[1]))
+        assert ImageChops.difference(part, strip).getbbox() is None
+    assert len(tops) == 3
+
+
+def test_thumbnail_in_strips():
+    whole = AsciiToImage().create_thumbnail(ASCII_ART, (40, 40))
+    in_strips = AsciiToImage(max_pixels=1).create_thumbnail(
+        ASCII_ART, (40, 40))
+    assert whole.size == in_strips.size
+    assert in_strips.getbbox()
@@ -22,6 +22,9 @@ from contextlib import contextmanager
 import logging
 import imghdr
 
+import numpy
+from PIL import Image
+
 #os.environ['GST_DEBUG'] = '4,python:4'
 
 pytest.importorskip("gi.repository.Gst")
@@ -33,6 +36,8 @@ Gst.init(None)
 
 from mediagoblin.media_types.audio.transcoders import (AudioTranscoder,
         AudioThumbnailer)
+from mediagoblin.media_types.audio import audioprocessing
+from mediagoblin.media_types.audio.audioprocessing import SpectrogramImage
 from mediagoblin.media_types.tools import discover
 
 
@@ -103,3 +108,64 @@ def test_thumbnails():
         thumbnailer.spectrogram(new_name, thumbnail.name, width=100,
                                 fft_size=4096)
         assert imghdr.what(thumbnail.name) == 'jpeg'
+
+
+def test_batched_spectrogram_matches_per_column():
+    '''Drawing all spectra at once gives the same image as per column.'''
+    width, height, fft_size = 50, 15, 512
+    spectra = numpy.random.RandomState(0).random_sample(
+        (width, fft_size // 2 + 1))
+
+    per_column = SpectrogramImage(width, height, fft_size)
+    for x in range(width):
+        per_column.draw_spectrum(x, spectra[x])
+    per_column.image.putdata(per_column.pixels)
+    expected = numpy.asarray(per_column.image.transpose(Image.ROTATE_90))
+
+    batched = SpectrogramImage(width, height, fft_size)
+    batched.draw_spectra(spectra)
+    assert (numpy.asarray(batched.image) == expected).all()
+
+
+class ArraySndfile(object):
+    '''Just enough of audiolab.Sndfile to read samples from an array.'''
+    samplerate = 44100
+    channels = 1
+
+    def __init__(self, samples):
+        self.samples = samples
+        self.nframes = len(samples)
+        self.position = 0
+
+    def seek(self, position):
+        self.position = position
+
+    def read_frames(self, count):
+        frames = self.samples[self.position:self.position + count]
+        self.position += count
+        return frames.copy()
+
+    def close(self):
+        pass
+
+
+def test_compute_spectra_matches_spectral_centroid(monkeypatch):
+    '''The batched spectra are the ones spectral_centroid computes per
+    column, also for the windows padded at the start and the end.'''
+    samples = numpy.random.RandomState(0).uniform(-0.5, 0.5, 20000)
+    samples += 0.4 * numpy.sin(numpy.arange(20000) * 0.05)
+    monkeypatch.setattr(audioprocessing.audiolab, 'Sndfile',
+                        lambda filename, mode: ArraySndfile(samples))
+
+    width, fft_size = 37, 1024
+    seek_points = audioprocessing.get_seek_points(len(samples), width)
+    processor = audioprocessing.AudioProcessor('audio.wav', fft_size)
+    expected = numpy.array([processor.spectral_centroid(seek_point)[1]
+                            for seek_point in seek_points])
+
+    # Blocks smaller and larger than the windows
+    for block_size in (300, 4096, 262144):
+        spectra = audioprocessing.compute_spectra(
+            'audio.wav', seek_points, fft_size, block_size=block_size)
+        assert spectra.shape == expected.shape
+        assert numpy.allclose(spectra, expected, rtol=0, atol=1e-9)
@@ -0,0 +1,135 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse
+import io
+
+import pytest
+try:
+    from PIL import Image
+except ImportError:
+    import Image
+
+from mediagoblin import mg_globals
+from mediagoblin.db.models import MediaEntry
+from mediagoblin.gmg_commands import batchaddmedia as batch
+from mediagoblin.gmg_commands.batchaddmedia import (
+    ImportCheckpoint, ImportProgress, FetchError, fetch_media)
+from mediagoblin.tests.tools import fixture_add_user
+
+
+class Interrupted(Exception):
+    pass
+
+
+def make_batch(tmpdir, count):
+    """ A csv file with count small images, returning its path """
+    lines = [u'location,dc:title']
+    for i in range(count):
+        filename = u'image{0}.png'.format(i)
+        Image.new('RGB', (20 + i, 10), (10 * i, 0, 0)).save(
+            str(tmpdir.join(filename)))
+        lines.append(u'{0},Image {1}'.format(filename, i))
+    metadata_path = str(tmpdir.join('batch.csv'))
+    with io.open(metadata_path, 'w', encoding='utf-8') as metadata_file:
+        metadata_file.write(u'\n'.join(lines) + u'\n')
+    return metadata_path
+
+
+def test_checkpoint(tmpdir):
+    path = str(tmpdir.join('batch.csv.imported'))
+    checkpoint = ImportCheckpoint(path)
+    checkpoint.add(u'image.png')
+    checkpoint.add(u'http://example.org/\xe9t\xe9.jpg')
+    assert u'image.png' in checkpoint
+    checkpoint.close()
+
+    checkpoint = ImportCheckpoint(path)
+    assert checkpoint.locations == set(
+        [u'image.png', u'http://example.org/\xe9t\xe9.jpg'])
+    assert u'other.png' not in checkpoint
+    checkpoint.close()
+
+
+def test_progress(capsys):
+    progress = ImportProgress(4, interval=3600)
+    progress.row_done()
+    assert capsys.readouterr()[0] == ''
+
+    progress.started -= 10
+    progress.report()
+    out = capsys.readouterr()[0]
+    assert out.startswith('1 of 4 rows done (0.10 rows/s)')
+    assert '0:00:30' in out
+
+
+def test_fetch_media(test_app, tmpdir):
+    metadata_dir = str(tmpdir)
+    Image.new('RGB', (20, 10)).save(str(tmpdir.join('image.png')))
+
+    media_file, filename, sniffed = fetch_media(u'image.png', metadata_dir)
+    media_file.close()
+    assert filename == u'image.png'
+    assert sniffed[0] == u'mediagoblin.media_types.image'
+
+    with pytest.raises(FetchError):
+        fetch_media(u'missing.png', metadata_dir)
+    with pytest.raises(FetchError):
+        fetch_media(u'ftp://example.org/image.png', metadata_dir)
+
+
+def test_resume_interrupted_import(test_app, tmpdir, monkeypatch,
+                                   process_media_locally):
+    """ A parallel import interrupted partway and run again submits every
+    row exactly once """
+    user = fixture_add_user(u'importer',
+                            privileges=[u'active', u'uploader'])
+    metadata_path = make_batch(tmpdir, 8)
+    monkeypatch.setattr(batch.commands_util, 'setup_app',
+                        lambda args: mg_globals.app)
+    monkeypatch.setenv('CELERY_ALWAYS_EAGER', 'true')
+
+    # Filenames submitted, and after how many to stop the import
+    submitted = []
+    interrupt_at = [3]
+    real_submit_media = batch.submit_media
+
+    def submit_media(**kwargs):
+        if interrupt_at[0] is not None and len(submitted) == interrupt_at[0]:
+            raise Interrupted()
+        submitted.append(kwargs['filename'])
+        return real_submit_media(**kwargs)
+
+    monkeypatch.setattr(batch, 'submit_media', submit_media)
+    args = argparse.Namespace(
+        username=u'importer', metadata_path=metadata_path, celery=False,
+        jobs=2, checkpoint=None, conf_file=None)
+
+    with pytest.raises(Interrupted):
+        batch.batchaddmedia(args)
+    assert len(submitted) == 3
+
+    interrupt_at[0] = None
+    batch.batchaddmedia(args)
+
+    expected = [u'image{0}.png'.format(i) for i in range(8)]
+    assert sorted(submitted) == expected
+    assert sorted(
+        entry.title for entry in MediaEntry.query.filter_by(actor=user.id)
+    ) == [u'Image {0}'.format(i) for i in range(8)]
+    checkpoint = ImportCheckpoint(metadata_path + '.imported')
+    assert checkpoint.locations == set(expected)
+    checkpoint.close()
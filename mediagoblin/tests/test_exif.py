@@ -14,6 +14,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import datetime
 import os
 try:
     from PIL import Image
@@ -22,8 +23,12 @@ except ImportError:
 
 from collections import OrderedDict
 
+from mediagoblin import mg_globals
+from mediagoblin.db.models import MediaEntry
+from mediagoblin.gmg_commands.summarizeexif import summarize_images
 from mediagoblin.tools.exif import exif_fix_image_orientation, \
-    extract_exif, clean_exif, get_gps_data, get_useful
+    extract_exif, clean_exif, get_gps_data, get_useful, summarize_exif
+from mediagoblin.tests.tools import fixture_add_user, fixture_media_entry
 from .resources import GOOD_JPG, EMPTY_JPG, BAD_JPG, GPS_JPG, BAD_GPS_JPG
 
 
@@ -410,6 +415,61 @@ def test_exif_no_exif():
     assert useful == {}
 
 
+def test_exif_summary():
+    summary = summarize_exif(clean_exif(extract_exif(GOOD_JPG)))
+    assert summary == {
+        'taken': datetime.datetime(2011, 6, 22, 12, 20, 33),
+        'camera_make': u'NIKON CORPORATION',
+        'camera_model': u'NIKON D80',
+        'lens': None,
+        'exposure_time': u'1/125',
+        'aperture': 10.0,
+        'iso': 100,
+        'focal_length': 18.0}
+
+    assert set(summarize_exif({}).values()) == set([None])
+
+
+def test_exif_summary_backfill(test_app, monkeypatch):
+    """ Images from before summaries were stored get them from exif_all """
+    monkeypatch.setitem(mg_globals.app_config, 'exif_visible', True)
+    user = fixture_add_user(u'photographer', privileges=[u'active'])
+    entry = fixture_media_entry(uploader=user.id, state=u'processed',
+                                expunge=False)
+    entry.media_data_init(exif_all=clean_exif(extract_exif(GOOD_JPG)))
+    entry.save()
+    entry_id = entry.id
+
+    short = {
+        'Date Taken': 'June 22 2011',
+        'Aperture': 'f/10',
+        'Camera': u'NIKON D80',
+        'Exposure': '1/125 sec',
+        'ISO Speed': 100,
+        'Focal Length': '18 mm'}
+    entry = MediaEntry.query.get(entry_id)
+    assert entry.media_data.has_exif is None
+    assert entry.exif_display_data_short() == short
+
+    assert summarize_images() == 1
+    assert summarize_images() == 0
+
+    entry = MediaEntry.query.get(entry_id)
+    assert entry.media_data.has_exif
+    assert entry.media_data.camera_model == u'NIKON D80'
+    assert (entry.media_data.width, entry.media_data.height) == (3872, 2592)
+    assert entry.exif_display_data_short() == short
+    assert entry.media_manager.get_original_date() == \
+        datetime.datetime(2011, 6, 22, 12, 20, 33)
+    # The tags themselves are not loaded for this
+    assert 'exif_all' not in entry.media_data.__dict__
+
+    res = test_app.get('/u/photographer/m/{0}/'.format(entry.slug))
+    assert b'NIKON D80' in res.body
+    # and the tags are still all shown
+    assert b'18/5' in res.body
+
+
 def test_exif_bad_image():
     '''
     Test EXIF extraction from a faithful, but bad image
@@ -0,0 +1,97 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+
+import pkg_resources
+import pytest
+
+from mediagoblin.db.models import Location, MediaEntry
+from mediagoblin.plugins.geolocation.tools import parse_bbox
+from mediagoblin.tools import template
+from mediagoblin.tests.tools import get_app, fixture_add_user, \
+    fixture_media_entry
+
+
+@pytest.fixture()
+def geolocation_app(request, monkeypatch):
+    # Template environments of earlier apps don't know the plugin's templates
+    monkeypatch.setattr(template, 'SETUP_JINJA_ENVS', {})
+    return get_app(
+        request,
+        mgoblin_config=pkg_resources.resource_filename(
+            'mediagoblin.tests', 'appconfig_geolocation.ini'))
+
+
+def test_parse_bbox():
+    assert parse_bbox('-10,-20,30,40') == (-10, -20, 30, 40)
+    assert parse_bbox('-200,-100,-170,100') == (160, -90, -170, 90)
+    assert parse_bbox('-400,0,400,10') == (-180, 0, 180, 10)
+    assert parse_bbox('170,-20,190,-10') == (170, -20, -170, -10)
+    for bbox in ('1,2,3', '1,2,3,x', '0,3,1,1', '0,nan,1,1'):
+        with pytest.raises(ValueError):
+            parse_bbox(bbox)
+
+
+def add_located_media(user, latitude, longitude, state=u'processed'):
+    entry = fixture_media_entry(uploader=user.id, state=state, expunge=False)
+    Location.create(
+        {"position": {"latitude": latitude, "longitude": longitude}}, entry)
+    entry.save()
+    return entry.id
+
+
+def get_clusters(app, bbox, zoom):
+    res = app.get('/map/clusters/', {'bbox': bbox, 'zoom': zoom})
+    return sorted(json.loads(res.body.decode())['clusters'],
+                  key=lambda cluster: cluster['count'])
+
+
+def test_media_clusters(geolocation_app):
+    user = fixture_add_user(u'traveller', privileges=[u'active'])
+    # Three photos in Paris, one in Berlin and one across the antimeridian
+    for offset in (0, .001, .002):
+        add_located_media(user, 48.85 + offset, 2.35)
+    berlin_id = add_located_media(user, 52.52, 13.4)
+    add_located_media(user, -17.7, 179.9)
+    # Neither unprocessed media nor user locations are shown
+    add_located_media(user, 48.85, 2.35, state=u'unprocessed')
+    location = Location.query.filter_by(latitude=48.85).first()
+    assert location.longitude == 2.35
+
+    clusters = get_clusters(geolocation_app, '-10,40,20,60', 5)
+    assert [cluster['count'] for cluster in clusters] == [1, 3]
+    berlin, paris = clusters
+    assert berlin['media']['id'] == berlin_id
+    assert berlin['media']['title'] == MediaEntry.query.get(berlin_id).title
+    assert paris['latitude'] == pytest.approx(48.851)
+    assert paris['bounds'] == pytest.approx([48.85, 2.35, 48.852, 2.35])
+    assert 'media' not in paris
+
+    # Close enough, the photos in Paris are apart
+    clusters = get_clusters(geolocation_app, '2.34,48.849,2.36,48.853', 18)
+    assert [cluster['count'] for cluster in clusters] == [1, 1, 1]
+
+    # The box and the clusters may go across the antimeridian
+    clusters = get_clusters(geolocation_app, '170,-20,-170,-10', 3)
+    assert len(clusters) == 1
+    assert clusters[0]['longitude'] == pytest.approx(179.9)
+
+    res = geolocation_app.get('/map/clusters/', {'bbox': 'nowhere'},
+                              expect_errors=True)
+    assert res.status_int == 400
+
+    assert b'site-map' in geolocation_app.get('/map/').body
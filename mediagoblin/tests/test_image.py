@@ -0,0 +1,159 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import collections
+import os
+
+import pytest
+try:
+    from PIL import Image
+except ImportError:
+    import Image
+
+from mediagoblin import mg_globals
+from mediagoblin.db.models import MediaEntry
+from mediagoblin.media_types.image import processing
+from mediagoblin.media_types.image.processing import parse_extra_sizes, \
+    resize_pyramid
+from mediagoblin.submit.lib import submit_media
+from mediagoblin.tests.tools import fixture_add_user, fixture_media_entry
+
+
+# Like the tags exifread returns
+ExifTag = collections.namedtuple('ExifTag', 'values')
+
+
+@pytest.fixture
+def landscape_jpg(tmpdir):
+    """ A 1600x1000 JPEG, wider than it is high """
+    filename = str(tmpdir.join('landscape.jpg'))
+    image = Image.new('RGB', (1600, 1000), (40, 90, 200))
+    # Something for the resizing filters to do
+    image.paste((250, 250, 0), (0, 0, 800, 500))
+    image.save(filename, quality=90)
+    return filename
+
+
+def stored_size(entry, keyname):
+    path = mg_globals.public_store.get_local_path(entry.media_files[keyname])
+    return Image.open(path).size
+
+
+RENDITIONS = [
+    ('thumb', 'landscape.thumbnail.jpg', (180, 180), True),
+    ('medium', 'landscape.medium.jpg', (640, 640), False),
+    ('thumb_2x', 'landscape.thumb_2x.jpg', (360, 360), False)]
+
+
+def run_pyramid(entry, filename, exif_tags, tmpdir):
+    workdir = str(tmpdir.mkdir('conversions'))
+    resize_pyramid(entry, filename, RENDITIONS, workdir, exif_tags, 90,
+                   'ANTIALIAS')
+
+
+def test_resize_pyramid(test_app, landscape_jpg, tmpdir, monkeypatch):
+    """ All renditions come from a single decode of the original """
+    opened = []
+    real_open = Image.open
+
+    def counting_open(*args, **kwargs):
+        opened.append(args)
+        return real_open(*args, **kwargs)
+
+    monkeypatch.setattr(processing.Image, 'open', counting_open)
+    entry = fixture_media_entry(fake_upload=False, expunge=False)
+    run_pyramid(entry, landscape_jpg, {}, tmpdir)
+    monkeypatch.undo()
+
+    assert len(opened) == 1
+    assert set(entry.media_files) == set(['thumb', 'medium', 'thumb_2x'])
+    assert stored_size(entry, 'medium') == (640, 400)
+    assert stored_size(entry, 'thumb_2x') == (360, 225)
+    assert stored_size(entry, 'thumb') == (180, 113)
+    assert entry.get_file_metadata('thumb_2x') == {
+        'width': 360, 'height': 360, 'quality': 90, 'filter': 'ANTIALIAS'}
+
+
+def test_resize_pyramid_small_original(test_app, tmpdir):
+    """ Only forced renditions are made of originals smaller than them """
+    filename = str(tmpdir.join('small.png'))
+    Image.new('RGB', (200, 150)).save(filename)
+    entry = fixture_media_entry(fake_upload=False, expunge=False)
+    run_pyramid(entry, filename, {}, tmpdir)
+
+    assert set(entry.media_files) == set(['thumb'])
+    assert stored_size(entry, 'thumb') == (180, 135)
+
+
+def test_resize_pyramid_orientation(test_app, landscape_jpg, tmpdir,
+                                    monkeypatch):
+    """ The EXIF orientation is applied once, before all renditions """
+    fixes = []
+    real_fix = processing.exif_fix_image_orientation
+
+    def counting_fix(im, exif_tags):
+        fixes.append(im.size)
+        return real_fix(im, exif_tags)
+
+    monkeypatch.setattr(processing, 'exif_fix_image_orientation',
+                        counting_fix)
+    entry = fixture_media_entry(fake_upload=False, expunge=False)
+    # Rotated by 90 degrees
+    run_pyramid(entry, landscape_jpg,
+                {'Image Orientation': ExifTag([6])}, tmpdir)
+
+    assert len(fixes) == 1
+    assert stored_size(entry, 'medium') == (400, 640)
+    assert stored_size(entry, 'thumb_2x') == (225, 360)
+    assert stored_size(entry, 'thumb') == (112, 180)
+
+
+def test_parse_extra_sizes():
+    assert parse_extra_sizes([]) == []
+    assert parse_extra_sizes([u'thumb_2x:360x360', u' medium_2x:1280X960']) \
+        == [(u'thumb_2x', (360, 360)), (u'medium_2x', (1280, 960))]
+
+    for extra_size in (u'thumb_2x', u'thumb_2x:360', u'thumb_2x:axb',
+                       u'thumb_2x:360x360:2', u'thumb:360x360',
+                       u'original:4000x4000'):
+        with pytest.raises(ValueError):
+            parse_extra_sizes([extra_size])
+
+
+def test_extra_sizes_processing(test_app, landscape_jpg, monkeypatch,
+                                process_media_locally):
+    """ Uploads get the renditions of extra_sizes along with the others """
+    image_config = mg_globals.global_config['plugins'][
+        'mediagoblin.media_types.image']
+    monkeypatch.setitem(image_config, 'extra_sizes', [u'thumb_2x:360x360'])
+    user = fixture_add_user(u'renderer', privileges=[u'active', u'uploader'])
+
+    with open(landscape_jpg, 'rb') as upload:
+        entry = submit_media(
+            mg_globals.app, user, upload, u'landscape.jpg',
+            title=u'Renditions')
+
+    entry = MediaEntry.query.get(entry.id)
+    assert entry.state == u'processed'
+    assert set(entry.media_files) == set(
+        ['original', 'medium', 'thumb', 'thumb_2x'])
+    assert entry.media_files['thumb_2x'][-1].endswith(
+        'landscape.thumb_2x.jpg')
+    assert stored_size(entry, 'original') == (1600, 1000)
+    assert stored_size(entry, 'thumb_2x') == (360, 225)
+    assert os.path.basename(
+        mg_globals.public_store.get_local_path(entry.media_files['medium'])
+    ).endswith('landscape.medium.jpg')
@@ -14,18 +14,32 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import io
+import os
 import pytz
 import datetime
 
+from sqlalchemy import event
 from werkzeug.datastructures import FileStorage
 
 from .resources import GOOD_JPG
 from mediagoblin.db.base import Session
-from mediagoblin.media_types import sniff_media
+from mediagoblin.db.deletion import delete_media_entries
+from mediagoblin.db.util import clean_orphan_tags
+from mediagoblin.gmg_commands.compiletemplates import compile_templates
+from mediagoblin.media_types import sniff_media, SniffedFile, \
+    SNIFF_HEADER_SIZE
 from mediagoblin.submit.lib import new_upload_entry
-from mediagoblin.submit.task import collect_garbage
-from mediagoblin.db.models import User, MediaEntry, TextComment, Comment
-from mediagoblin.tests.tools import fixture_add_user, fixture_media_entry
+from mediagoblin.submit.task import collect_garbage, delete_public_files
+from mediagoblin.db.models import User, MediaEntry, TextComment, Comment, \
+    Collection, CollectionItem, MediaFile, Graveyard, GenericModelReference, \
+    Tag
+from mediagoblin.user_pages.lib import add_media_to_collection
+from mediagoblin import mg_globals
+from mediagoblin.tools import response_cache
+from mediagoblin.tools.response_cache import MemoryResponseCache
+from mediagoblin.tests.tools import fixture_add_user, fixture_media_entry, \
+    fixture_add_collection
 
 
 def test_404_for_non_existent(test_app):
@@ -107,6 +121,76 @@ def test_media_deletes_broken_attachment(test_app):
     MediaEntry.query.get(media.id).delete()
     User.query.get(user_a.id).delete()
 
+def test_delete_media_entries(test_app, monkeypatch):
+    """ Media entries are deleted a batch at a time, like one by one """
+    # Remove the files right away, like with CELERY_ALWAYS_EAGER
+    monkeypatch.setattr(delete_public_files, 'delay', delete_public_files)
+    user = fixture_add_user(u"bulk_deleter")
+    media_ids = []
+    for i in range(3):
+        media_ids.append(fixture_media_entry(uploader=user.id).id)
+    collection = fixture_add_collection(user=user)
+    add_media_to_collection(Collection.query.get(collection.id),
+                            MediaEntry.query.get(media_ids[0]))
+    kept = fixture_media_entry(uploader=user.id, fake_upload=False).id
+    with mg_globals.public_store.get_file([u'a', u'b', u'c.jpg'], 'wb') as f:
+        f.write(b'thumbnail')
+
+    progress = []
+    deleted = delete_media_entries(
+        media_ids + [12345], batch_size=2,
+        progress=lambda *args: progress.append(args))
+
+    assert deleted == 3
+    assert progress == [(2, 4), (3, 4)]
+    assert MediaEntry.query.filter(MediaEntry.id.in_(media_ids)).count() == 0
+    assert MediaEntry.query.get(kept) is not None
+    assert MediaFile.query.filter(
+        MediaFile.media_entry.in_(media_ids)).count() == 0
+    assert CollectionItem.query.filter_by(
+        collection=collection.id).count() == 0
+    assert not mg_globals.public_store.file_exists([u'a', u'b', u'c.jpg'])
+
+    # References to the entries now point at their tombstones
+    reference = GenericModelReference.query.filter_by(
+        model_type=Graveyard.__tablename__).one()
+    tombstone = reference.get_object()
+    assert tombstone.object_type == u'image'
+    assert tombstone.actor().id == user.id
+
+
+def test_clean_orphan_tags(test_app, monkeypatch):
+    """ Only tags which no media entry uses anymore are deleted """
+    monkeypatch.setattr(delete_public_files, 'delay', delete_public_files)
+    user = fixture_add_user(u"tagger")
+
+    def tagged_entry(*names):
+        entry = fixture_media_entry(uploader=user.id, expunge=False)
+        entry.tags = [{'name': name, 'slug': name} for name in names]
+        entry.save()
+        return entry
+
+    def tag_slugs():
+        return set(slug for (slug,) in Session.query(Tag.slug))
+
+    first = tagged_entry(u'cats', u'dogs')
+    second = tagged_entry(u'cats', u'birds')
+    third = tagged_entry(u'fish')
+    assert tag_slugs() == set([u'cats', u'dogs', u'birds', u'fish'])
+
+    first.delete()
+    assert tag_slugs() == set([u'cats', u'birds', u'fish'])
+
+    delete_media_entries([second.id])
+    assert tag_slugs() == set([u'fish'])
+
+    # Tags left over some other way are found by a full sweep
+    third.delete(del_orphan_tags=False)
+    assert tag_slugs() == set([u'fish'])
+    assert clean_orphan_tags() == 1
+    assert tag_slugs() == set()
+
+
 def test_garbage_collection_task(test_app):
     """ Test old media entry are removed by GC task """
     user = fixture_add_user()
@@ -169,3 +253,244 @@ def test_comments_removed_when_graveyarded(test_app):
     # Verify this also deleted the Comment link, ergo there is no comment left.
     assert Comment.query.filter_by(target_id=link.target_id).first() is None
  
+
+
+def test_sniffed_file_reuses_local_path():
+    """ Uploads that are already on disk are not copied for sniffing """
+    with open(os.path.abspath(GOOD_JPG), 'rb') as upload:
+        sniffed_file = SniffedFile(FileStorage(stream=upload))
+        assert sniffed_file.header.startswith(b'\xff\xd8')
+        assert upload.tell() == 0
+        assert sniffed_file.name == os.path.abspath(GOOD_JPG)
+        assert sniffed_file._tmp_file is None
+
+
+def test_sniffed_file_spills_in_memory_uploads():
+    """ In-memory uploads are only copied to disk when name is used """
+    data = b'x' * (SNIFF_HEADER_SIZE * 3)
+    upload = io.BytesIO(data)
+    sniffed_file = SniffedFile(upload)
+    assert sniffed_file.header == data[:SNIFF_HEADER_SIZE]
+    assert sniffed_file._tmp_file is None
+
+    name = sniffed_file.name
+    with open(name, 'rb') as spilled:
+        assert spilled.read() == data
+    assert upload.tell() == 0
+
+    sniffed_file.close()
+    assert not os.path.exists(name)
+
+
+def test_atom_feed_conditional_get(test_app):
+    """ Unchanged feeds are answered with 304 until media is saved """
+    user = fixture_add_user(u"feed_user", privileges=[u"active"])
+    media_id = fixture_media_entry(uploader=user.id, state=u'processed').id
+
+    res = test_app.get('/u/feed_user/atom/')
+    etag = res.headers['ETag']
+    last_modified = res.headers['Last-Modified']
+    assert 'public' in res.headers['Cache-Control']
+
+    res = test_app.get('/u/feed_user/atom/',
+                       headers={'If-None-Match': etag})
+    assert res.status_int == 304
+    assert not res.body
+
+    res = test_app.get('/u/feed_user/atom/',
+                       headers={'If-Modified-Since': last_modified})
+    assert res.status_int == 304
+
+    media = MediaEntry.query.get(media_id)
+    media.title = u"A new title"
+    media.save(set_updated=True)
+    res = test_app.get('/u/feed_user/atom/',
+                       headers={'If-None-Match': etag})
+    assert res.status_int == 200
+    assert res.headers['ETag'] != etag
+    assert b'A new title' in res.body
+
+
+def test_atom_feed_response_cache(test_app, monkeypatch):
+    """ Anonymous feed responses are stored and dropped on media save """
+    monkeypatch.setitem(mg_globals.app_config, 'response_cache',
+                        'mediagoblin.tools.response_cache:MemoryResponseCache')
+    monkeypatch.setattr(response_cache, '_response_cache', None)
+    user = fixture_add_user(u"cached_user", privileges=[u"active"])
+    media_id = fixture_media_entry(uploader=user.id, state=u'processed').id
+
+    body = test_app.get('/u/cached_user/atom/').body
+    cache = response_cache.get_response_cache()
+    assert len(cache._entries) == 1
+    assert test_app.get('/u/cached_user/atom/').body == body
+
+    # Saving what listings don't show keeps the cache
+    media = MediaEntry.query.get(media_id)
+    media.media_metadata = {u'dc:rights': u'All rights reserved'}
+    media.save()
+    assert len(cache._entries) == 1
+
+    media.title = u"A new title"
+    media.save()
+    assert len(cache._entries) == 0
+
+
+def test_media_home_conditional_get(test_app):
+    """ Media pages validate per visitor and change with new comments """
+    user = fixture_add_user(u"media_user")
+    media = fixture_media_entry(uploader=user.id, state=u'processed',
+                                expunge=False)
+    media_id = media.id
+    url = '/u/media_user/m/{0}/'.format(media.slug)
+
+    res = test_app.get(url)
+    etag = res.headers['ETag']
+    assert 'private' in res.headers['Cache-Control']
+    assert 'Last-Modified' not in res.headers
+    assert test_app.get(
+        url, headers={'If-None-Match': etag}).status_int == 304
+
+    comment = TextComment()
+    comment.actor = user.id
+    comment.content = u"Some Comment"
+    comment.save()
+    comment_id = comment.id
+    link = Comment()
+    link.target = MediaEntry.query.get(media_id)
+    link.comment = comment
+    link.save()
+
+    res = test_app.get(url, headers={'If-None-Match': etag})
+    assert res.status_int == 200
+
+    # Edited comments
+    etag = res.headers['ETag']
+    comment = TextComment.query.get(comment_id)
+    comment.content = u"Some edited Comment"
+    comment.updated = datetime.datetime.utcnow()
+    comment.save()
+    assert test_app.get(
+        url, headers={'If-None-Match': etag}).status_int == 200
+
+
+def test_media_home_logged_in_not_validated(test_app):
+    """ Pages of logged in users aren't answered with 304, their header
+    shows state (like notifications) the validators don't cover """
+    user = fixture_add_user(u"media_viewer")
+    media = fixture_media_entry(uploader=user.id, state=u'processed')
+    session_manager = mg_globals.app.session_manager
+    test_app.set_cookie(session_manager.cookie_name,
+                        session_manager.signer.dumps({'user_id': user.id}))
+
+    res = test_app.get('/u/media_viewer/m/{0}/'.format(media.slug))
+    assert 'ETag' not in res.headers
+
+
+def test_media_save_set_updated(test_app):
+    """ Only edits by the user bump updated """
+    media = fixture_media_entry(state=u'processed', expunge=False)
+    updated = media.updated
+
+    media.state = u'failed'
+    media.save()
+    assert media.updated == updated
+
+    media.title = u"Edited"
+    media.save(set_updated=True)
+    assert media.updated > updated
+
+
+def test_collection_atom_feed_conditional_get(test_app):
+    """ Collection feeds change with the collection and its media """
+    user = fixture_add_user(u"collector", privileges=[u"active"])
+    collection = fixture_add_collection(u"Feed collection", user=user)
+    media = fixture_media_entry(uploader=user.id, state=u'processed',
+                                expunge=False)
+    add_media_to_collection(collection, media)
+    collection_id, media_id = collection.id, media.id
+    url = '/u/collector/collection/{0}/atom/'.format(collection.slug)
+
+    def get_unless(etag):
+        return test_app.get(url, headers={'If-None-Match': etag})
+
+    etag = test_app.get(url).headers['ETag']
+    assert get_unless(etag).status_int == 304
+
+    collection = Collection.query.get(collection_id)
+    collection.description = u"Now with a description"
+    collection.save()
+    res = get_unless(etag)
+    assert res.status_int == 200
+
+    etag = res.headers['ETag']
+    media = MediaEntry.query.get(media_id)
+    media.title = u"Renamed media"
+    media.save(set_updated=True)
+    res = get_unless(etag)
+    assert res.status_int == 200
+    assert b'Renamed media' in res.body
+
+
+def test_memory_response_cache_evicts_least_recently_used():
+    cache = MemoryResponseCache(size=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+
+    cache.clear()
+    assert cache.get('a') is None
+
+
+def _count_queries(test_app, url):
+    queries = []
+    def count_query(*args, **kwargs):
+        queries.append(args)
+
+    engine = Session.get_bind()
+    event.listen(engine, 'before_cursor_execute', count_query)
+    try:
+        test_app.get(url)
+    finally:
+        event.remove(engine, 'before_cursor_execute', count_query)
+    return len(queries)
+
+
+def test_listing_query_count(test_app):
+    """ Galleries and feeds don't need more queries for more entries """
+    query_counts = {}
+    for number in (2, 12):
+        username = u'lister%d' % number
+        user = fixture_add_user(username, privileges=[u'active'])
+        collection = fixture_add_collection(user=user)
+        for i in range(number):
+            entry = fixture_media_entry(uploader=user.id, state=u'processed',
+                                        expunge=False)
+            entry.tags = [{'name': username, 'slug': username}]
+            entry.save()
+            add_media_to_collection(
+                Collection.query.get(collection.id), entry)
+
+        urls = ['/', '/atom/',
+                '/u/{0}/', '/u/{0}/gallery/', '/u/{0}/atom/',
+                '/tag/{0}/', '/tag/{0}/atom/',
+                '/u/{0}/collection/{1}/', '/u/{0}/collection/{1}/atom/']
+        for url in urls:
+            query_counts.setdefault(url, []).append(_count_queries(
+                test_app, url.format(username, collection.slug)))
+
+    for url, counts in query_counts.items():
+        assert counts[0] == counts[1], url
+
+
+def test_compile_templates(test_app):
+    """ All templates can be compiled into the bytecode cache up front """
+    app = mg_globals.app
+    compiled, failed = compile_templates(app)
+    assert compiled and not failed
+
+    cache_dir = app.template_bytecode_cache.directory
+    assert len(os.listdir(cache_dir)) >= compiled
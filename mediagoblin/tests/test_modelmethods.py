@@ -20,12 +20,15 @@
 from __future__ import print_function
 
 from mediagoblin.db.base import Session
+from sqlalchemy import event
+
 from mediagoblin.db.models import MediaEntry, User, LocalUser, Privilege, \
-                                  Activity, Generator
+                                  Activity, Generator, GenericModelReference
 
+from mediagoblin.gmg_commands.rendermarkdown import render_markdown
 from mediagoblin.tests import MGClientTestCase
 from mediagoblin.tests.tools import fixture_add_user, fixture_media_entry, \
-                                    fixture_add_activity
+                                    fixture_add_activity, fixture_add_collection
 
 try:
     import mock
@@ -198,6 +201,82 @@ class TestUserHasPrivilege:
         # Test that we can look this out ignoring that she's an admin
         assert not self.natalie_user.has_privilege(u'commenter', allow_admin=False)
 
+def test_rendered_markdown(test_app):
+    """ Markdown is rendered when saved, and again for other renderers """
+    user = fixture_add_user(u'markdowner')
+    media = fixture_media_entry(uploader=user.id, expunge=False)
+    media.description = u'Some *markdown*'
+    media.save()
+    media_id = media.id
+
+    media = MediaEntry.query.get(media_id)
+    assert media.rendered_description == u'<p>Some <em>markdown</em></p>'
+    assert media.description_html == media.rendered_description
+
+    # Changes are shown before being saved
+    media.description = u'Other **markdown**'
+    assert media.description_html == u'<p>Other <strong>markdown</strong></p>'
+    Session.rollback()
+
+    # HTML from an older renderer isn't used, but only stored when saved
+    Session.query(MediaEntry).filter_by(id=media_id).update({
+        'rendered_description': u'<p>old</p>',
+        'html_renderer': u'old-renderer'})
+    Session.commit()
+    media = MediaEntry.query.get(media_id)
+    assert media.description_html == u'<p>Some <em>markdown</em></p>'
+    assert media not in Session.dirty
+    assert media.rendered_description == u'<p>old</p>'
+
+    assert render_markdown(MediaEntry) == 1
+    assert render_markdown(MediaEntry) == 0
+    media = MediaEntry.query.get(media_id)
+    assert media.rendered_description == u'<p>Some <em>markdown</em></p>'
+
+
+def test_load_generic_references(test_app):
+    """ Objects of many references are loaded with a query per type """
+    user = fixture_add_user(u'referrer')
+    collection = fixture_add_collection(user=user)
+    for i in range(3):
+        activity = Activity(verb=u'add', actor=user.id)
+        activity.object = fixture_media_entry(uploader=user.id,
+                                              expunge=False)
+        activity.target = collection
+        activity.save()
+    Session.expunge_all()
+
+    queries = []
+    def count_query(*args, **kwargs):
+        queries.append(args)
+
+    engine = Session.get_bind()
+    event.listen(engine, 'before_cursor_execute', count_query)
+    try:
+        activities = Activity.for_listing().filter_by(actor=user.id).all()
+        assert len(queries) == 1
+        # One query for the collection, and the media with their files,
+        # uploaders and tags like in galleries
+        objects = Activity.load_objects(activities)
+        assert len(queries) == 6
+        assert len(objects) == 4
+
+        for activity in activities:
+            assert isinstance(activity.object(), MediaEntry)
+            assert activity.object().media_files
+            assert activity.target().id == collection.id
+            assert activity.get_actor.username == u'referrer'
+        assert len(queries) == 6
+    finally:
+        event.remove(engine, 'before_cursor_execute', count_query)
+
+    # References pointed elsewhere don't keep their loaded object
+    reference = activities[0].object_helper
+    reference.obj_pk = activities[1].object_helper.obj_pk
+    assert reference.get_object() is activities[1].object()
+    assert GenericModelReference.load_objects([None]) == []
+
+
 def test_media_data_init(test_app):
     Session.rollback()
     Session.remove()
@@ -14,7 +14,17 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import base64
+import hashlib
+import os
+
 import pytest
+import six
+
+from mediagoblin import mg_globals
+from mediagoblin.db.models import MediaEntry
+from mediagoblin.plugins.piwigo.tools import PWGSession
+from .resources import GOOD_JPG
 from .tools import fixture_add_user
 
 
@@ -26,14 +36,14 @@ class Test_PWG(object):
     def setup(self, test_app):
         self.test_app = test_app
 
-        fixture_add_user()
+        self.user_id = fixture_add_user().id
 
         self.username = u"chris"
         self.password = "toast"
 
-    def do_post(self, method, params):
+    def do_post(self, method, params, **kwargs):
         params["method"] = method
-        return self.test_app.post("/api/piwigo/ws.php", params)
+        return self.test_app.post("/api/piwigo/ws.php", params, **kwargs)
 
     def do_get(self, method, params=None):
         if params is None:
@@ -64,3 +74,76 @@ class Test_PWG(object):
 
         resp = self.do_get("pwg.session.getStatus")
         assert resp.body == (XML_PREFIX + '<rsp stat="ok"><username>guest</username></rsp>').encode('ascii')
+
+    def login(self):
+        # Like pwg.session.login does
+        session_manager = PWGSession.session_manager
+        self.test_app.set_cookie(
+            session_manager.cookie_name,
+            session_manager.signer.dumps({'user_id': self.user_id}))
+
+    def add_chunk(self, original_sum, position, data):
+        return self.do_post("pwg.images.addChunk", {
+            "original_sum": original_sum,
+            "type": "file",
+            "position": str(position),
+            "data": base64.b64encode(data).decode('ascii')},
+            expect_errors=True)
+
+    @pytest.mark.usefixtures('process_media_locally')
+    def test_chunked_upload(self):
+        with open(GOOD_JPG, 'rb') as image:
+            data = image.read()
+        original_sum = hashlib.md5(data).hexdigest()
+        chunks = [data[start:start + 100000]
+                  for start in range(0, len(data), 100000)]
+        assert len(chunks) > 2
+
+        resp = self.add_chunk(original_sum, 0, chunks[0])
+        assert b'Access denied' in resp.body
+
+        self.login()
+        self.add_chunk(original_sum, 0, chunks[0])
+        # Chunks must not be skipped, but may be sent again
+        resp = self.add_chunk(original_sum, 2, chunks[2])
+        assert b'Chunk 1 is missing' in resp.body
+        self.add_chunk(original_sum, 1, b'broken')
+        for position, chunk in enumerate(chunks[1:], 1):
+            resp = self.add_chunk(original_sum, position, chunk)
+            assert resp.body == (XML_PREFIX + '<rsp stat="ok">1</rsp>').encode('ascii')
+
+        queue_store = self.test_app.app.queue_store
+        queue_dir = queue_store.get_local_path(
+            [u'piwigo', six.text_type(self.user_id), original_sum])
+        assert sorted(os.listdir(queue_dir)) == [u'chunks', u'file']
+
+        resp = self.do_post("pwg.images.add", {
+            "original_sum": original_sum,
+            "original_filename": "good.jpg",
+            "name": "Chunky",
+            "categories": "-29711"})
+        assert b'<image_id>' in resp.body
+
+        # The chunks were put together into a file processing could use
+        entry = MediaEntry.query.filter_by(title=u'Chunky').one()
+        assert entry.state == u'processed'
+        assert entry.media_files['original'][-1] == u'good.jpg'
+        with mg_globals.public_store.get_file(
+                entry.media_files['original'], 'rb') as original:
+            assert original.read() == data
+        assert set([u'medium', u'thumb']) <= set(entry.media_files)
+        # and processing cleaned up after it
+        assert not os.path.exists(queue_dir)
+
+    def test_chunked_upload_checksum(self):
+        self.login()
+        self.add_chunk('0' * 32, 0, b'not what was promised')
+        resp = self.do_post("pwg.images.add", {
+            "original_sum": '0' * 32,
+            "name": "Broken"})
+        assert b'checksum' in resp.body
+        resp = self.do_post("pwg.images.add", {
+            "original_sum": '0' * 32,
+            "name": "Broken"})
+        assert b'No chunks' in resp.body
+        assert MediaEntry.query.filter_by(title=u'Broken').count() == 0
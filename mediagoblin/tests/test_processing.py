@@ -1,6 +1,9 @@
 #!/usr/bin/env python
 
-from mediagoblin import processing
+from mediagoblin import mg_globals, processing
+from mediagoblin.db.base import Session
+from mediagoblin.db.models import MediaEntry
+from mediagoblin.tests.tools import fixture_add_user, fixture_media_entry
 
 class TestProcessing(object):
     def run_fill(self, input, format, output=None):
@@ -16,3 +19,39 @@ class TestProcessing(object):
     def test_long_filename_fill(self):
         self.run_fill('{0}.png'.format('A' * 300), 'image-{basename}{ext}',
                       'image-{0}.png'.format('A' * 245))
+
+
+def test_progress_callback_coalesces_updates(test_app, monkeypatch):
+    monkeypatch.setitem(mg_globals.app_config, 'progress_update_interval', 60)
+    user = fixture_add_user(u'progress_user', privileges=[u'active'])
+    entry_id = fixture_media_entry(uploader=user.id, state=u'processing').id
+
+    callback = processing.ProgressCallback(MediaEntry.query.get(entry_id))
+    callback(1)
+    callback(2)
+    callback(3, 40)
+    Session.expire_all()
+    # Only the first tick was written right away
+    assert MediaEntry.query.get(entry_id).transcoding_progress == 1
+
+    callback(7)
+    Session.expire_all()
+    # Ten percent more, so this is written too
+    entry = MediaEntry.query.get(entry_id)
+    assert entry.transcoding_progress == 13
+    assert entry.main_transcoding_progress == 40
+
+    callback(95)
+    callback.flush()
+    Session.expire_all()
+    assert MediaEntry.query.get(entry_id).transcoding_progress == 100
+
+    # Log in without going through the login form
+    session_manager = mg_globals.app.session_manager
+    test_app.set_cookie(session_manager.cookie_name,
+                        session_manager.signer.dumps({'user_id': user.id}))
+    res = test_app.get('/u/progress_user/panel/progress/')
+    assert res.json == {str(entry_id): {
+        'transcoding_progress': 100, 'main_transcoding_progress': 40}}
+    res = test_app.get('/u/progress_user/panel/')
+    assert 'data-entry-id="{0}"'.format(entry_id) in res.text
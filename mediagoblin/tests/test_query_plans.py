@@ -0,0 +1,212 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Checks that the queries of the busiest pages use indexes.
+
+The statements a request runs are recorded, then explained (EXPLAIN
+QUERY PLAN on SQLite, EXPLAIN on PostgreSQL).  Tests fail if one of them
+reads all of a table, or sorts media entries which should have come in
+the order of an index.  The test databases are tiny, so PostgreSQL is
+told to avoid sequential scans and sorts wherever it has a choice.
+"""
+
+import datetime
+import re
+
+import pytest
+from sqlalchemy import event
+
+from mediagoblin import mg_globals
+from mediagoblin.db.base import Session
+from mediagoblin.tests.tools import fixture_add_user, fixture_media_entry, \
+    fixture_add_comment
+from mediagoblin.tools.pagination import encode_page_key
+
+MEDIA_TABLE = 'core__media_entries'
+
+# Like "SCAN core__media_entries" or "SEARCH core__media_entries USING
+# INDEX ...", with "TABLE " after the verb before SQLite 3.36
+_SQLITE_TABLE_RE = re.compile(r'^(?:SCAN|SEARCH) (?:TABLE )?(\w+)')
+
+
+def record_statements(test_app, url):
+    """
+    The (statement, parameters) of the SELECTs run to get url
+    """
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith(
+                'SELECT'):
+            statements.append((statement, parameters))
+
+    engine = Session.get_bind()
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        test_app.get(url)
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+    return statements
+
+
+def _table(name, tables):
+    """
+    The table of name, which may be an alias like core__users_1, or None
+    for subqueries
+    """
+    if name in tables:
+        return name
+    name = re.sub(r'_\d+$', '', name)
+    if name in tables:
+        return name
+    return None
+
+
+def _sqlite_plan(cursor, statement, parameters, tables):
+    cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters)
+    plan = [row[-1] for row in cursor.fetchall()]
+
+    problems = []
+    used = set()
+    sorted_rows = False
+    for detail in plan:
+        match = _SQLITE_TABLE_RE.match(detail)
+        table = match and _table(match.group(1), tables)
+        if table is not None:
+            used.add(table)
+            # Full text searches go through their own index
+            if detail.startswith('SCAN') and 'VIRTUAL TABLE' not in detail:
+                problems.append(('scan', table))
+        if detail.startswith('USE TEMP B-TREE FOR') and 'ORDER BY' in detail:
+            sorted_rows = True
+    # Sorts aren't attributed to tables, blame the ones in the statement
+    if sorted_rows:
+        problems.extend(('sort', table) for table in sorted(used))
+    return problems, plan
+
+
+def _postgresql_nodes(node, parent_sorts=()):
+    yield node, parent_sorts
+    if node['Node Type'] in ('Sort', 'Incremental Sort'):
+        parent_sorts = parent_sorts + (node,)
+    for child in node.get('Plans', ()):
+        for item in _postgresql_nodes(child, parent_sorts):
+            yield item
+
+
+def _postgresql_plan(cursor, statement, parameters, tables):
+    cursor.execute('SET enable_seqscan = off')
+    cursor.execute('SET enable_sort = off')
+    try:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + statement, parameters)
+        plan = cursor.fetchone()[0][0]['Plan']
+    finally:
+        cursor.execute('RESET enable_seqscan')
+        cursor.execute('RESET enable_sort')
+
+    problems = []
+    for node, sorts in _postgresql_nodes(plan):
+        table = node.get('Relation Name')
+        if table not in tables:
+            continue
+        if node['Node Type'] == 'Seq Scan':
+            problems.append(('scan', table))
+        if sorts:
+            problems.append(('sort', table))
+    return problems, plan
+
+
+def plan_problems(statement, parameters):
+    """
+    What is wrong with the plan of statement, as a list of ('scan',
+    table) for tables read in full and ('sort', table) for tables whose
+    rows get sorted, and the plan itself
+    """
+    engine = Session.get_bind()
+    tables = set(engine.table_names())
+    dialect = engine.dialect.name
+    cursor = Session.connection().connection.cursor()
+    try:
+        if dialect == 'sqlite':
+            return _sqlite_plan(cursor, statement, parameters, tables)
+        elif dialect == 'postgresql':
+            return _postgresql_plan(cursor, statement, parameters, tables)
+        pytest.skip('No query plans for {0} databases'.format(dialect))
+    finally:
+        cursor.close()
+
+
+def assert_indexed(test_app, url, sorted_tables=(MEDIA_TABLE,)):
+    """
+    Fail if a query of url reads all of a table or sorts the rows of one
+    of sorted_tables
+    """
+    statements = record_statements(test_app, url)
+    assert statements, url
+    for statement, parameters in statements:
+        problems, plan = plan_problems(statement, parameters)
+        problems = [(kind, table) for kind, table in problems
+                    if kind == 'scan' or table in sorted_tables]
+        assert not problems, (url, statement, plan)
+
+
+@pytest.fixture
+def planner(test_app):
+    """
+    A logged in user with some processed and failed media, returning
+    the urls of the processed media
+    """
+    user = fixture_add_user(u'planner', privileges=[u'active', u'uploader'])
+    urls = []
+    for i in range(3):
+        entry = fixture_media_entry(uploader=user.id, state=u'processed',
+                                    expunge=False)
+        entry.tags = [{'name': u'plans', 'slug': u'plans'}]
+        entry.save()
+        urls.append(u'/u/planner/m/{0}/'.format(entry.slug))
+        urls.append(u'/u/planner/m/id:{0}/'.format(entry.id))
+    fixture_add_comment(author=user.id, media_entry=entry)
+    fixture_media_entry(uploader=user.id, state=u'failed')
+
+    session_manager = mg_globals.app.session_manager
+    test_app.set_cookie(session_manager.cookie_name,
+                        session_manager.signer.dumps({'user_id': user.id}))
+    return urls
+
+
+def test_listing_query_plans(test_app, planner):
+    """ Listings of media read them in the order of an index """
+    urls = ['/', '/atom/',
+            '/u/planner/', '/u/planner/gallery/', '/u/planner/atom/',
+            '/tag/plans/', '/tag/plans/atom/',
+            '/u/planner/panel/', '/u/planner/panel/failed/']
+    # Later and earlier pages
+    key = encode_page_key(datetime.datetime.utcnow(), 1)
+    for direction in ('after', 'before'):
+        for url in ('/', '/u/planner/', '/u/planner/gallery/',
+                    '/tag/plans/'):
+            urls.append('{0}?{1}={2}'.format(url, direction, key))
+
+    for url in urls:
+        assert_indexed(test_app, url)
+
+
+def test_media_page_query_plans(test_app, planner):
+    """ Media pages, with their links to the previous and next media,
+    don't read all of a table """
+    for url in planner:
+        assert_indexed(test_app, url)
@@ -0,0 +1,176 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+
+from mediagoblin import mg_globals
+from mediagoblin.db.base import Session
+from mediagoblin.db.deletion import delete_media_entries
+from mediagoblin.db.models import TextComment
+from mediagoblin.search import lib as search_lib
+from mediagoblin.search.index import MemorySearchIndex
+from mediagoblin.search.lib import SearchResults, get_search_index, \
+    reindex_media
+from mediagoblin.submit.task import delete_public_files
+from mediagoblin.tests.tools import fixture_add_user, fixture_media_entry, \
+    fixture_add_comment
+from mediagoblin.tools import template
+
+
+@pytest.fixture(params=['database',
+                        'mediagoblin.search.index:MemorySearchIndex'])
+def search_app(request, test_app, monkeypatch):
+    """ test_app searching with the database and the in-memory index """
+    monkeypatch.setitem(mg_globals.app_config, 'search_index', request.param)
+    search_lib.setup_search_index()
+    yield test_app
+    search_lib.setup_search_index()
+
+
+def search(query):
+    results = SearchResults(query)
+    return results.count(), [entry.title for entry in results.slice(0, 10)]
+
+
+def test_search_follows_changes(search_app, monkeypatch):
+    monkeypatch.setattr(delete_public_files, 'delay', delete_public_files)
+    user = fixture_add_user(u'searcher')
+    cat = fixture_media_entry(
+        title=u'A grumpy cat', uploader=user.id, state=u'processed',
+        expunge=False)
+    dog = fixture_media_entry(
+        title=u'Dog on a beach', uploader=user.id, state=u'processed',
+        expunge=False)
+    fixture_media_entry(
+        title=u'Unprocessed cat', uploader=user.id)
+
+    assert search(u'cat') == (1, [u'A grumpy cat'])
+    assert search(u'CAT grumpy!') == (1, [u'A grumpy cat'])
+    assert search(u'cat dog') == (0, [])
+    assert search(u'') == (0, [])
+
+    # Tags and descriptions
+    dog.tags = [{'name': u'Sandy', 'slug': u'sandy'}]
+    dog.description = u'Chasing a cat'
+    dog.save()
+    assert search(u'sandy') == (1, [u'Dog on a beach'])
+    # Title matches count more than description matches
+    assert search(u'cat') == (2, [u'A grumpy cat', u'Dog on a beach'])
+
+    # Comments, as they are added, edited and deleted
+    comment = fixture_add_comment(
+        author=user.id, media_entry=cat, comment=u'Such whiskers')
+    assert search(u'whiskers') == (1, [u'A grumpy cat'])
+    comment.content = u'Such paws'
+    comment.save()
+    assert search(u'whiskers') == (0, [])
+    assert search(u'paws') == (1, [u'A grumpy cat'])
+    TextComment.query.get(comment.id).delete()
+    assert search(u'paws') == (0, [])
+
+    # Untagging, and entries going away
+    dog.tags = []
+    dog.save()
+    assert search(u'sandy') == (0, [])
+    cat.delete()
+    assert search(u'cat') == (1, [u'Dog on a beach'])
+    delete_media_entries([dog.id])
+    assert search(u'cat') == (0, [])
+
+
+def test_search_pages(search_app):
+    user = fixture_add_user(u'searcher')
+    for i in range(5):
+        fixture_media_entry(title=u'Bird {0}'.format(i), uploader=user.id,
+                            state=u'processed')
+
+    results = SearchResults(u'bird')
+    assert results.count() == 5
+    # Equally good matches come newest first
+    assert [entry.title for entry in results.slice(1, 3)] == \
+        [u'Bird 3', u'Bird 2']
+
+    # Rebuilding the index finds them again
+    get_search_index().clear(Session.connection())
+    assert SearchResults(u'bird').count() == 0
+    progress = []
+    assert reindex_media(batch_size=2,
+                         progress=lambda *args: progress.append(args)) == 5
+    assert progress == [(2, 5), (4, 5), (5, 5)]
+    assert SearchResults(u'bird').count() == 5
+
+
+def test_search_index_survives_rollback(test_app):
+    """ A rolled back transaction doesn't take the index table with it """
+    index = get_search_index()
+    if index is None:
+        pytest.skip('No database search index here')
+    user = fixture_add_user(u'searcher')
+    lost = fixture_media_entry(title=u'Lost owl', uploader=user.id,
+                               state=u'processed', save=False,
+                               expunge=False)
+    lost.save(commit=False)
+    Session.flush()
+    assert search(u'owl') == (1, [u'Lost owl'])
+    Session.rollback()
+
+    assert Session.get_bind().has_table(index.table)
+    fixture_media_entry(title=u'Found owl', uploader=user.id,
+                        state=u'processed')
+    assert search(u'owl') == (1, [u'Found owl'])
+
+
+def test_search_views(test_app):
+    user = fixture_add_user(u'searcher')
+    fixture_media_entry(title=u'Mountain lake', uploader=user.id,
+                        state=u'processed')
+
+    template.clear_test_template_context()
+    response = test_app.get('/search/', {'q': u'lake'})
+    assert response.status_int == 200
+    context = template.TEMPLATE_TEST_CONTEXT[
+        'mediagoblin/search/results.html']
+    assert len(context['media_entries']) == 1
+    assert context['pagination'].total_count == 1
+
+    template.clear_test_template_context()
+    test_app.get('/search/', {'q': u'sea'})
+    context = template.TEMPLATE_TEST_CONTEXT[
+        'mediagoblin/search/results.html']
+    assert context['media_entries'] == []
+
+
+def test_memory_search_index():
+    index = MemorySearchIndex()
+    index.update(None, {
+        1: {'title': u'red', 'tags': u'', 'description': u'blue',
+            'comments': u''},
+        2: {'title': u'blue', 'tags': u'', 'description': u'',
+            'comments': u'red red'},
+        3: {'title': u'green', 'tags': u'', 'description': u'',
+            'comments': u''},
+    })
+    assert index.count(None, [u'red']) == 2
+    assert index.search(None, [u'red'], 10) == [1, 2]
+    # Equal scores, the newest first
+    assert index.search(None, [u'blue', u'red'], 10) == [2, 1]
+    assert index.search(None, [u'blue', u'red'], 1, 1) == [1]
+    assert index.search(None, [u'red', u'green'], 10) == []
+
+    index.remove(None, [1])
+    assert index.search(None, [u'red'], 10) == [2]
+    index.clear(None)
+    assert index.count(None, [u'blue']) == 0
@@ -14,7 +14,12 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from mediagoblin.tools import session
+import six
+
+from mediagoblin import mg_globals
+from mediagoblin.db.models import User
+from mediagoblin.tools import session, template
+from mediagoblin.tests.tools import fixture_add_user
 
 def test_session():
     sess = session.Session()
@@ -28,3 +33,51 @@ def test_session():
     sess.delete()
     assert not sess
     assert sess.is_updated()
+
+
+def test_stored_session_ids_rotate_on_login(test_app):
+    manager = session.SessionManager(store=session.MemorySessionStore())
+    sess = session.Session(messages=[])
+    anonymous_id = manager.save_stored_session(sess)
+    assert manager.load_stored_session(anonymous_id) == {'messages': []}
+
+    sess['user_id'] = u'27'
+    user_id = manager.save_stored_session(sess)
+    assert user_id != anonymous_id
+    assert not manager.load_stored_session(anonymous_id)
+    assert manager.load_stored_session(user_id)['user_id'] == u'27'
+
+    manager.store.delete_user_sessions(27)
+    assert not manager.load_stored_session(user_id)
+
+
+def test_sql_session_store(test_app, monkeypatch):
+    manager = mg_globals.app.session_manager
+    store = session.SQLSessionStore()
+    monkeypatch.setattr(manager, 'store', store)
+    monkeypatch.setitem(mg_globals.app_config, 'user_cache_time', 60)
+    monkeypatch.setattr(session, '_user_cache', None)
+    user_id = fixture_add_user(u'session_user').id
+
+    session_id = manager.save_stored_session(
+        session.Session(user_id=six.text_type(user_id)))
+    assert store.load(session_id)['user_id'] == six.text_type(user_id)
+    test_app.set_cookie('MGSession', session_id)
+
+    # The user is looked up once and then kept in the user cache
+    for i in range(2):
+        template.clear_test_template_context()
+        test_app.get('/')
+        context = template.TEMPLATE_TEST_CONTEXT['mediagoblin/root.html']
+        assert context['request'].user is not None
+    assert session.get_user_cache().get(user_id).id == user_id
+
+    # Saving the user drops the cached copy
+    User.query.get(user_id).save()
+    assert session.get_user_cache().get(user_id) is None
+
+    store.delete_user_sessions(user_id)
+    template.clear_test_template_context()
+    test_app.get('/')
+    context = template.TEMPLATE_TEST_CONTEXT['mediagoblin/root.html']
+    assert context['request'].user is None
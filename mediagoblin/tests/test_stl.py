@@ -0,0 +1,204 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import io
+import os
+import tempfile
+
+import pytest
+
+numpy = pytest.importorskip("numpy")
+
+from mediagoblin.media_types.stl import model_loader, rasterizer
+from mediagoblin.media_types.stl.model_loader import (
+    auto_detect, BinaryStlModel, ObjModel, ThreeDeeParseError, STL_TRIANGLE)
+
+try:
+    from PIL import Image
+except ImportError:
+    import Image
+
+
+# Two triangles spanning (-1, 0, 0) .. (2, 4, 6)
+TRIANGLES = [
+    [(-1, 0, 0), (2, 0, 0), (0, 4, 0)],
+    [(0, 0, 6), (1, 1, 1), (0, 2, 3)],
+]
+
+
+def binary_stl(triangles):
+    records = numpy.zeros(len(triangles), dtype=STL_TRIANGLE)
+    if triangles:
+        records['verts'] = triangles
+    return (b'\0' * 80 + numpy.array([len(triangles)], '<u4').tobytes() +
+            records.tobytes())
+
+
+def ascii_stl(triangles):
+    lines = [b'solid test']
+    for triangle in triangles:
+        lines.extend([b'  facet normal 0 0 1', b'    outer loop'])
+        lines.extend(b'      vertex %f %f %f' % vertex for vertex in triangle)
+        lines.extend([b'    endloop', b'  endfacet'])
+    lines.append(b'endsolid test')
+    return b'\n'.join(lines) + b'\n'
+
+
+def obj(triangles):
+    lines = [b'# test model', b'vn 100 100 100', b'vt 0.5 0.5']
+    for triangle in triangles:
+        lines.extend(b'v %f %f %f 1.0' % vertex for vertex in triangle)
+    lines.append(b'')
+    lines.append(b'f 1 2 3')
+    return b'\n'.join(lines) + b'\n'
+
+
+def assert_bounds(model):
+    assert model.vertex_count == 6
+    assert model.min == [-1, 0, 0]
+    assert model.max == [2, 4, 6]
+    assert (model.width, model.depth, model.height) == (3, 4, 6)
+    assert model.average == pytest.approx([2 / 6., 7 / 6., 10 / 6.])
+
+
+@pytest.mark.parametrize('data, hint', [
+    (binary_stl(TRIANGLES), 'stl'),
+    (ascii_stl(TRIANGLES), 'stl'),
+    (obj(TRIANGLES), 'obj'),
+    (obj(TRIANGLES), None),
+], ids=['binary stl', 'ascii stl', 'obj', 'obj without hint'])
+def test_model_bounds(data, hint):
+    # Both from disk and from memory
+    with tempfile.TemporaryFile() as model_file:
+        model_file.write(data)
+        assert_bounds(auto_detect(model_file, hint))
+    assert_bounds(auto_detect(io.BytesIO(data), hint))
+
+
+def test_binary_stl_in_chunks(monkeypatch):
+    monkeypatch.setattr(model_loader, 'CHUNK_SIZE', 1)
+    assert_bounds(BinaryStlModel(io.BytesIO(binary_stl(TRIANGLES))))
+    assert_bounds(ObjModel(io.BytesIO(obj(TRIANGLES))))
+
+
+def test_broken_models():
+    # Fewer triangles than the header says
+    with pytest.raises(ThreeDeeParseError):
+        BinaryStlModel(io.BytesIO(binary_stl(TRIANGLES)[:-1]))
+    with pytest.raises(ThreeDeeParseError):
+        BinaryStlModel(io.BytesIO(binary_stl([])))
+    with pytest.raises(ThreeDeeParseError):
+        ObjModel(io.BytesIO(b'v 1 2\n'))
+    with pytest.raises(ThreeDeeParseError):
+        auto_detect(io.BytesIO(b'not a model\n'), 'stl')
+
+
+# A unit cube made of six quads, with relative and v/vt/vn references
+CUBE_OBJ = b"""
+v 0 0 0
+v 1 0 0
+v 1 1 0
+v 0 1 0
+v 0 0 1
+v 1 0 1
+v 1 1 1
+v 0 1 1
+f 1 4 3 2
+f 5 6 7 8
+f 1/1 2/1 6/1 5/1
+f 2//1 3//1 7//1 6//1
+f -5/1/1 -1/1/1 -2/1/1 -6/1/1
+f 4 1 5 8
+"""
+
+
+def test_triangles():
+    cube = ObjModel(io.BytesIO(CUBE_OBJ))
+    triangles = numpy.concatenate(list(cube.triangles(io.BytesIO(CUBE_OBJ))))
+    assert triangles.shape == (12, 3, 3)
+    # Every corner of the cube is used
+    assert len(set(map(tuple, triangles.reshape(-1, 3)))) == 8
+
+    stl = BinaryStlModel(io.BytesIO(binary_stl(TRIANGLES)))
+    triangles = list(stl.triangles(io.BytesIO(binary_stl(TRIANGLES))))
+    assert numpy.array_equal(numpy.concatenate(triangles), TRIANGLES)
+
+    ascii_data = ascii_stl(TRIANGLES)
+    stl = ObjModel(io.BytesIO(ascii_data))
+    triangles = list(stl.triangles(io.BytesIO(ascii_data)))
+    assert numpy.array_equal(numpy.concatenate(triangles), TRIANGLES)
+
+
+# Faces between their vertices, counting back from the last vertex
+# above them
+INTERLEAVED_OBJ = b"""
+v 0 0 0
+v 1 0 0
+v 0 1 0
+f -3 -2 -1
+v 5 5 5
+v 6 5 5
+v 5 6 5
+f -3 -2 -1
+f 1 -3 -1
+"""
+
+
+@pytest.mark.parametrize('chunk_size', [1, 4, 1 << 16])
+def test_interleaved_negative_indexes(monkeypatch, chunk_size):
+    monkeypatch.setattr(model_loader, 'CHUNK_SIZE', chunk_size)
+    model = ObjModel(io.BytesIO(INTERLEAVED_OBJ))
+    triangles = numpy.concatenate(
+        list(model.triangles(io.BytesIO(INTERLEAVED_OBJ))))
+    assert numpy.array_equal(triangles, [
+        [(0, 0, 0), (1, 0, 0), (0, 1, 0)],
+        [(5, 5, 5), (6, 5, 5), (5, 6, 5)],
+        [(0, 0, 0), (5, 5, 5), (5, 6, 5)]])
+
+
+def test_rasterizer():
+    """ Without Blender, all views are drawn by the rasterizer """
+    cube = ObjModel(io.BytesIO(CUBE_OBJ))
+    greatest = 1
+    workbench = tempfile.mkdtemp()
+    # The views of CommonStlProcessor
+    cameras = [
+        ([0, greatest * -1.5, greatest], 'PERSP'),
+        ([cube.average[0], cube.average[1], greatest * 2], 'ORTHO'),
+        ([cube.average[0], greatest * -2, cube.average[2]], 'ORTHO'),
+        ([greatest * -2, cube.average[1], cube.average[2]], 'ORTHO'),
+    ]
+    shots = [{
+        'camera_coord': camera,
+        'camera_focus': cube.average,
+        'camera_clip': greatest * 10,
+        'greatest': greatest,
+        'projection': projection,
+        'width': 64,
+        'height': 48,
+        'out_file': os.path.join(workbench, '{0}.jpg'.format(i)),
+    } for i, (camera, projection) in enumerate(cameras)]
+
+    rasterizer.render(cube.triangles(io.BytesIO(CUBE_OBJ)), shots)
+
+    for shot in shots:
+        image = numpy.asarray(Image.open(shot['out_file']).convert('L'))
+        assert image.shape == (48, 64)
+        # The cube is in the middle and the corners are background
+        assert image[24, 32] < 230
+        assert image[0, 0] > 230
+        os.remove(shot['out_file'])
+    os.rmdir(workbench)
@@ -16,6 +16,7 @@
 
 
 import os
+import shutil
 import tempfile
 
 import pytest
@@ -321,3 +322,68 @@ def test_basic_storage_copy_local_to_storage():
 def test_general_storage_copy_local_to_storage():
     tmpdir, this_storage = get_tmp_filestorage(fake_remote=True)
     _test_copy_local_to_storage_works(tmpdir, this_storage)
+
+
+def test_basic_storage_link_files():
+    tmpdir, this_storage = get_tmp_filestorage()
+    this_storage.link_files = True
+
+    local_filename = os.path.join(tmpdir, 'queued.txt')
+    with open(local_filename, 'w') as tmpfile:
+        tmpfile.write('haha')
+
+    filepath = ['dir1', 'dir2', 'linkedto.txt']
+    this_storage.copy_local_to_storage(local_filename, filepath)
+    assert os.path.samefile(
+        local_filename, this_storage.get_local_path(filepath))
+
+    # Writing to the stored file leaves the source alone
+    with this_storage.get_file(filepath, 'wb') as our_file:
+        our_file.write(b'hoho')
+    with open(local_filename) as tmpfile:
+        assert tmpfile.read() == 'haha'
+
+    os.remove(local_filename)
+    this_storage.delete_file(filepath)
+    cleanup_storage(this_storage, tmpdir, ['dir1', 'dir2'])
+
+
+def test_basic_storage_content_addressed(monkeypatch):
+    tmpdir, this_storage = get_tmp_filestorage()
+    this_storage.content_addressed = True
+
+    local_filename = tempfile.mktemp()
+    with open(local_filename, 'w') as tmpfile:
+        tmpfile.write('haha')
+
+    first = ['dir1', 'first.txt']
+    second = ['dir1', 'second.txt']
+    this_storage.copy_local_to_storage(local_filename, first)
+    this_storage.copy_local_to_storage(local_filename, second)
+    os.remove(local_filename)
+
+    # Both files share one blob
+    assert os.path.samefile(this_storage.get_local_path(first),
+                            this_storage.get_local_path(second))
+    assert os.stat(this_storage.get_local_path(first)).st_nlink == 3
+
+    # Appending to one gives it its own copy
+    with this_storage.get_file(second, 'ab') as our_file:
+        our_file.write(b'!')
+    with this_storage.get_file(first, 'rb') as our_file:
+        assert our_file.read() == b'haha'
+    with this_storage.get_file(second, 'rb') as our_file:
+        assert our_file.read() == b'haha!'
+
+    # The blob goes away with the last file using it, found without
+    # hashing the file again
+    def no_digest(filename):
+        raise AssertionError('hashed {0} again'.format(filename))
+    monkeypatch.setattr(storage.filestorage, 'file_digest', no_digest)
+    blob_dir = os.path.join(tmpdir, storage.filestorage.BLOB_DIR)
+    this_storage.delete_file(second)
+    this_storage.delete_file(first)
+    assert not any(files for _, _, files in os.walk(blob_dir))
+
+    shutil.rmtree(blob_dir)
+    cleanup_storage(this_storage, tmpdir, ['dir1'])
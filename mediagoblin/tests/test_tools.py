@@ -24,8 +24,13 @@ except ImportError:
 from werkzeug.wrappers import Request
 from werkzeug.test import EnvironBuilder
 
+import datetime
+
+from mediagoblin.db.models import MediaEntry
 from mediagoblin.tools.request import decode_request
-from mediagoblin.tools.pagination import Pagination
+from mediagoblin.tools.pagination import Pagination, KeysetPagination, \
+    encode_page_key, decode_page_key, get_page_key
+from mediagoblin.tests.tools import fixture_add_user, fixture_media_entry
 
 class TestDecodeRequest(object):
     """Test the decode_request function."""
@@ -116,3 +121,79 @@ class TestPagination(object):
         paginator = self._create_paginator(num_items=31, page=1, per_page=30)
         assert paginator.total_count == 31
         assert paginator.pages == 2
+
+
+class TestKeysetPagination(object):
+    def test_page_key_round_trip(self):
+        """Check that page keys survive encoding and decoding."""
+        created = datetime.datetime(2014, 3, 1, 12, 30, 5, 1234)
+        token = encode_page_key(created, 42)
+        assert '=' not in token
+        assert decode_page_key(token) == (created, 42)
+        assert get_page_key({'before': token}) == ('before', (created, 42))
+        assert get_page_key({}) is None
+
+    def test_invalid_page_key(self):
+        """Check that malformed tokens raise ValueError."""
+        for token in ['', 'garbage', encode_page_key('notadate', 1)]:
+            try:
+                decode_page_key(token)
+            except ValueError:
+                pass
+            else:
+                assert False, token
+
+    def test_seek_through_pages(self, test_app):
+        """Check that keyset pages match offset pages, ties included."""
+        user = fixture_add_user(u'keysetuser', password=None)
+        created = datetime.datetime(2014, 1, 1)
+        for i in range(7):
+            entry = fixture_media_entry(
+                title=u'entry %d' % i, uploader=user.id,
+                state=u'processed', expunge=False)
+            # Give some entries identical timestamps to test tie breaking
+            entry.created = created + datetime.timedelta(minutes=i // 2)
+            entry.save()
+
+        cursor = MediaEntry.query.filter_by(actor=user.id)
+        expected = [entry.id for entry in cursor.order_by(
+            MediaEntry.created.desc(), MediaEntry.id.desc())]
+
+        seen = []
+        page_key = None
+        for page in range(1, 4):
+            pagination = KeysetPagination(
+                page, cursor, per_page=3, page_key=page_key)
+            ids = [entry.id for entry in pagination()]
+            assert ids == expected[(page - 1) * 3:page * 3]
+            assert pagination.has_prev == (page > 1)
+            assert pagination.has_next == (page < 3)
+            assert pagination.pages == 3
+            seen.extend(ids)
+            page_key = ('after', pagination.keys[-1])
+        assert seen == expected
+
+        # And back again from the last page
+        pagination = KeysetPagination(
+            2, cursor, per_page=3, page_key=('before', pagination.keys[0]))
+        assert [entry.id for entry in pagination()] == expected[3:6]
+
+        # Walking back from the second page lands on the first page
+        pagination = KeysetPagination(
+            1, cursor, per_page=3, page_key=('before', pagination.keys[0]))
+        assert [entry.id for entry in pagination()] == expected[:3]
+
+    def test_jump_to_id(self, test_app):
+        """Check that jump_to_id finds the right page with a count."""
+        user = fixture_add_user(u'keysetjumper', password=None)
+        for i in range(5):
+            fixture_media_entry(title=u'jump %d' % i, uploader=user.id)
+        cursor = MediaEntry.query.filter_by(actor=user.id)
+        expected = [entry.id for entry in cursor.order_by(
+            MediaEntry.created.desc(), MediaEntry.id.desc())]
+
+        pagination = KeysetPagination(1, cursor, per_page=2,
+                                      jump_to_id=expected[4])
+        assert pagination.page == 3
+        assert pagination.active_id == expected[4]
+        assert [entry.id for entry in pagination()] == [expected[4]]
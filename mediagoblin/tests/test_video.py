@@ -29,8 +29,9 @@ from gi.repository import Gst
 Gst.init(None)
 
 from mediagoblin.media_types.video.transcoders import (capture_thumb,
-        VideoTranscoder)
-from mediagoblin.media_types.video.util import ACCEPTED_RESOLUTIONS
+        VideoTranscoder, MultiResolutionTranscoder)
+from mediagoblin.media_types.video.util import ACCEPTED_RESOLUTIONS, \
+    serialize_metadata
 from mediagoblin.media_types.tools import discover
 from mediagoblin.tests.tools import get_app
 
@@ -135,6 +136,49 @@ def test_transcoder():
         assert len(discover(result_name).get_video_streams()) == 1
         assert len(discover(result_name).get_audio_streams()) == 1
 
+def test_multi_resolution_transcoder():
+    for make_audio in (False, True):
+        with create_data(make_audio=make_audio) as (video_name, result_name):
+            destinations = [
+                (resolution, ACCEPTED_RESOLUTIONS[resolution],
+                 '{0}.{1}.webm'.format(result_name, resolution))
+                for resolution in ('360p', '144p')]
+            progress = []
+            transcoder = MultiResolutionTranscoder()
+            transcoder.transcode(
+                    video_name, destinations,
+                    '360p', 2,
+                    vp8_quality=8,
+                    vp8_threads=0,  # autodetect
+                    vorbis_quality=0.3,
+                    progress_callback=lambda *args: progress.append(args))
+            for resolution, dimensions, path in destinations:
+                result = transcoder.dst_data[resolution]
+                assert len(result.get_video_streams()) == 1
+                # videotestsrc is landscape, so scaled to the width
+                assert result.get_video_streams()[0].get_width() == \
+                    dimensions[0]
+                assert len(result.get_audio_streams()) == int(make_audio)
+                os.remove(path)
+            assert sum(args[0] for args in progress) <= 100
+
+def test_discover_reuses_unchanged_files():
+    with create_data(make_audio=True) as (video_name, result_name):
+        data = discover(video_name)
+        assert discover(video_name) is data
+
+        metadata = serialize_metadata(data)
+        assert metadata['video'][0]['width'] == \
+            data.get_video_streams()[0].get_width()
+        assert len(metadata['audio']) == 1
+        assert metadata['common']['duration'] == data.get_duration()
+
+        # Changed files are discovered again
+        with open(video_name, 'ab') as video:
+            video.write(b'\0')
+        assert discover(video_name) is not data
+
+
 def test_accepted_resolutions():
     accepted_resolutions = {
         '144p': (256, 144),
@@ -14,6 +14,8 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import datetime
+
 import six
 
 from exifread import process_file
@@ -41,6 +43,19 @@ USEFUL_TAGS = [
     'EXIF UserComment',
     ]
 
+# Columns of ImageData holding the summary of its EXIF tags, see
+# summarize_exif
+EXIF_SUMMARY_FIELDS = [
+    'taken',
+    'camera_make',
+    'camera_model',
+    'lens',
+    'exposure_time',
+    'aperture',
+    'iso',
+    'focal_length',
+    ]
+
 
 def exif_image_needs_rotation(exif_tags):
     """
@@ -192,3 +207,73 @@ def get_gps_data(tags):
         pass
 
     return gps_data
+
+
+def _first_value(exif, key):
+    try:
+        values = exif[key]['values']
+    except (KeyError, TypeError):
+        return None
+    if isinstance(values, list):
+        return values[0] if values else None
+    return values
+
+
+def _number(exif, key):
+    value = _first_value(exif, key)
+    if isinstance(value, list):
+        # A ratio, see _ratio_to_list
+        if len(value) != 2 or not value[1]:
+            return None
+        return float(value[0]) / value[1]
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _text(exif, key):
+    try:
+        text = six.text_type(exif[key]['printable']).strip()
+    except (KeyError, TypeError):
+        return None
+    return text or None
+
+
+def summarize_exif(exif):
+    """
+    Pick the tags worth showing and querying from the result of
+    clean_exif, as a dict of EXIF_SUMMARY_FIELDS (None where missing).
+    """
+    taken = None
+    for key in ('EXIF DateTimeOriginal', 'Image DateTimeOriginal'):
+        try:
+            taken = datetime.datetime.strptime(
+                _text(exif, key) or '', '%Y:%m:%d %H:%M:%S')
+            break
+        except ValueError:
+            pass
+
+    iso = _number(exif, 'EXIF ISOSpeedRatings')
+
+    return {
+        'taken': taken,
+        'camera_make': _text(exif, 'Image Make'),
+        'camera_model': _text(exif, 'Image Model'),
+        'lens': _text(exif, 'EXIF LensModel'),
+        'exposure_time': _text(exif, 'EXIF ExposureTime'),
+        'aperture': _number(exif, 'EXIF FNumber'),
+        'iso': int(iso) if iso is not None else None,
+        'focal_length': _number(exif, 'EXIF FocalLength'),
+        }
+
+
+def exif_dimensions(exif):
+    """
+    The (width, height) the EXIF tags give for the image, or None
+    """
+    width = _number(exif, 'EXIF ExifImageWidth')
+    height = _number(exif, 'EXIF ExifImageLength')
+    if not width or not height:
+        return None
+    return int(width), int(height)
@@ -14,15 +14,29 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import base64
 import copy
+import datetime
+import time
 from math import ceil, floor
 from itertools import count
 from werkzeug.datastructures import MultiDict
 
 from six.moves import range, urllib, zip
+from sqlalchemy import and_, or_
+
+from mediagoblin import mg_globals
 
 PAGINATION_DEFAULT_PER_PAGE = 30
 
+# GET parameters carrying keyset positions, see KeysetPagination
+KEYSET_PARAMS = ('after', 'before')
+
+_KEY_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+# count cache key -> (expiry timestamp, count)
+_count_cache = {}
+
 
 class Pagination(object):
     """
@@ -105,6 +119,10 @@ class Pagination(object):
             new_get_params = dict(get_params) or {}
 
         new_get_params['page'] = page_no
+        # A page number alone means "use offsets", so drop any keyset
+        # position which would otherwise take precedence.
+        for param in KEYSET_PARAMS:
+            new_get_params.pop(param, None)
         return "%s?%s" % (
             base_url, urllib.parse.urlencode(new_get_params))
 
@@ -116,3 +134,276 @@ class Pagination(object):
         """
         return self.get_page_url_explicit(
             request.full_path, request.GET, page_no)
+
+    def get_prev_url_explicit(self, base_url, get_params):
+        """
+        Get the url of the previous ("newer") page
+        """
+        return self.get_page_url_explicit(base_url, get_params, self.page - 1)
+
+    def get_next_url_explicit(self, base_url, get_params):
+        """
+        Get the url of the next ("older") page
+        """
+        return self.get_page_url_explicit(base_url, get_params, self.page + 1)
+
+
+def encode_page_key(key, obj_id):
+    """
+    Encode a (key, id) position into an opaque url-safe token
+    """
+    if isinstance(key, datetime.datetime):
+        key = key.strftime(_KEY_DATETIME_FORMAT)
+    token = u'%s|%d' % (key, obj_id)
+    token = base64.urlsafe_b64encode(token.encode('utf-8'))
+    return token.decode('ascii').rstrip('=')
+
+
+def decode_page_key(token):
+    """
+    Decode a token made by encode_page_key() into a (datetime, id) tuple.
+
+    Raises ValueError if the token is malformed.
+    """
+    try:
+        token = str(token)
+        token += '=' * (-len(token) % 4)
+        token = base64.urlsafe_b64decode(token.encode('ascii'))
+        key, obj_id = token.decode('utf-8').rsplit(u'|', 1)
+        return (datetime.datetime.strptime(key, _KEY_DATETIME_FORMAT),
+                int(obj_id))
+    except (TypeError, UnicodeError, ValueError) as exc:
+        # binascii.Error is a ValueError subclass on py3
+        raise ValueError('Invalid page key: %s' % exc)
+
+
+def get_page_key(get_params):
+    """
+    Look up a keyset position in the GET parameters.
+
+    Returns None or a (direction, (key, id)) tuple where direction is
+    one of KEYSET_PARAMS.  Raises ValueError on a malformed token.
+    """
+    for direction in KEYSET_PARAMS:
+        token = get_params.get(direction)
+        if token:
+            return (direction, decode_page_key(token))
+    return None
+
+
+def cached_count(cursor, cache_key):
+    """
+    Count the rows of cursor, caching the result under cache_key.
+
+    The cache lifetime is the pagination_count_cache_time config option
+    in seconds; when it is 0 this is the same as cursor.count().
+    Counts can therefore be slightly out of date, which is fine for
+    rendering page links.
+    """
+    cache_time = mg_globals.app_config.get('pagination_count_cache_time', 0)
+    if not cache_time or cache_key is None:
+        return cursor.count()
+
+    now = time.time()
+    cached = _count_cache.get(cache_key)
+    if cached is not None and cached[0] > now:
+        return cached[1]
+
+    total = cursor.count()
+    _count_cache[cache_key] = (now + cache_time, total)
+    return total
+
+
+class KeysetPagination(Pagination):
+    """
+    Pagination which seeks on a (key, id) pair instead of using OFFSET.
+
+    Neighbouring pages are addressed with opaque "after"/"before"
+    tokens holding the position of the last/first object of the current
+    page, so fetching page N costs the same as fetching page 1 when
+    (key_column, id_column) is indexed.  Plain page numbers still work
+    and fall back to OFFSET.
+
+    The total count is only computed when a template asks for it, and
+    can be cached through count_cache_key (see cached_count()).
+    """
+
+    def __init__(self, page, cursor, per_page=PAGINATION_DEFAULT_PER_PAGE,
+                 jump_to_id=False, page_key=None, key_column=None,
+                 id_column=None, descending=True, count_cache_key=None):
+        """
+        Initializes KeysetPagination
+
+        Args:
+         - page: requested page, only used for display when page_key
+           is given
+         - cursor: db query, its ordering is replaced by
+           (key_column, id_column)
+         - per_page: number of objects per page
+         - jump_to_id: object id, sets the page to the page containing the
+           object with id == jump_to_id.
+         - page_key: None or a (direction, (key, id)) tuple as returned
+           by get_page_key()
+         - key_column: column to order by, defaults to the "created"
+           column of the queried model
+         - id_column: unique tie breaker, defaults to the "id" column
+         - descending: whether newest objects come first
+         - count_cache_key: hashable key to cache the total count under
+        """
+        model = cursor.column_descriptions[0]['entity']
+        self.page = page
+        self.per_page = per_page
+        self.cursor = cursor
+        self.page_key = page_key
+        self.key_column = key_column if key_column is not None \
+            else model.created
+        self.id_column = id_column if id_column is not None else model.id
+        self.descending = descending
+        self.count_cache_key = count_cache_key
+        self.active_id = None
+        self._total_count = None
+        self._keys = None
+
+        if jump_to_id:
+            self._jump_to(jump_to_id)
+
+    def _order(self, query, reverse=False):
+        if self.descending != reverse:
+            return query.order_by(None).order_by(
+                self.key_column.desc(), self.id_column.desc())
+        return query.order_by(None).order_by(
+            self.key_column.asc(), self.id_column.asc())
+
+    def _follows(self, position, inclusive=False):
+        """
+        Filter for objects which come after position in listing order
+        """
+        key, obj_id = position
+        if self.descending:
+            key_cmp = self.key_column < key
+            id_cmp = self.id_column <= obj_id if inclusive \
+                else self.id_column < obj_id
+        else:
+            key_cmp = self.key_column > key
+            id_cmp = self.id_column >= obj_id if inclusive \
+                else self.id_column > obj_id
+        return or_(key_cmp, and_(self.key_column == key, id_cmp))
+
+    def _precedes(self, position):
+        """
+        Filter for objects which come before position in listing order
+        """
+        key, obj_id = position
+        if self.descending:
+            return or_(self.key_column > key,
+                       and_(self.key_column == key, self.id_column > obj_id))
+        return or_(self.key_column < key,
+                   and_(self.key_column == key, self.id_column < obj_id))
+
+    def _jump_to(self, jump_to_id):
+        position = self.cursor.with_entities(
+            self.key_column, self.id_column).filter(
+                self.id_column == jump_to_id).first()
+        if position is None:
+            return
+
+        preceding = self.cursor.order_by(None).filter(
+            self._precedes(tuple(position))).count()
+        self.page = 1 + int(floor(preceding / self.per_page))
+        self.page_key = None
+        self.active_id = jump_to_id
+
+    def __call__(self):
+        """
+        Returns the objects of the requested page
+        """
+        query = self._order(self.cursor)
+
+        if self.page_key is None:
+            self._query = query.slice(
+                (self.page - 1) * self.per_page,
+                self.page * self.per_page)
+            return self._query
+
+        direction, position = self.page_key
+        if direction == 'after':
+            query = query.filter(self._follows(position))
+        else:
+            # Walk backwards to find the first object of the previous
+            # page and list forward from (and including) it.
+            start = self._order(self.cursor, reverse=True).with_entities(
+                self.key_column, self.id_column).filter(
+                    self._precedes(position)).offset(
+                        self.per_page - 1).limit(1).first()
+            if start is None:
+                self.page = 1
+            else:
+                query = query.filter(
+                    self._follows(tuple(start), inclusive=True))
+
+        self._query = query.limit(self.per_page)
+        return self._query
+
+    @property
+    def keys(self):
+        """
+        (key, id) positions of the objects on the current page
+        """
+        if self._keys is None:
+            query = getattr(self, '_query', None)
+            if query is None:
+                query = self()
+            self._keys = [tuple(key) for key in query.with_entities(
+                self.key_column, self.id_column)]
+        return self._keys
+
+    @property
+    def total_count(self):
+        if self._total_count is None:
+            self._total_count = cached_count(
+                self.cursor.order_by(None), self.count_cache_key)
+        return self._total_count
+
+    @property
+    def pages(self):
+        # The total count may be cached and slightly stale, never claim
+        # fewer pages than the ones we know to exist.
+        pages = int(ceil(self.total_count / float(self.per_page)))
+        if self.has_next:
+            return max(pages, self.page + 1)
+        return max(pages, self.page)
+
+    @property
+    def has_prev(self):
+        if not self.keys:
+            return self.page > 1
+        return self.cursor.filter(self._precedes(self.keys[0])).with_entities(
+            self.id_column).limit(1).first() is not None
+
+    @property
+    def has_next(self):
+        if not self.keys:
+            return False
+        return self.cursor.filter(self._follows(self.keys[-1])).with_entities(
+            self.id_column).limit(1).first() is not None
+
+    def _get_key_url_explicit(self, base_url, get_params, page_no,
+                              direction, position):
+        url = self.get_page_url_explicit(base_url, get_params, page_no)
+        return '%s&%s' % (url, urllib.parse.urlencode(
+            {direction: encode_page_key(*position)}))
+
+    def get_prev_url_explicit(self, base_url, get_params):
+        if not self.keys:
+            return super(KeysetPagination, self).get_prev_url_explicit(
+                base_url, get_params)
+        return self._get_key_url_explicit(
+            base_url, get_params, max(self.page - 1, 1),
+            'before', self.keys[0])
+
+    def get_next_url_explicit(self, base_url, get_params):
+        if not self.keys:
+            return super(KeysetPagination, self).get_next_url_explicit(
+                base_url, get_params)
+        return self._get_key_url_explicit(
+            base_url, get_params, self.page + 1, 'after', self.keys[-1])
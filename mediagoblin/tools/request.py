@@ -18,9 +18,12 @@ import json
 import logging
 
 import six
+from sqlalchemy.orm import joinedload, with_polymorphic
 from werkzeug.http import parse_options_header
 
+from mediagoblin.db.base import Session
 from mediagoblin.db.models import User, AccessToken
+from mediagoblin.tools.session import get_user_cache
 from mediagoblin.oauth.tools.request import decode_authorization_header
 
 _log = logging.getLogger(__name__)
@@ -52,7 +55,7 @@ def setup_user_in_request(request):
         request.user = None
         return
 
-    request.user = User.query.get(request.session['user_id'])
+    request.user = get_session_user(request.session['user_id'])
 
     if not request.user:
         # Something's wrong... this user doesn't exist?  Invalidate
@@ -60,6 +63,37 @@ def setup_user_in_request(request):
         _log.warn("Killing session for user id %r", request.session['user_id'])
         request.session.delete()
 
+def get_session_user(user_id):
+    """
+    Look up the user logged in to a session, going through the user
+    cache if there is one.
+    """
+    user_cache = get_user_cache()
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return None
+    if user_cache is None:
+        return User.query.get(user_id)
+
+    user = user_cache.get(user_id)
+    if user is None:
+        # Load everything the cached copy may need, as it can't lazy
+        # load anything once detached
+        any_user = with_polymorphic(User, '*')
+        user = Session.query(any_user).options(
+            joinedload(any_user.all_privileges)).filter(
+                any_user.id == user_id).first()
+        if user is None:
+            return None
+        for privilege in user.all_privileges:
+            Session.expunge(privilege)
+        Session.expunge(user)
+        user_cache.set(user_id, user)
+
+    return Session.merge(user, load=False)
+
+
 def decode_request(request):
     """ Decodes a request based on MIME-Type """
     data = request.data
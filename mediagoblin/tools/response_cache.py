@@ -0,0 +1,255 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+HTTP validators for rendered pages and an optional store for rendered
+responses, see mediagoblin.decorators.cache_response.
+"""
+
+import datetime
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+import pytz
+from six.moves import cPickle as pickle
+from sqlalchemy import func
+from werkzeug.http import http_date, quote_etag
+from werkzeug.wrappers import Response
+
+from mediagoblin import mg_globals
+from mediagoblin.tools import common
+
+
+_log = logging.getLogger(__name__)
+
+# The configured response cache, created on first use
+_response_cache = None
+
+
+def query_validators(query, column):
+    """
+    Return [newest value of column, number of rows] for query.
+
+    Ordering and limits are dropped, so the values change whenever a row
+    matching query is added, removed or has column bumped.
+    """
+    query = query.order_by(None).limit(None).offset(None)
+    return list(query.with_entities(func.max(column), func.count()).one())
+
+
+def get_last_modified(validators):
+    """
+    The newest datetime among validators, or None
+    """
+    dates = [value for value in validators
+             if isinstance(value, datetime.datetime)]
+    if not dates:
+        return None
+    return max(dates).replace(microsecond=0)
+
+
+def make_etag(request, validators, shared=False):
+    """
+    Hash validators together with everything else the page depends on.
+
+    Unless the response is shared by all anonymous visitors this includes
+    the user and the CSRF token, which is part of every rendered form.
+    """
+    parts = [request.url, getattr(request, 'locale', None)]
+    if not shared:
+        user = getattr(request, 'user', None)
+        parts.extend([user.id if user else None,
+                      request.environ.get('CSRF_TOKEN')])
+    parts.extend(validators)
+    return hashlib.sha1(
+        repr(parts).encode('utf-8')).hexdigest()
+
+
+def is_not_modified(request, etag, last_modified=None):
+    """
+    Whether the client's cached copy matching etag/last_modified is fresh
+    """
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+
+    since = request.if_modified_since
+    if last_modified is None or since is None:
+        return False
+    if since.tzinfo is not None:
+        since = since.astimezone(pytz.utc).replace(tzinfo=None)
+    return last_modified <= since
+
+
+def set_cache_headers(response, etag, last_modified=None, public=False):
+    """
+    Set the validators and Cache-Control on response
+    """
+    response.headers['ETag'] = quote_etag(etag)
+    if last_modified is not None:
+        response.headers['Last-Modified'] = http_date(last_modified)
+
+    if public:
+        response.headers['Cache-Control'] = 'public, max-age=%d' % (
+            mg_globals.app_config['response_cache_max_age'])
+    else:
+        # Let the browser keep it, but have it ask us every time
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def not_modified_response(etag, last_modified=None, public=False):
+    return set_cache_headers(
+        Response(status=304), etag, last_modified, public)
+
+
+class BaseResponseCache(object):
+    """
+    Interface of the response cache backends.
+
+    Entries are (status, headers, body) tuples.  Keys include the ETag of
+    the response, so entries never go stale; clear() only exists to let
+    go of entries that can't be requested any longer.
+    """
+
+    def __init__(self, **kwargs):
+        pass
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class MemoryResponseCache(BaseResponseCache):
+    """
+    Least recently used cache in the memory of this process
+    """
+
+    def __init__(self, size=256, **kwargs):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                value = self._entries.pop(key)
+            except KeyError:
+                return None
+            self._entries[key] = value
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class FileSystemResponseCache(BaseResponseCache):
+    """
+    Cache in a directory, shared by all processes using it
+    """
+
+    def __init__(self, directory=None, **kwargs):
+        self.directory = directory
+
+    def _path(self, key):
+        return os.path.join(
+            self.directory,
+            hashlib.sha1(repr(key).encode('utf-8')).hexdigest())
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as cache_file:
+                stored_key, value = pickle.load(cache_file)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return None
+        if stored_key != key:
+            return None
+        return value
+
+    def set(self, key, value):
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+        # Write to a temporary file first so readers never see half an entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, 'wb') as cache_file:
+            pickle.dump((key, value), cache_file, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, self._path(key))
+
+    def clear(self):
+        if not os.path.exists(self.directory):
+            return
+        for filename in os.listdir(self.directory):
+            try:
+                os.remove(os.path.join(self.directory, filename))
+            except OSError:
+                # Removed by another process in the meantime
+                pass
+
+
+def get_response_cache():
+    """
+    The response cache configured in response_cache, or None
+    """
+    global _response_cache
+    cache_class = (mg_globals.app_config or {}).get('response_cache')
+    if not cache_class:
+        return None
+
+    if _response_cache is None:
+        _response_cache = common.import_component(cache_class)(
+            size=mg_globals.app_config['response_cache_size'],
+            directory=mg_globals.app_config['response_cache_dir'])
+    return _response_cache
+
+
+def invalidate_response_cache():
+    """
+    Drop all stored responses, called when media is saved or deleted
+    """
+    cache = get_response_cache()
+    if cache is not None:
+        cache.clear()
+
+
+def get_cached_response(cache, key):
+    stored = cache.get(key)
+    if stored is None:
+        return None
+    status, headers, body = stored
+    return Response(body, status=status, headers=headers)
+
+
+def store_response(cache, key, response):
+    headers = [(name, value) for name, value in response.headers
+               if name.lower() != 'set-cookie']
+    cache.set(key, (response.status_code, headers, response.get_data()))
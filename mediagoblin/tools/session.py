@@ -14,18 +14,34 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import base64
+import datetime
 import itsdangerous
+import json
 import logging
+import os
+import threading
+import time
 
-from mediagoblin.tools import crypto
+import six
+
+from mediagoblin import mg_globals
+from mediagoblin.tools import common, crypto
 
 _log = logging.getLogger(__name__)
 
 MAX_AGE = 30 * 24 * 60 * 60
 
+# The configured user cache, created on first use
+_user_cache = None
+
+
 class Session(dict):
     def __init__(self, *args, **kwargs):
         self.send_new_cookie = False
+        # Only set for sessions kept in a session store
+        self.session_id = None
+        self.loaded_user_id = None
         dict.__init__(self, *args, **kwargs)
 
     def save(self):
@@ -39,17 +55,195 @@ class Session(dict):
         self.save()
 
 
+def new_session_id():
+    """
+    A random, url safe id for a stored session
+    """
+    return six.text_type(
+        base64.urlsafe_b64encode(os.urandom(24)).decode('ascii'))
+
+
+class BaseSessionStore(object):
+    """
+    Interface of the server side session backends.
+
+    Sessions are JSON serializable dicts, stored under their id together
+    with the id of the logged in user (so they can be revoked per user)
+    and the time they expire.
+    """
+
+    def __init__(self, **kwargs):
+        pass
+
+    def load(self, session_id):
+        """
+        The session data stored as session_id, or None
+        """
+        raise NotImplementedError
+
+    def save(self, session_id, data, user_id, expires):
+        raise NotImplementedError
+
+    def delete(self, session_id):
+        raise NotImplementedError
+
+    def delete_user_sessions(self, user_id):
+        """
+        Revoke all sessions of the user with user_id
+        """
+        raise NotImplementedError
+
+    def delete_all(self):
+        """
+        Revoke all sessions, logging everybody out
+        """
+        raise NotImplementedError
+
+    def delete_expired(self):
+        raise NotImplementedError
+
+
+class MemorySessionStore(BaseSessionStore):
+    """
+    Sessions in the memory of this process.
+
+    Only useful when a single process serves all requests, and sessions
+    are lost on restart.
+    """
+
+    def __init__(self, **kwargs):
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def load(self, session_id):
+        with self._lock:
+            stored = self._sessions.get(session_id)
+        if stored is None:
+            return None
+        data, user_id, expires = stored
+        if expires <= datetime.datetime.utcnow():
+            return None
+        return json.loads(data)
+
+    def save(self, session_id, data, user_id, expires):
+        with self._lock:
+            self._sessions[session_id] = (json.dumps(data), user_id, expires)
+
+    def delete(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def _delete_where(self, matches):
+        with self._lock:
+            for session_id, stored in list(self._sessions.items()):
+                if matches(*stored):
+                    del self._sessions[session_id]
+
+    def delete_user_sessions(self, user_id):
+        self._delete_where(lambda data, stored_user_id, expires:
+                           stored_user_id == user_id)
+
+    def delete_all(self):
+        with self._lock:
+            self._sessions.clear()
+
+    def delete_expired(self):
+        now = datetime.datetime.utcnow()
+        self._delete_where(lambda data, user_id, expires: expires <= now)
+
+
+class SQLSessionStore(BaseSessionStore):
+    """
+    Sessions in the core__sessions table, shared by all processes.
+
+    Sessions are saved after the view has run, so this uses its own
+    connection rather than committing whatever the view left in the
+    database session.
+    """
+
+    @property
+    def _table(self):
+        # TODO: import here due to cyclic imports
+        from mediagoblin.db.models import StoredSession
+        return StoredSession.__table__
+
+    def _engine(self):
+        from mediagoblin.db.base import Session as DBSession
+        return DBSession.get_bind()
+
+    def load(self, session_id):
+        table = self._table
+        with self._engine().connect() as connection:
+            data = connection.execute(
+                table.select()
+                .with_only_columns([table.c.data])
+                .where(table.c.id == session_id)
+                .where(table.c.expires > datetime.datetime.utcnow())
+            ).scalar()
+        return data
+
+    def save(self, session_id, data, user_id, expires):
+        table = self._table
+        with self._engine().begin() as connection:
+            connection.execute(table.delete().where(table.c.id == session_id))
+            connection.execute(table.insert().values(
+                id=session_id, data=data, user_id=user_id, expires=expires))
+
+    def _delete_where(self, *criteria):
+        table = self._table
+        statement = table.delete()
+        for criterion in criteria:
+            statement = statement.where(criterion)
+        with self._engine().begin() as connection:
+            connection.execute(statement)
+
+    def delete(self, session_id):
+        self._delete_where(self._table.c.id == session_id)
+
+    def delete_user_sessions(self, user_id):
+        self._delete_where(self._table.c.user_id == user_id)
+
+    def delete_all(self):
+        self._delete_where()
+
+    def delete_expired(self):
+        self._delete_where(
+            self._table.c.expires <= datetime.datetime.utcnow())
+
+
+def get_session_store(app_config):
+    """
+    The session store configured in session_store, or None to keep
+    sessions in signed cookies
+    """
+    store_class = app_config.get('session_store')
+    if not store_class:
+        return None
+    return common.import_component(store_class)()
+
+
+def _session_user_id(session):
+    try:
+        return int(session.get('user_id'))
+    except (TypeError, ValueError):
+        return None
+
+
 class SessionManager(object):
-    def __init__(self, cookie_name='MGSession', namespace=None):
+    def __init__(self, cookie_name='MGSession', namespace=None, store=None):
         if namespace is None:
             namespace = cookie_name
         self.signer = crypto.get_timed_signer_url(namespace)
         self.cookie_name = cookie_name
+        # Keep sessions here and only their id in the cookie
+        self.store = store
 
     def load_session_from_cookie(self, request):
         cookie = request.cookies.get(self.cookie_name)
         if not cookie:
             return Session()
+        if self.store is not None:
+            return self.load_stored_session(cookie)
         ### FIXME: Future cookie-blacklisting code
         # m = BadCookie.query.filter_by(cookie = cookie)
         # if m:
@@ -60,10 +254,39 @@ class SessionManager(object):
         except itsdangerous.BadData:
             return Session()
 
+    def load_stored_session(self, session_id):
+        data = self.store.load(session_id)
+        if data is None:
+            return Session()
+        session = Session(data)
+        session.session_id = session_id
+        session.loaded_user_id = _session_user_id(session)
+        return session
+
+    def save_stored_session(self, session):
+        """
+        Save session in the store and return its (possibly new) id
+        """
+        user_id = _session_user_id(session)
+        if session.session_id is None or user_id != session.loaded_user_id:
+            # A new id whenever somebody logs in or out, so an id known
+            # before can't be used to take over the session
+            if session.session_id is not None:
+                self.store.delete(session.session_id)
+            session.session_id = new_session_id()
+            session.loaded_user_id = user_id
+
+        self.store.save(
+            session.session_id, dict(session), user_id,
+            datetime.datetime.utcnow() + datetime.timedelta(seconds=MAX_AGE))
+        return session.session_id
+
     def save_session_to_cookie(self, session, request, response):
         if not session.is_updated():
             return
         elif not session:
+            if self.store is not None and session.session_id is not None:
+                self.store.delete(session.session_id)
             response.delete_cookie(self.cookie_name)
         else:
             if session.get('stay_logged_in', False):
@@ -71,5 +294,68 @@ class SessionManager(object):
             else:
                 max_age = None
 
-            response.set_cookie(self.cookie_name, self.signer.dumps(session),
+            if self.store is not None:
+                cookie = self.save_stored_session(session)
+            else:
+                cookie = self.signer.dumps(session)
+
+            response.set_cookie(self.cookie_name, cookie,
                 max_age=max_age, httponly=True)
+
+
+class UserCache(object):
+    """
+    Users of sessions kept in memory for cache_time seconds, so they
+    (and their privileges) need not be looked up on every request.
+
+    The users are detached from any database session; use
+    mediagoblin.db.base.Session.merge(user, load=False) to get a copy
+    for the current one.
+    """
+
+    def __init__(self, cache_time):
+        self.cache_time = cache_time
+        self._users = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            cached = self._users.get(user_id)
+        if cached is None or cached[0] <= time.time():
+            return None
+        return cached[1]
+
+    def set(self, user_id, user):
+        with self._lock:
+            self._users[user_id] = (time.time() + self.cache_time, user)
+
+    def invalidate(self, user_id=None):
+        with self._lock:
+            if user_id is None:
+                self._users.clear()
+            else:
+                self._users.pop(user_id, None)
+
+
+def get_user_cache():
+    """
+    The user cache if user_cache_time is set, or None
+    """
+    global _user_cache
+    cache_time = (mg_globals.app_config or {}).get('user_cache_time')
+    if not cache_time:
+        return None
+
+    if _user_cache is None:
+        _user_cache = UserCache(cache_time)
+    return _user_cache
+
+
+def invalidate_cached_user(user_id=None):
+    """
+    Forget the cached user with user_id (or all of them), called when
+    users are saved or deleted
+    """
+    user_cache = get_user_cache()
+    if user_cache is not None:
+        user_cache.invalidate(user_id)
@@ -61,6 +61,7 @@ def get_jinja_env(app, template_loader, locale):
     template_env = jinja2.Environment(
         loader=template_loader, autoescape=True,
         undefined=jinja2.StrictUndefined,
+        bytecode_cache=getattr(app, 'template_bytecode_cache', None),
         extensions=[
             'jinja2.ext.i18n', 'jinja2.ext.autoescape',
             TemplateHookExtension] + local_exts)
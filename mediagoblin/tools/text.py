@@ -15,6 +15,8 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import collections
+import hashlib
+import threading
 import wtforms
 import markdown
 from lxml.html.clean import Cleaner
@@ -24,7 +26,7 @@ from mediagoblin.tools import url
 
 
 # A super strict version of the lxml.html cleaner class
-HTML_CLEANER = Cleaner(
+HTML_CLEANER_SETTINGS = dict(
     scripts=True,
     javascript=True,
     comments=True,
@@ -44,6 +46,29 @@ HTML_CLEANER = Cleaner(
     add_nofollow=True,  # for now
     host_whitelist=(),
     whitelist_tags=set([]))
+HTML_CLEANER = Cleaner(**HTML_CLEANER_SETTINGS)
+
+# Bump this when cleaned_markdown_conversion changes in a way
+# MARKDOWN_RENDERER can't tell, to render stored HTML again
+MARKDOWN_RENDERER_VERSION = 1
+
+
+def _markdown_renderer_key():
+    settings = sorted(
+        (name, sorted(value) if isinstance(value, (set, frozenset)) else value)
+        for name, value in HTML_CLEANER_SETTINGS.items())
+    key = repr([MARKDOWN_RENDERER_VERSION,
+                getattr(markdown, '__version__',
+                        getattr(markdown, 'version', None)),
+                settings])
+    return u'{0}-{1}'.format(
+        MARKDOWN_RENDERER_VERSION,
+        hashlib.sha1(key.encode('utf-8')).hexdigest()[:16])
+
+
+# Identifies the way cleaned_markdown_conversion renders, stored with the
+# HTML it rendered (see mediagoblin.db.mixin.RenderedMarkdownMixin)
+MARKDOWN_RENDERER = _markdown_renderer_key()
 
 
 def clean_html(html):
@@ -108,8 +133,17 @@ def tag_length_validator(form, field):
 
 
 # Don't use the safe mode, because lxml.html.clean is better and we are using
-# it anyway
-UNSAFE_MARKDOWN_INSTANCE = markdown.Markdown()
+# it anyway.  Markdown instances keep state while converting, so every
+# thread gets its own.
+_markdown = threading.local()
+
+
+def get_markdown_instance():
+    try:
+        return _markdown.instance
+    except AttributeError:
+        _markdown.instance = markdown.Markdown()
+        return _markdown.instance
 
 
 def cleaned_markdown_conversion(text):
@@ -121,4 +155,4 @@ def cleaned_markdown_conversion(text):
     if not text:
         return u''
 
-    return clean_html(UNSAFE_MARKDOWN_INSTANCE.convert(text))
+    return clean_html(get_markdown_instance().convert(text))
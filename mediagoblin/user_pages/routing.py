@@ -101,6 +101,10 @@ add_route('mediagoblin.user_pages.processing_panel',
           '/u/<string:user>/panel/<any(processed, processing, failed):state>/',
           'mediagoblin.user_pages.views:processing_panel')
 
+add_route('mediagoblin.user_pages.processing_progress',
+          '/u/<string:user>/panel/progress/',
+          'mediagoblin.user_pages.views:processing_progress')
+
 
 # Stray edit routes
 add_route('mediagoblin.edit.edit_media',
@@ -19,17 +19,19 @@ import datetime
 import json
 
 import six
+from sqlalchemy.orm import aliased, joinedload
 
 from mediagoblin import messages, mg_globals
 from mediagoblin.db.models import (MediaEntry, MediaTag, Collection, Comment,
                                    CollectionItem, LocalUser, Activity, \
-                                   GenericModelReference)
+                                   GenericModelReference, TextComment)
 from mediagoblin.plugins.api.tools import get_media_file_paths
 from mediagoblin.tools.response import render_to_response, render_404, \
-    redirect, redirect_obj
+    redirect, redirect_obj, json_response
 from mediagoblin.tools.text import cleaned_markdown_conversion
 from mediagoblin.tools.translate import pass_to_ugettext as _
-from mediagoblin.tools.pagination import Pagination
+from mediagoblin.tools.pagination import Pagination, KeysetPagination
+from mediagoblin.tools.response_cache import query_validators
 from mediagoblin.tools.federation import create_activity
 from mediagoblin.user_pages import forms as user_forms
 from mediagoblin.user_pages.lib import (send_comment_email,
@@ -42,7 +44,7 @@ from mediagoblin.decorators import (uses_pagination, get_user_media_entry,
     get_media_entry_by_id, user_has_privilege, user_not_banned,
     require_active_login, user_may_delete_media, user_may_alter_collection,
     get_user_collection, get_user_collection_item, active_user_from_url,
-    get_optional_media_comment_by_id, allow_reporting)
+    get_optional_media_comment_by_id, allow_reporting, cache_response)
 
 from werkzeug.contrib.atom import AtomFeed
 from werkzeug.exceptions import MethodNotAllowed
@@ -65,10 +67,12 @@ def user_home(request, page):
             'mediagoblin/user_pages/user_nonactive.html',
             {'user': user})
 
-    cursor = MediaEntry.query.\
+    cursor = MediaEntry.for_listing().\
         filter_by(actor = user.id).order_by(MediaEntry.created.desc())
 
-    pagination = Pagination(page, cursor)
+    pagination = KeysetPagination(
+        page, cursor, page_key=request.page_key,
+        count_cache_key=('user_home', user.id))
     media_entries = pagination()
 
     # if no data is available, return NotFound
@@ -93,7 +97,7 @@ def user_home(request, page):
 def user_gallery(request, page, url_user=None):
     """'Gallery' of a LocalUser()"""
     tag = request.matchdict.get('tag', None)
-    cursor = MediaEntry.query.filter_by(
+    cursor = MediaEntry.for_listing().filter_by(
         actor=url_user.id,
         state=u'processed').order_by(MediaEntry.created.desc())
 
@@ -104,7 +108,9 @@ def user_gallery(request, page, url_user=None):
                 MediaTag.slug == request.matchdict['tag']))
 
     # Paginate gallery
-    pagination = Pagination(page, cursor)
+    pagination = KeysetPagination(
+        page, cursor, page_key=request.page_key,
+        count_cache_key=('user_gallery', url_user.id, tag))
     media_entries = pagination()
 
     #if no data is available, return NotFound
@@ -122,9 +128,35 @@ def user_gallery(request, page, url_user=None):
 
 MEDIA_COMMENTS_PER_PAGE = 50
 
+
+def _media_home_validators(request, media, page, **kwargs):
+    collection_items = CollectionItem.query.join(
+        CollectionItem.object_helper).filter(
+            GenericModelReference.model_type == media.__tablename__,
+            GenericModelReference.obj_pk == media.id)
+
+    # The comments themselves, which are edited in place
+    target_ref = aliased(GenericModelReference)
+    comment_ref = aliased(GenericModelReference)
+    comments = TextComment.query.join(
+        comment_ref,
+        (comment_ref.model_type == TextComment.__tablename__)
+        & (comment_ref.obj_pk == TextComment.id)).join(
+            Comment, Comment.comment_id == comment_ref.id).join(
+                target_ref, Comment.target_id == target_ref.id).filter(
+                    target_ref.model_type == media.__tablename__,
+                    target_ref.obj_pk == media.id)
+
+    return ([media.id, media.updated]
+            + query_validators(media.get_comments(), Comment.added)
+            + query_validators(comments, TextComment.updated)
+            + query_validators(collection_items, CollectionItem.added))
+
+
 @user_not_banned
 @get_user_media_entry
 @uses_pagination
+@cache_response(_media_home_validators)
 def media_home(request, media, page, **kwargs):
     """
     'Homepage' of a MediaEntry()
@@ -134,16 +166,13 @@ def media_home(request, media, page, **kwargs):
         if request.user:
             mark_comment_notification_seen(comment_id, request.user)
 
-        pagination = Pagination(
-            page, media.get_comments(
-                mg_globals.app_config['comments_ascending']),
-            MEDIA_COMMENTS_PER_PAGE,
-            comment_id)
-    else:
-        pagination = Pagination(
-            page, media.get_comments(
-                mg_globals.app_config['comments_ascending']),
-            MEDIA_COMMENTS_PER_PAGE)
+    ascending = mg_globals.app_config['comments_ascending']
+    pagination = KeysetPagination(
+        page, media.get_comments(ascending),
+        MEDIA_COMMENTS_PER_PAGE, comment_id,
+        page_key=request.page_key,
+        key_column=Comment.added,
+        descending=not ascending)
 
     comments = pagination()
 
@@ -410,6 +439,11 @@ def user_collection(request, page, url_user=None):
     if collection_items == None:
         return render_404(request)
 
+    # The template gets the objects through these items' references
+    collection_items = list(collection_items)
+    GenericModelReference.load_objects(
+        [item.object_helper for item in collection_items])
+
     return render_to_response(
         request,
         'mediagoblin/user_pages/collection.html',
@@ -538,18 +572,36 @@ def collection_confirm_delete(request, collection):
 ATOM_DEFAULT_NR_OF_UPDATED_ITEMS = 15
 
 
+def _get_feed_user(request):
+    user = LocalUser.query.filter_by(
+        username = request.matchdict['user']).first()
+    if not user or not user.has_privilege(u'active'):
+        return None
+    return user
+
+
+def _atom_feed_validators(request):
+    user = _get_feed_user(request)
+    if not user:
+        return None
+    return query_validators(
+        MediaEntry.query.filter_by(actor=user.id, state=u'processed'),
+        MediaEntry.updated)
+
+
+@cache_response(_atom_feed_validators, shared=True)
 def atom_feed(request):
     """
     generates the atom feed with the newest images
     """
-    user = LocalUser.query.filter_by(
-        username = request.matchdict['user']).first()
-    if not user or not user.has_privilege(u'active'):
+    user = _get_feed_user(request)
+    if not user:
         return render_404(request)
     feed_title = "MediaGoblin Feed for user '%s'" % request.matchdict['user']
     link = request.urlgen('mediagoblin.user_pages.user_home',
                           qualified=True, user=request.matchdict['user'])
-    cursor = MediaEntry.query.filter_by(actor=user.id, state=u'processed')
+    cursor = MediaEntry.for_listing().filter_by(
+        actor=user.id, state=u'processed')
     cursor = cursor.order_by(MediaEntry.created.desc())
     cursor = cursor.limit(ATOM_DEFAULT_NR_OF_UPDATED_ITEMS)
 
@@ -608,25 +660,52 @@ def atom_feed(request):
     return feed.get_response()
 
 
+def _get_feed_collection(request):
+    user = _get_feed_user(request)
+    if not user:
+        return None
+    return Collection.query.filter_by(
+               actor=user.id,
+               slug=request.matchdict['collection']).first()
+
+
+def _collection_atom_feed_validators(request):
+    collection = _get_feed_collection(request)
+    if not collection:
+        return None
+    media_items = MediaEntry.query.join(
+        GenericModelReference,
+        (GenericModelReference.model_type == MediaEntry.__tablename__)
+        & (GenericModelReference.obj_pk == MediaEntry.id)).join(
+            CollectionItem,
+            CollectionItem.object_id == GenericModelReference.id).filter(
+                CollectionItem.collection == collection.id)
+
+    return ([collection.id, collection.slug, collection.title,
+             collection.description]
+            + query_validators(
+                CollectionItem.query.filter_by(collection=collection.id),
+                CollectionItem.added)
+            + query_validators(media_items, MediaEntry.updated))
+
+
+@cache_response(_collection_atom_feed_validators, shared=True)
 def collection_atom_feed(request):
     """
     generates the atom feed with the newest images from a collection
     """
-    user = LocalUser.query.filter_by(
-        username = request.matchdict['user']).first()
-    if not user or not user.has_privilege(u'active'):
-        return render_404(request)
-
-    collection = Collection.query.filter_by(
-               actor=user.id,
-               slug=request.matchdict['collection']).first()
+    collection = _get_feed_collection(request)
     if not collection:
         return render_404(request)
 
     cursor = CollectionItem.query.filter_by(
                  collection=collection.id) \
+                 .options(joinedload(CollectionItem.object_helper)) \
                  .order_by(CollectionItem.added.desc()) \
                  .limit(ATOM_DEFAULT_NR_OF_UPDATED_ITEMS)
+    cursor = cursor.all()
+    GenericModelReference.load_objects(
+        [item.object_helper for item in cursor])
 
     """
     ATOM feed id is a tag URI (see http://en.wikipedia.org/wiki/Tag_URI)
@@ -719,6 +798,31 @@ def processing_panel(request, page, url_user):
          'entries': entries_on_a_page,
          'pagination': pagination})
 
+@active_user_from_url
+@require_active_login
+def processing_progress(request, url_user):
+    """
+    The transcoding progress of the user's media in processing, as JSON,
+    for the processing panel to poll
+    """
+    if not (url_user.id == request.user.id
+            or request.user.has_privilege(u'admin')):
+        return render_404(request)
+
+    # Only the few columns needed, not whole entries
+    entries = MediaEntry.query.filter_by(
+        actor=url_user.id, state=u'processing').with_entities(
+            MediaEntry.id, MediaEntry.transcoding_progress,
+            MediaEntry.main_transcoding_progress)
+
+    return json_response(dict(
+        (six.text_type(entry_id), {
+            'transcoding_progress': transcoding_progress,
+            'main_transcoding_progress': main_transcoding_progress})
+        for entry_id, transcoding_progress, main_transcoding_progress
+        in entries))
+
+
 @allow_reporting
 @get_user_media_entry
 @user_has_privilege(u'reporter')
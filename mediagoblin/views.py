@@ -16,7 +16,7 @@
 
 from mediagoblin import mg_globals
 from mediagoblin.db.models import MediaEntry
-from mediagoblin.tools.pagination import Pagination
+from mediagoblin.tools.pagination import KeysetPagination
 from mediagoblin.tools.pluginapi import hook_handle
 from mediagoblin.tools.response import render_to_response, render_404
 from mediagoblin.decorators import uses_pagination, user_not_banned
@@ -25,10 +25,12 @@ from mediagoblin.decorators import uses_pagination, user_not_banned
 @user_not_banned
 @uses_pagination
 def default_root_view(request, page):
-    cursor = request.db.query(MediaEntry).filter_by(state=u'processed').\
-        order_by(MediaEntry.created.desc())
+    cursor = MediaEntry.for_listing(request.db.query(MediaEntry)).\
+        filter_by(state=u'processed').order_by(MediaEntry.created.desc())
 
-    pagination = Pagination(page, cursor)
+    pagination = KeysetPagination(
+        page, cursor, page_key=request.page_key,
+        count_cache_key=('default_root_view',))
     media_entries = pagination()
     return render_to_response(
         request, 'mediagoblin/root.html',